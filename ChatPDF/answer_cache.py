@@ -0,0 +1,151 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from bm25_index import tokenize
+from embedding_cache import normalize_text
+
+
+def _exact_terms(text):
+    '''必须完全一致的词：含数字的型号、版本号与数值（如 7b、70b、llama-2、2.0）'''
+    return frozenset(token for token in tokenize(text) if any(ch.isdigit() for ch in token))
+
+
+class AnswerCache:
+    def __init__(self, embedding_fn=None, similarity_threshold=0.97, max_entries=1000, ttl=3600):
+        """
+        RAG 回答缓存，分两层：
+        1. 精确匹配：归一化后的问题完全相同；
+        2. 语义匹配：问题向量与某个已缓存问题的余弦相似度不低于 similarity_threshold，
+           且两个问题中的数字、型号与版本号（如 7B 与 70B）完全相同。只差一个数字的问题向量几乎相同，
+           但答案不同，不能共用。
+
+        缓存按命名空间隔离，命名空间由检索范围的版本号、模型、Prompt 模板等组成（见 make_namespace），
+        检索范围（如用户会话）内有新写入时版本号变化，旧命名空间下的条目不再命中并会被清理；
+        其他会话的写入不影响本会话的条目。
+        条目超过 ttl 秒过期，超过 max_entries 时按 LRU 淘汰。
+
+        参数:
+        embedding_fn: 函数，计算问题向量；为空时只启用精确匹配。
+            建议传入带 EmbeddingCache 的函数，与检索共用问题向量。
+        similarity_threshold: 浮点数，语义匹配的余弦相似度阈值。
+        max_entries: 整数，最大缓存条目数。
+        ttl: 秒数，条目有效期，None 表示不过期。
+        """
+        self.embedding_fn = embedding_fn
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # (namespace, 归一化问题) -> (结果, 单位化的问题向量, 过期时间)
+        self._entries = OrderedDict()
+        # namespace -> (keys, 向量矩阵, 各条目的 _exact_terms)，语义匹配时使用，条目变化后重建
+        self._matrices = {}
+
+    @staticmethod
+    def make_namespace(collection_version, model, prompt_template, source=None, scope=None):
+        '''
+        生成命名空间：内容版本、模型、Prompt 模板与检索范围相同的问题才能共用回答。
+
+        collection_version: 检索范围的内容版本号（MyVectorDBConnector.namespace_version）
+        scope: 检索所在的命名空间（如用户会话），不同会话的回答互不共用
+        '''
+        template_hash = hashlib.sha256(prompt_template.encode('utf-8')).hexdigest()[:16]
+        return (collection_version, model, template_hash, source, scope)
+
+    def _embed(self, query):
+        vector = np.asarray(self.embedding_fn([query])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _matrix(self, namespace):
+        '''返回命名空间下所有条目的 (keys, 向量矩阵, 必须一致的词)，需持有锁'''
+        cached = self._matrices.get(namespace)
+        if cached is None:
+            keys = [k for k, (_, vector, _) in self._entries.items()
+                    if k[0] == namespace and vector is not None]
+            matrix = np.stack([self._entries[k][1] for k in keys]) if keys else None
+            cached = self._matrices[namespace] = (keys, matrix, [_exact_terms(k[1]) for k in keys])
+        return cached
+
+    def _drop(self, key):
+        '''删除条目，需持有锁'''
+        del self._entries[key]
+        self._matrices.pop(key[0], None)
+
+    def _purge(self, namespace):
+        '''清理过期条目与旧版本集合的条目，需持有锁'''
+        now = time.time()
+        for key, (_, _, expires) in list(self._entries.items()):
+            stale_version = key[0][1:] == namespace[1:] and key[0][0] != namespace[0]
+            if (expires is not None and expires < now) or stale_version:
+                self._drop(key)
+
+    def lookup(self, query, namespace):
+        '''查询缓存，命中时返回缓存的结果，否则返回 None'''
+        key = (namespace, normalize_text(query))
+        with self._lock:
+            self._purge(namespace)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[0]
+            has_candidates = self.embedding_fn is not None and any(
+                k[0] == namespace for k in self._entries)
+
+        if has_candidates:
+            vector = self._embed(query)
+            terms = _exact_terms(query)
+            with self._lock:
+                keys, matrix, entry_terms = self._matrix(namespace)
+                if matrix is not None:
+                    scores = matrix @ vector
+                    # 数字或型号不同的条目不参与匹配
+                    scores[[i for i, t in enumerate(entry_terms) if t != terms]] = -np.inf
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.similarity_threshold and keys[best] in self._entries:
+                        self._entries.move_to_end(keys[best])
+                        self.similar_hits += 1
+                        return self._entries[keys[best]][0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, query, namespace, result):
+        '''写入缓存'''
+        vector = self._embed(query) if self.embedding_fn is not None else None
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        key = (namespace, normalize_text(query))
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (result, vector, expires)
+            self._matrices.pop(namespace, None)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self):
+        '''清空缓存'''
+        with self._lock:
+            self._entries.clear()
+            self._matrices.clear()
+
+    def stats(self):
+        '''返回命中统计'''
+        hits = self.exact_hits + self.similar_hits
+        total = hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
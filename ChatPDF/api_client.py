@@ -0,0 +1,94 @@
+import json
+import os
+
+import httpx
+
+
+class APIClient:
+    def __init__(self, base_url, timeout=300.0, ingest_concurrency=2, query_concurrency=16):
+        """
+        api_server 的同步客户端，方法与 rag_service.RAGService 相同，
+        Gradio 界面可以不加修改地在本地核心与远程服务之间切换。
+
+        参数:
+        base_url: 字符串，服务地址，如 http://127.0.0.1:8000。
+        timeout: 秒数，单个请求的超时时间（导入大文档与批量问答耗时较长）。
+        ingest_concurrency / query_concurrency: 整数，界面侧的并发上限，与服务端的设置保持一致即可。
+        """
+        self.base_url = base_url.rstrip('/')
+        self.ingest_concurrency = ingest_concurrency
+        self.query_concurrency = query_concurrency
+        # 连接池在所有会话间共用
+        self._client = httpx.Client(base_url=self.base_url, timeout=timeout,
+                                    limits=httpx.Limits(max_connections=query_concurrency + ingest_concurrency))
+
+    def _json(self, response):
+        response.raise_for_status()
+        return response.json()
+
+    def ingest(self, filename, source=None, namespace=None, progress=None):
+        '''上传并导入 PDF 文件，返回导入统计；服务端一次性返回结果，progress 不会被调用'''
+        source = source or os.path.basename(filename)
+        data = {"namespace": namespace} if namespace is not None else {}
+        with open(filename, 'rb') as f:
+            return self._json(self._client.post(
+                "/v1/documents", files={"file": (source, f, "application/pdf")}, data=data))
+
+    def submit_ingest(self, filename, source=None, namespace=None):
+        '''上传文件并提交后台导入任务，立即返回任务状态'''
+        source = source or os.path.basename(filename)
+        data = {"namespace": namespace} if namespace is not None else {}
+        with open(filename, 'rb') as f:
+            return self._json(self._client.post(
+                "/v1/jobs", files={"file": (source, f, "application/pdf")}, data=data))
+
+    def job_status(self, job_id):
+        response = self._client.get(f"/v1/jobs/{job_id}")
+        if response.status_code == 404:
+            return None
+        return self._json(response)
+
+    def document_count(self, namespace=None):
+        if namespace is None:
+            return self.health()["documents"]
+        return self._json(self._client.get(f"/v1/namespaces/{namespace}"))["documents"]
+
+    def has_documents(self, namespace=None):
+        if namespace is None:
+            return self.health()["documents"] > 0
+        return self._json(self._client.get(
+            f"/v1/namespaces/{namespace}", params={"count": "false"}))["has_documents"]
+
+    def query(self, question, source=None, namespace=None):
+        return self._json(self._client.post(
+            "/v1/query", json={"question": question, "source": source, "namespace": namespace}))
+
+    def query_batch(self, questions, source=None, namespace=None):
+        return self._json(self._client.post(
+            "/v1/query/batch", json={"questions": list(questions), "source": source, "namespace": namespace}))["answers"]
+
+    def query_stream(self, question, source=None, namespace=None):
+        '''逐个 yield 事件字典，格式见 RAGService.query_stream'''
+        payload = {"question": question, "source": source, "namespace": namespace}
+        with self._client.stream("POST", "/v1/query/stream", json=payload) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def delete_namespace(self, namespace):
+        self._json(self._client.delete(f"/v1/namespaces/{namespace}"))
+
+    def health(self):
+        return self._json(self._client.get("/healthz"))
+
+    def metrics(self):
+        return self._json(self._client.get("/metrics"))
+
+    def prometheus_metrics(self):
+        response = self._client.get("/metrics/prometheus")
+        response.raise_for_status()
+        return response.text
+
+    def close(self):
+        self._client.close()
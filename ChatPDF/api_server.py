@@ -0,0 +1,262 @@
+'''
+问答服务的 HTTP 接口（ASGI，基于 FastAPI），与 Gradio 界面共用 rag_service 中的核心，可部署在负载均衡之后，
+也可供其他服务调用。
+
+用法（在 ChatPDF 目录下）:
+    python api_server.py --port 8000 --threads 40
+    CHATPDF_API_URL=http://127.0.0.1:8000 python app.py    # Gradio 界面作为本服务的客户端
+
+接口:
+    POST   /v1/documents            上传 PDF（multipart，字段 file 与可选的 namespace），导入完成后返回导入统计
+    POST   /v1/jobs                 参数同上，提交后台导入任务，立即返回任务状态
+    GET    /v1/jobs/{id}            查询导入任务的状态与进度
+    GET    /v1/namespaces/{ns}      命名空间中的片段数（?count=false 时只返回是否有文档）
+    DELETE /v1/namespaces/{ns}      删除命名空间下的全部片段
+    POST   /v1/query                {"question", "namespace", "source"}，返回回答与参考片段
+    POST   /v1/query/stream         参数同上，以 NDJSON 逐行返回 references 与 token 事件
+    POST   /v1/query/batch          {"questions": [...], "namespace", "source"}，批量回答，检索合并为一次
+    GET    /healthz                 健康检查
+    GET    /metrics                 各组件与各接口的统计
+    GET    /metrics/prometheus      Prometheus 文本格式的指标，包括各阶段的耗时直方图（TRACING=1 时记录）
+
+检索、生成与导入都是阻塞调用，在线程池中执行，并按 INGEST_CONCURRENCY / LLM_CONCURRENCY 限制同时进行的数量。
+只支持单个 worker 进程：chroma 的 PersistentClient 不能由多个进程同时写入，BM25 索引、回答缓存与
+内容版本号也都在进程内存中，多个进程之间不会同步。需要更多并发时增加 --threads（阻塞调用的线程数）
+与 LLM_CONCURRENCY。
+'''
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import anyio
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from tracing import tracer
+
+
+class QueryRequest(BaseModel):
+    question: str = Field(min_length=1)
+    namespace: Optional[str] = None
+    source: Optional[str] = None
+
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str] = Field(min_length=1, max_length=256)
+    namespace: Optional[str] = None
+    source: Optional[str] = None
+
+
+class RequestStats:
+    def __init__(self):
+        '''按接口统计请求数、错误数与耗时'''
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, status, seconds):
+        with self._lock:
+            stats = self._routes.setdefault(route, {"requests": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stats["requests"] += 1
+            stats["errors"] += status >= 500
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {route: dict(stats, mean_seconds=stats["seconds"] / stats["requests"])
+                    for route, stats in self._routes.items()}
+
+    def prometheus_text(self, prefix="chatpdf"):
+        lines = []
+        for key, metric in (("requests", "http_requests_total"), ("errors", "http_errors_total"),
+                            ("seconds", "http_request_seconds_total")):
+            lines.append(f"# TYPE {prefix}_{metric} counter")
+            for route, stats in sorted(self.snapshot().items()):
+                lines.append(f'{prefix}_{metric}{{route="{route}"}} {stats[key]}')
+        return "\n".join(lines) + "\n"
+
+
+def create_app(service_factory=None, threads=40):
+    '''
+    创建 ASGI 应用。
+
+    service_factory: 返回 RAGService 的函数，启动时调用一次，默认为 rag_service.create_service
+    threads: 整数，执行阻塞调用的线程池大小
+    '''
+    if service_factory is None:
+        from rag_service import create_service
+        service_factory = create_service
+
+    @asynccontextmanager
+    async def lifespan(app):
+        anyio.to_thread.current_default_thread_limiter().total_tokens = threads
+        service = await run_in_threadpool(service_factory)
+        app.state.service = service
+        app.state.ingest_slots = asyncio.Semaphore(service.ingest_concurrency)
+        app.state.query_slots = asyncio.Semaphore(service.query_concurrency)
+        yield
+
+    app = FastAPI(title="ChatPDF", lifespan=lifespan)
+    request_stats = RequestStats()
+
+    @app.middleware("http")
+    async def record_requests(request: Request, call_next):
+        start = time.perf_counter()
+        # 请求的根 span，检索、生成等阶段的 span 随上下文传入线程池，归在同一个 trace 下
+        span = tracer.start("http_request", method=request.method)
+
+        def finish(status, error=None):
+            route = getattr(request.scope.get("route"), "path", request.url.path)
+            span.set(route=route, status=status)
+            span.end(error)
+            request_stats.record(route, status, time.perf_counter() - start)
+
+        try:
+            with tracer.activate(span):
+                response = await call_next(request)
+        except Exception as e:
+            finish(500, e)
+            raise
+
+        # call_next 在响应头就绪时返回，流式响应（/v1/query/stream）的正文此时还在生成，
+        # 耗时与 span 在正文发送完毕后才记录
+        body = response.body_iterator
+
+        async def timed_body():
+            error = None
+            try:
+                async for chunk in body:
+                    yield chunk
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                finish(response.status_code, error)
+
+        response.body_iterator = timed_body()
+        return response
+
+    @app.post("/v1/documents")
+    async def ingest(file: UploadFile = File(...), namespace: Optional[str] = Form(None)):
+        source = os.path.basename(file.filename or "document.pdf")
+        # 导入流水线按文件路径读取，先保存到临时文件
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, source)
+            with open(path, "wb") as f:
+                await run_in_threadpool(shutil.copyfileobj, file.file, f)
+            async with app.state.ingest_slots:
+                return await run_in_threadpool(app.state.service.ingest, path, source, namespace)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @app.post("/v1/jobs")
+    async def submit_job(file: UploadFile = File(...), namespace: Optional[str] = Form(None)):
+        source = os.path.basename(file.filename or "document.pdf")
+        # 任务队列提交时复制一份文件，临时文件可以立即删除
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, source)
+            with open(path, "wb") as f:
+                await run_in_threadpool(shutil.copyfileobj, file.file, f)
+            return await run_in_threadpool(app.state.service.submit_ingest, path, source, namespace)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @app.get("/v1/jobs/{job_id}")
+    async def job_status(job_id: str):
+        job = await run_in_threadpool(app.state.service.job_status, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="job not found")
+        return job
+
+    @app.get("/v1/namespaces/{namespace}")
+    async def namespace_info(namespace: str, count: bool = True):
+        # count=false 时只判断是否有文档，不统计片段数
+        if not count:
+            found = await run_in_threadpool(app.state.service.has_documents, namespace)
+            return {"namespace": namespace, "has_documents": found}
+        documents = await run_in_threadpool(app.state.service.document_count, namespace)
+        return {"namespace": namespace, "has_documents": documents > 0, "documents": documents}
+
+    @app.delete("/v1/namespaces/{namespace}")
+    async def delete_namespace(namespace: str):
+        await run_in_threadpool(app.state.service.delete_namespace, namespace)
+        return {"namespace": namespace, "deleted": True}
+
+    @app.post("/v1/query")
+    async def query(body: QueryRequest):
+        async with app.state.query_slots:
+            return await run_in_threadpool(app.state.service.query, body.question, body.source, body.namespace)
+
+    @app.post("/v1/query/stream")
+    async def query_stream(body: QueryRequest):
+        async def events():
+            # 流式响应占用一个并发名额直到生成结束
+            async with app.state.query_slots:
+                stream = app.state.service.query_stream(body.question, body.source, body.namespace)
+                async for event in iterate_in_threadpool(stream):
+                    yield json.dumps(event, ensure_ascii=False) + "\n"
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
+    @app.post("/v1/query/batch")
+    async def query_batch(body: BatchQueryRequest):
+        if any(not q for q in body.questions):
+            raise HTTPException(status_code=422, detail="questions must not be empty")
+        async with app.state.query_slots:
+            answers = await run_in_threadpool(
+                app.state.service.query_batch, body.questions, body.source, body.namespace)
+        return {"answers": answers}
+
+    @app.get("/healthz")
+    async def health():
+        return await run_in_threadpool(app.state.service.health)
+
+    @app.get("/metrics")
+    async def metrics():
+        service_metrics = await run_in_threadpool(app.state.service.metrics)
+        return dict(service_metrics, http=request_stats.snapshot())
+
+    @app.get("/metrics/prometheus", response_class=PlainTextResponse)
+    async def prometheus_metrics():
+        text = await run_in_threadpool(app.state.service.prometheus_metrics)
+        return PlainTextResponse(text + request_stats.prometheus_text(tracer.prefix),
+                                 media_type="text/plain; version=0.0.4")
+
+    return app
+
+
+def _app_from_env():
+    '''供 uvicorn 按导入路径加载'''
+    return create_app(threads=int(os.getenv("API_THREADS", "40")))
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="worker 进程数，只支持 1")
+    parser.add_argument("--threads", type=int, default=40, help="执行阻塞调用的线程数")
+    args = parser.parse_args()
+    if args.workers != 1:
+        # 各进程的 chroma PersistentClient 同时写入同一目录会损坏数据，内存中的 BM25 索引、
+        # 回答缓存与版本号也不会在进程间同步
+        parser.error("--workers must be 1: the vector store, keyword index and answer cache are per-process; "
+                     "raise --threads and LLM_CONCURRENCY for more concurrency")
+
+    from dotenv import load_dotenv, find_dotenv
+    _ = load_dotenv(find_dotenv())
+
+    os.environ["API_THREADS"] = str(args.threads)
+    uvicorn.run("api_server:_app_from_env", factory=True, host=args.host, port=args.port)
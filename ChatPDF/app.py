@@ -1,85 +1,164 @@
-import gradio as gr
-from utilities import *
-from vector_db import MyVectorDBConnector
-from rag_bot import RAG_Bot
-from llm_api import get_completion, get_embeddings
-
-
-# 创建一个向量数据库对象
-vector_db = MyVectorDBConnector("demo_text_split", get_embeddings)
+import os
 
-# 创建一个RAG机器人
-bot = RAG_Bot(
-    vector_db,
-    llm_api=get_completion
-)
-
-
-def handle_file_upload(file, chat_history):       
+import gradio as gr
+from transcript import TranscriptRenderer
+
+# 加载环境变量
+from dotenv import load_dotenv, find_dotenv
+_ = load_dotenv(find_dotenv())  # 读取本地 .env 文件，里面定义了 OPENAI_API_KEY
+
+def connect_service():
+    '''
+    问答服务：设置 CHATPDF_API_URL 时作为 api_server 的客户端，界面不再加载模型与向量数据库；
+    否则在本进程中创建服务核心（与 api_server 相同，见 rag_service.create_service）
+    '''
+    if os.getenv("CHATPDF_API_URL"):
+        from api_client import APIClient
+        return APIClient(os.getenv("CHATPDF_API_URL"))
+    from rag_service import create_service
+    service = create_service()
+    # 设置 METRICS_PORT 时在该端口提供 Prometheus 格式的 /metrics（追踪由 TRACING=1 启用）
+    if os.getenv("METRICS_PORT"):
+        from tracing import serve_metrics
+        serve_metrics(int(os.getenv("METRICS_PORT")), render=service.prometheus_metrics)
+    return service
+
+# 排队请求数上限
+QUEUE_SIZE = 64
+
+
+def handle_file_upload(file, chat_history, request: gr.Request):
     if not file:
         chat_history = [("Assistant", "请先选择文件。")]
-        return chat_history, ""
-    
-    paragraphs = extract_text_from_pdf(file.name, min_line_length=10)
-    
-    chunks = split_text(paragraphs, 300, 100)
-
-    # 向向量数据库中添加文档
-    vector_db.add_documents(chunks)
-    chat_history = [("Assistant", "文件已上传并处理成功。")]
-    return chat_history, ""
-
-def handle_query(query, chat_history):
-    collection_count = vector_db.collection_size()
-    
-    if collection_count == 0:
+        return chat_history, "", None, None, gr.Timer(active=False)
+
+    source = os.path.basename(file.name)
+    # 每个浏览器会话是一个独立的命名空间，上传的文档只对本会话可见
+    namespace = request.session_hash
+
+    # 导入在后台任务中执行，请求立即返回；导入过程中即可对已写入的部分提问，
+    # 进度由 handle_job_status 轮询，只在有任务时启用定时器
+    job = service.submit_ingest(file.name, source, namespace=namespace)
+    chat_history = [("Assistant", "文件已提交导入，导入过程中即可对已导入的部分提问。")]
+    # 同一内容以其他文件名导入过时，片段上是之前的文件名，按任务返回的 source 检索
+    return chat_history, "", job["source"], job["id"], gr.Timer(active=True)
+
+def format_job_status(job):
+    if job is None:
+        return ""
+    if job["status"] == "failed":
+        return f"导入失败：{job['error']}"
+    if job["status"] == "cancelled":
+        return "导入已取消。"
+    if job["status"] == "done":
+        if job["stats"] and job["stats"].get("skipped"):
+            return "文件已导入过，可直接提问。"
+        return f"导入完成：共 {job['total_pages']} 页，{job['indexed']} 个片段。"
+    if job["status"] == "queued":
+        return "排队等待导入..."
+    return f"正在导入：已解析 {job['pages']}/{job['total_pages']} 页，已写入 {job['indexed']} 个片段"
+
+def handle_job_status(job_id, chat_history):
+    if job_id is None:
+        return gr.update(), None, chat_history, gr.Timer(active=False)
+    job = service.job_status(job_id)
+    if job is None or job["status"] in ("done", "failed", "cancelled"):
+        # 任务结束后停止定时器，结果追加到对话历史
+        status = format_job_status(job)
+        return (status, None, (chat_history + [("Assistant", status)]) if status else chat_history,
+                gr.Timer(active=False))
+    return format_job_status(job), job_id, chat_history, gr.update()
+
+def handle_query(query, chat_history, current_source, request: gr.Request):
+    namespace = request.session_hash
+    if not service.has_documents(namespace):
         chat_history = [("Assistant", "请先上传文件。")]        
-        return chat_history, ""
+        yield chat_history, ""
+        return
     
-    search_results = vector_db.search(query, 2)
+    # 重复或相近的问题直接使用缓存的回答；否则只检索一次，参考文档与生成共用本次检索结果，
+    # 上传过文件时只在该文件中检索。先显示问题和参考文档，再随生成进度逐步更新回答
+    chat_history = chat_history + [("User", query)]
     ref_docs = ""
-
-    for doc in search_results['documents'][0]:
-        ref_docs += doc+"\n\n"
-
-    response = bot.chat(query)
-    chat_history.append(("User", query))
-    chat_history.append(("Assistant", f"{response}\n"))    
-    return chat_history, ref_docs
-
-def format_chat(chat_history):
-    formatted_chat = "<div><strong>对话历史</strong></div>"
-    for speaker, text in chat_history:
-        if speaker == "User":
-            formatted_chat += f'<div style="text-align: right; margin: 10px;"><span style="background-color: #daf7a6; padding: 5px; border-radius: 5px;">{text}</span></div>'
+    response = ""
+    for event in service.query_stream(query, source=current_source, namespace=namespace):
+        if event["event"] == "references":
+            ref_docs = format_ref_docs(event['documents'], event['metadatas'])
+            if not event["cached"]:
+                yield chat_history, ref_docs
         else:
-            formatted_chat += f'<div style="text-align: left; margin: 10px;"><span style="background-color: #ffcccc; padding: 5px; border-radius: 5px;">{text}</span></div>'
-    return formatted_chat
-
+            response += event["text"]
+            yield chat_history + [("Assistant", f"{response}\n")], ref_docs
 
-with gr.Blocks() as demo:
-    gr.Markdown("## ChatPDF")
+def handle_unload(request: gr.Request):
+    # 会话结束后删除该会话上传的文档
+    service.delete_namespace(request.session_hash)
 
-    with gr.Row():
-        with gr.Column(scale=3):
-            chat_display = gr.HTML(label="对话历史", elem_id="chat_display")
-
-        with gr.Column(scale=1):
-            chat_history = gr.State([])            
-            upload = gr.File(label="上传PDF文件")
-            upload_button = gr.Button("上传")
-            query = gr.Textbox(label="输入问题", placeholder="请输入您的问题...")
+def format_ref_docs(documents, metadatas):
+    ref_docs = ""
+    for doc, metadata in zip(documents, metadatas or [None] * len(documents)):
+        if metadata and "page" in metadata:
+            ref_docs += f"[{metadata.get('source', '')} 第 {metadata['page'] + 1} 页]\n"
+        ref_docs += doc+"\n\n"
+    return ref_docs
+
+# 对话历史的渲染器（所有会话共用片段缓存），只显示最近 50 条消息
+transcript = TranscriptRenderer(max_turns=50)
+
+def format_chat(chat_history, pages=1):
+    return transcript.render(chat_history, pages)
+
+
+def build_demo(upload_concurrency, query_concurrency):
+    '''界面；并发上限为同时进行的导入数与同时进行的问答数（不超过 LLM 客户端的并发上限）'''
+    with gr.Blocks() as demo:
+        gr.Markdown("## ChatPDF")
+
+        with gr.Row():
+            with gr.Column(scale=3):
+                chat_display = gr.HTML(label="对话历史", elem_id="chat_display")
+
+            with gr.Column(scale=1):
+                chat_history = gr.State([])            
+                current_source = gr.State(None)
+                current_job = gr.State(None)
+                # 对话历史展开的页数，每页 50 条
+                shown_pages = gr.State(1)
+                upload = gr.File(label="上传PDF文件")
+                upload_button = gr.Button("上传")
+                job_status = gr.Markdown()
+                query = gr.Textbox(label="输入问题", placeholder="请输入您的问题...")
             
-            with gr.Row():
-                query_button = gr.Button("提交")
-                clear_button = gr.Button("清除")                   
+                with gr.Row():
+                    query_button = gr.Button("提交")
+                    clear_button = gr.Button("清除")                   
   
-            ref_docs = gr.Textbox(label="相关文档片段", elem_id="ref_docs", interactive=False)
-            upload_button.click(handle_file_upload, inputs=[upload, chat_history], outputs=[chat_history, ref_docs])
-            query_button.click(handle_query, inputs=[query, chat_history], outputs=[chat_history, ref_docs])
-            clear_button.click(lambda: ([], ""), inputs=None, outputs=[chat_history, ref_docs])
-
-    demo.load(lambda: format_chat([]), inputs=None, outputs=chat_display)
-    chat_history.change(fn=format_chat, inputs=chat_history, outputs=chat_display)
-
-demo.launch()
+                ref_docs = gr.Textbox(label="相关文档片段", elem_id="ref_docs", interactive=False)
+                # 导入任务进度每 2 秒查询一次；定时器默认停用，上传后启用、任务结束后停用，空闲会话不轮询
+                job_timer = gr.Timer(2, active=False)
+                # 提交导入只是保存文件并登记任务，导入的并发数由后台任务队列限制；问答主要等待 LLM，允许更多并发
+                upload_button.click(handle_file_upload, inputs=[upload, chat_history],
+                                    outputs=[chat_history, ref_docs, current_source, current_job, job_timer],
+                                    concurrency_limit=upload_concurrency, concurrency_id="upload")
+                query_button.click(handle_query, inputs=[query, chat_history, current_source], outputs=[chat_history, ref_docs],
+                                   concurrency_limit=query_concurrency, concurrency_id="query")
+                clear_button.click(lambda: ([], "", 1), inputs=None, outputs=[chat_history, ref_docs, shown_pages])
+                older_button = gr.Button("显示更早的消息")
+                older_button.click(lambda pages: pages + 1, inputs=shown_pages, outputs=shown_pages)
+
+        demo.load(lambda: format_chat([]), inputs=None, outputs=chat_display)
+        job_timer.tick(handle_job_status, inputs=[current_job, chat_history],
+                       outputs=[job_status, current_job, chat_history, job_timer])
+        chat_history.change(fn=format_chat, inputs=[chat_history, shown_pages], outputs=chat_display)
+        shown_pages.change(fn=format_chat, inputs=[chat_history, shown_pages], outputs=chat_display)
+        demo.unload(handle_unload)
+    return demo
+
+
+if __name__ == "__main__":
+    # 解析 PDF 的进程池以 spawn 方式启动，子进程会以 __mp_main__ 的名字重新导入本脚本，
+    # 创建服务与启动界面只在主进程中执行
+    service = connect_service()
+    demo = build_demo(service.ingest_concurrency, service.query_concurrency)
+    # 未单独设置并发上限的事件（如渲染对话历史）使用默认上限；排队请求过多时直接拒绝
+    demo.queue(default_concurrency_limit=service.query_concurrency, max_size=QUEUE_SIZE).launch()
@@ -0,0 +1,306 @@
+import asyncio
+import json
+import queue
+import random
+import threading
+from contextlib import nullcontext
+
+import httpx
+from openai import (APIConnectionError, APIStatusError, APITimeoutError,
+                    AsyncOpenAI, RateLimitError)
+
+from tracing import tracer
+
+
+def _record_usage(usage, **kinds):
+    '''把响应中的 token 用量记到当前 span 与计数器上，kinds 为 {属性名: usage 字段名}'''
+    if usage is None or not tracer.enabled:
+        return
+    span = tracer.current()
+    for kind, field in kinds.items():
+        tokens = getattr(usage, field, None) or 0
+        span.add(kind, tokens)
+        tracer.count("llm_tokens_total", tokens, kind=kind.removesuffix("_tokens"))
+
+
+def _is_retryable(error):
+    '''连接错误、超时、限流与服务端 5xx 错误可以重试'''
+    if isinstance(error, (APIConnectionError, APITimeoutError, RateLimitError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+class AsyncRateLimiter:
+    def __init__(self, rate, burst=None):
+        """
+        令牌桶限流器。
+
+        参数:
+        rate: 浮点数，每秒允许的请求数。
+        burst: 整数，允许的突发请求数，默认与 rate 相同（至少为 1）。
+        """
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = self.capacity
+        self._updated = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        '''取得一个令牌，令牌不足时等待'''
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self._updated is not None:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AsyncLLMClient:
+    def __init__(self, base_url=None, api_key=None, max_concurrency=16, requests_per_second=None,
+                 timeout=60.0, max_retries=3, backoff=0.5, max_connections=64, stream_timeout=300.0):
+        """
+        异步的对话补全与 Embedding 客户端。
+
+        - 所有请求共用一个 httpx 连接池；
+        - 全局并发信号量限制同时在途的请求数，可选的令牌桶限制每秒请求数；
+        - 请求超时、连接错误、限流与 5xx 错误按指数退避加随机抖动重试；
+        - 参数完全相同的非流式请求在途时合并为一次调用，结果共享。
+
+        同一个客户端只在一个事件循环中使用：要么在异步代码中直接 await complete / embed，
+        要么使用 completion_fn / completion_stream_fn / embedding_fn 返回的同步函数，
+        它们在客户端自带的后台事件循环中执行，可在 Gradio 等多线程环境中直接调用。
+
+        参数:
+        base_url: 字符串，OpenAI 兼容服务地址，默认读取 OPENAI_BASE_URL 环境变量。
+        api_key: 字符串，默认读取 OPENAI_API_KEY 环境变量。
+        max_concurrency: 整数，同时在途的请求数上限。
+        requests_per_second: 浮点数，每秒请求数上限，None 表示不限。
+        timeout: 秒数，单个请求的超时时间。
+        max_retries: 整数，可重试错误的最大重试次数。
+        backoff: 秒数，首次重试的最大等待时间，之后每次翻倍。
+        max_connections: 整数，连接池的最大连接数。
+        stream_timeout: 秒数，流式请求从发出到读取完毕的总时长上限，超时抛出 TimeoutError 并释放并发名额。
+        """
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self.stream_timeout = stream_timeout
+
+        self.requests = 0
+        self.retries = 0
+        self.coalesced = 0
+
+        # 以下对象绑定到首次使用时的事件循环，延迟创建
+        self._client = None
+        self._semaphore = None
+        self._limiter = None
+        self._inflight = {}
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+
+    def _ensure_client(self):
+        if self._client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=self.timeout,
+            )
+            # 重试由本客户端统一控制，关闭 openai 自带的重试
+            self._client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key,
+                                       http_client=http_client, max_retries=0, timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            if self.requests_per_second:
+                self._limiter = AsyncRateLimiter(self.requests_per_second)
+        return self._client
+
+    async def _call(self, request_fn, acquire=True):
+        '''
+        在并发与限流约束下执行请求，可重试的错误按退避策略重试。
+
+        acquire 为 False 时调用方已持有并发名额
+        '''
+        client = self._ensure_client()
+        attempt = 0
+        while True:
+            async with (self._semaphore if acquire else nullcontext()):
+                if self._limiter is not None:
+                    await self._limiter.acquire()
+                self.requests += 1
+                try:
+                    return await request_fn(client)
+                except Exception as e:
+                    if attempt >= self.max_retries or not _is_retryable(e):
+                        raise
+            # 退避时不占用并发名额（acquire 为 False 时除外）
+            self.retries += 1
+            tracer.current().add("retries")
+            tracer.count("llm_retries_total")
+            await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+            attempt += 1
+
+    async def _coalesce(self, key, request_fn):
+        '''参数相同的请求在途时等待同一个结果'''
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call(request_fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+            tracer.current().set(coalesced=True)
+        # shield：某个等待方被取消时不影响其他等待方
+        return await asyncio.shield(task)
+
+    async def complete(self, prompt, model="gpt-3.5-turbo-1106", temperature=0):
+        '''对话补全，返回回答文本'''
+        messages = [{"role": "user", "content": prompt}]
+
+        async def request(client):
+            response = await client.chat.completions.create(
+                model=model, messages=messages, temperature=temperature)
+            _record_usage(response.usage, prompt_tokens="prompt_tokens", completion_tokens="completion_tokens")
+            return response.choices[0].message.content
+
+        key = ("chat", model, temperature, prompt)
+        return await self._coalesce(key, request)
+
+    async def complete_stream(self, prompt, model="gpt-3.5-turbo-1106", temperature=0):
+        '''
+        流式对话补全，逐段 yield 文本；建立连接阶段的错误会重试，流开始后的错误直接抛出。
+
+        请求最后一个 chunk 附带 token 用量（stream_options.include_usage），与非流式调用一样计入用量
+        '''
+        messages = [{"role": "user", "content": prompt}]
+        self._ensure_client()
+
+        async def request(client):
+            return await client.chat.completions.create(
+                model=model, messages=messages, temperature=temperature, stream=True,
+                stream_options={"include_usage": True})
+
+        # 流式响应占用一个并发名额直到读取完毕；整个流受 stream_timeout 限制，
+        # 调用方停止读取却不关闭时，下次读取超时即释放名额
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.stream_timeout
+        async with self._semaphore:
+            stream = await asyncio.wait_for(self._call(request, acquire=False), self.stream_timeout)
+            try:
+                chunks = stream.__aiter__()
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise TimeoutError(f"流式响应超过 {self.stream_timeout} 秒未读取完毕")
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        break
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                    # 用量在 choices 为空的最后一个 chunk 中
+                    if chunk.usage is not None:
+                        _record_usage(chunk.usage, prompt_tokens="prompt_tokens", completion_tokens="completion_tokens")
+            finally:
+                await stream.close()
+
+    async def embed(self, texts, model="text-embedding-ada-002", dimensions=None):
+        '''计算一组文本的向量'''
+        texts = list(texts)
+        if model == "text-embedding-ada-002":
+            dimensions = None
+
+        async def request(client):
+            kwargs = {"dimensions": dimensions} if dimensions else {}
+            response = await client.embeddings.create(input=texts, model=model, **kwargs)
+            _record_usage(response.usage, embedding_tokens="prompt_tokens")
+            return [x.embedding for x in response.data]
+
+        key = ("embeddings", model, dimensions, json.dumps(texts, ensure_ascii=False))
+        return await self._coalesce(key, request)
+
+    def stats(self):
+        '''返回请求、重试与合并次数'''
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+
+    # ---- 同步包装：在后台事件循环中执行 ----
+
+    def _background_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever, name="async-llm-loop", daemon=True)
+                self._loop_thread.start()
+        return self._loop
+
+    def run(self, coro):
+        '''在后台事件循环中执行协程并等待结果'''
+        return asyncio.run_coroutine_threadsafe(coro, self._background_loop()).result()
+
+    def completion_fn(self, model="gpt-3.5-turbo-1106"):
+        '''返回与 llm_api.get_completion 用法相同的同步函数'''
+        def get_completion(prompt):
+            return self.run(self.complete(prompt, model=model))
+        return get_completion
+
+    def completion_stream_fn(self, model="gpt-3.5-turbo-1106"):
+        '''
+        返回与 llm_api.get_completion_stream 用法相同的同步生成器函数。
+
+        流在后台事件循环中一次读完并放入队列，调用方中途停止读取（即使没有关闭生成器）
+        也不会一直占用并发名额；生成器关闭或被回收时取消尚未完成的读取
+        '''
+        def get_completion_stream(prompt):
+            chunks = queue.Queue()
+            done = object()
+
+            async def produce():
+                async for text in self.complete_stream(prompt, model=model):
+                    chunks.put(text)
+
+            future = asyncio.run_coroutine_threadsafe(produce(), self._background_loop())
+            future.add_done_callback(lambda _: chunks.put(done))
+            try:
+                while True:
+                    text = chunks.get()
+                    if text is done:
+                        # 抛出读取过程中的异常
+                        future.result()
+                        return
+                    yield text
+            finally:
+                future.cancel()
+        return get_completion_stream
+
+    def embedding_fn(self, model="text-embedding-ada-002", dimensions=None):
+        '''返回与 llm_api.get_embeddings 用法相同的同步函数'''
+        def get_embeddings(texts):
+            return self.run(self.embed(texts, model=model, dimensions=dimensions))
+        return get_embeddings
+
+    def close(self):
+        '''关闭连接池与后台事件循环'''
+        if self._loop is not None:
+            self.run(self.aclose())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop = None
@@ -0,0 +1,246 @@
+'''
+ChatPDF 全流程的端到端基准测试，不访问 OpenAI：对话补全与 Embedding 由本地桩服务（stub_server）提供，
+延迟与生成速度可配置。
+
+在 llama2.pdf 上依次测量各阶段：extract_text_from_pdf、split_text、embedding、add_documents、
+search、build_prompt 与 RAG_Bot.chat，输出每个阶段的 p50 / p95 / p99 延迟、吞吐与进程的峰值内存（RSS），
+结果可保存为 JSON，并与之前的结果对比，超出阈值的退化会被标出。
+
+用法（在 ChatPDF 目录下）:
+    python benchmarks/bench_pipeline.py --output baseline.json
+    python benchmarks/bench_pipeline.py --latency 0.05 --tokens-per-second 200 --concurrency 8 \\
+        --output new.json --compare baseline.json --threshold 10 --fail-on-regression
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_llm import AsyncLLMClient
+from prompt_base import prompt_template
+from rag_bot import RAG_Bot
+from stub_server import start_stub_server
+from utilities import build_prompt, count_pdf_pages, extract_text_from_pdf, split_text
+from vector_db import MyVectorDBConnector
+
+QUESTIONS = [
+    "llama 2有多少参数",
+    "How many parameters does Llama 2 have?",
+    "What is Ghost Attention?",
+    "How was the reward model trained?",
+    "What safety measures were used in fine-tuning?",
+    "What is the context length of Llama 2?",
+    "How does Llama 2-Chat compare to ChatGPT?",
+    "What data was used for pretraining?",
+    "What is RLHF?",
+    "How were the helpfulness and safety reward models combined?",
+]
+
+
+def peak_rss_mb():
+    '''进程至今的峰值常驻内存（MiB）；Linux 上 ru_maxrss 的单位是 KiB，macOS 上是字节'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+def summarize(durations, items, unit, wall=None):
+    '''
+    durations: 每次调用的耗时（秒）
+    items: 处理的条目总数（页、片段、问题等），用于计算吞吐
+    wall: 整个阶段的墙钟时间，并发执行时小于耗时之和，默认为耗时之和
+    '''
+    durations = np.array(durations) * 1000
+    wall = wall if wall is not None else durations.sum() / 1000
+    return {
+        "calls": len(durations),
+        "items": items,
+        "unit": unit,
+        "p50_ms": float(np.percentile(durations, 50)),
+        "p95_ms": float(np.percentile(durations, 95)),
+        "p99_ms": float(np.percentile(durations, 99)),
+        "mean_ms": float(durations.mean()),
+        "throughput": items / wall if wall > 0 else float("inf"),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def timed_calls(fn, args_list):
+    durations, results = [], []
+    for args in args_list:
+        start = time.perf_counter()
+        results.append(fn(*args))
+        durations.append(time.perf_counter() - start)
+    return durations, results
+
+
+def concurrent_calls(fn, args_list, concurrency):
+    '''并发执行，返回每次调用的耗时、结果与墙钟时间'''
+    def call(args):
+        start = time.perf_counter()
+        result = fn(*args)
+        return time.perf_counter() - start, result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(call, args_list))
+    wall = time.perf_counter() - start
+    return [d for d, _ in outcomes], [r for _, r in outcomes], wall
+
+
+def report(name, summary):
+    print(f"{name:<14} calls={summary['calls']:<5} p50={summary['p50_ms']:9.2f}ms p95={summary['p95_ms']:9.2f}ms "
+          f"p99={summary['p99_ms']:9.2f}ms  {summary['throughput']:10.1f} {summary['unit']}/s  "
+          f"rss={summary['peak_rss_mb']:7.1f}MiB")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    server, base_url = start_stub_server(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                         dimensions=args.dimensions, answer_words=args.answer_words)
+    client = AsyncLLMClient(base_url=base_url, api_key="stub", max_concurrency=max(args.concurrency, 4))
+    get_embeddings = client.embedding_fn(model="text-embedding-3-small", dimensions=args.dimensions)
+    get_completion = client.completion_fn()
+    stages = {}
+
+    # 1. 解析 PDF
+    pages = count_pdf_pages(args.pdf)
+    durations, results = timed_calls(
+        lambda: extract_text_from_pdf(args.pdf, min_line_length=10), [()] * args.repeat)
+    paragraphs = results[-1]
+    stages["extract"] = summarize(durations, pages * args.repeat, "pages")
+
+    # 2. 切分
+    durations, results = timed_calls(lambda: split_text(paragraphs, 300, 100), [()] * args.repeat)
+    chunks = results[-1]
+    stages["split"] = summarize(durations, len(chunks) * args.repeat, "chunks")
+
+    # 3. 计算向量（经 HTTP 调用桩服务，每批一次请求）
+    batches = [chunks[i:i + args.batch_size] for i in range(0, len(chunks), args.batch_size)]
+    durations, results = timed_calls(get_embeddings, [(batch,) for batch in batches])
+    vectors = dict(zip(chunks, (v for batch in results for v in batch)))
+    stages["embedding"] = summarize(durations, len(chunks), "chunks")
+
+    # 4. 写入向量数据库：使用已算好的向量，只测量写入本身
+    persist_dir = tempfile.mkdtemp() if args.backend == "local" else None
+    store = MyVectorDBConnector(
+        f"bench_{uuid.uuid4().hex[:8]}", lambda texts: [vectors[t] for t in texts],
+        persist_path=persist_dir, keyword_index=args.search_mode != "dense",
+        search_mode=args.search_mode, backend=args.backend)
+    durations, _ = timed_calls(
+        lambda batch, i: store.add_documents(batch, source="llama2.pdf", doc_hash=f"batch-{i}"),
+        [(batch, i) for i, batch in enumerate(batches)])
+    stages["add_documents"] = summarize(durations, len(chunks), "chunks")
+
+    # 5. 检索（问题的向量经桩服务计算）
+    store.embedding_fn = get_embeddings
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.queries)]
+    durations, results = timed_calls(lambda q: store.search(q, 2), [(q,) for q in questions])
+    stages["search"] = summarize(durations, len(questions), "queries")
+
+    # 6. 构建 Prompt
+    contexts = [r['documents'][0] for r in results]
+    calls = [(contexts[i % len(contexts)], questions[i % len(questions)]) for i in range(args.queries * 20)]
+    durations, _ = timed_calls(lambda docs, q: build_prompt(prompt_template, context=docs, query=q), calls)
+    stages["build_prompt"] = summarize(durations, len(calls), "prompts")
+
+    # 7. 完整问答：检索 + 生成，不使用回答缓存
+    bot = RAG_Bot(store, llm_api=get_completion)
+    durations, _, wall = concurrent_calls(bot.chat, [(q,) for q in questions], args.concurrency)
+    stages["chat"] = summarize(durations, len(questions), "queries", wall)
+
+    client.close()
+    server.shutdown()
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pdf": os.path.basename(args.pdf),
+            "chunks": len(chunks),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        },
+        "stages": stages,
+    }
+
+
+def compare(current, baseline, threshold):
+    '''
+    与之前的结果逐阶段对比，返回退化的阶段列表：
+    p50 / p95 / p99 延迟增加或吞吐下降超过 threshold 百分比视为退化
+    '''
+    print(f"\ncompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    old_args, new_args = baseline["meta"].get("args", {}), current["meta"]["args"]
+    differing = sorted(k for k in set(old_args) | set(new_args) if old_args.get(k) != new_args.get(k))
+    if differing:
+        print(f"note: run parameters differ ({', '.join(differing)}), results may not be comparable")
+    regressions = []
+    for name, stage in current["stages"].items():
+        old = baseline["stages"].get(name)
+        if old is None:
+            continue
+        changes = {}
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput"):
+            if old[key]:
+                changes[key] = (stage[key] - old[key]) / old[key] * 100
+        worse = [key for key, change in changes.items()
+                 if (change < -threshold if key == "throughput" else change > threshold)]
+        if worse:
+            regressions.append(name)
+        print(f"{name:<14} " + "  ".join(f"{key}={change:+7.1f}%" for key, change in changes.items())
+              + ("  REGRESSION" if worse else ""))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf", default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "llama2.pdf"))
+    parser.add_argument("--repeat", type=int, default=3, help="解析与切分的重复次数")
+    parser.add_argument("--queries", type=int, default=50, help="检索与问答的问题数")
+    parser.add_argument("--batch-size", type=int, default=64, help="每次 Embedding 请求的片段数")
+    parser.add_argument("--backend", choices=("chroma", "local"), default="chroma")
+    parser.add_argument("--search-mode", choices=("dense", "keyword", "hybrid"), default="dense")
+    parser.add_argument("--concurrency", type=int, default=1, help="问答阶段的并发数")
+    parser.add_argument("--latency", type=float, default=0.0, help="桩服务每个请求的模拟延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="桩服务的生成速度，0 表示不限速")
+    parser.add_argument("--answer-words", type=int, default=40)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--output", help="保存结果的 JSON 文件")
+    parser.add_argument("--compare", help="之前保存的结果，用于对比")
+    parser.add_argument("--threshold", type=float, default=10.0, help="视为退化的变化百分比")
+    parser.add_argument("--fail-on-regression", action="store_true", help="有退化时以非零状态退出")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"{result['meta']['pdf']}: {result['meta']['chunks']} chunks, commit {result['meta']['commit']}")
+    for name, summary in result["stages"].items():
+        report(name, summary)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
@@ -0,0 +1,93 @@
+'''
+对比原先的 split_text 与线性时间的流式切分在 llama2.pdf 上的耗时，并校验两者输出一致。
+
+用法（在 ChatPDF 目录下）:
+    python benchmarks/bench_split_text.py --repeat 20
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nltk.tokenize import sent_tokenize
+from utilities import _iter_sentence_chunks, extract_text_from_pdf, iter_chunks, split_text
+
+
+def legacy_split_text(paragraphs, chunk_size=300, overlap_size=100):
+    '''原先的实现：每个 chunk 都向前逐句拼接重叠部分'''
+    sentences = [s.strip() for p in paragraphs for s in sent_tokenize(p)]
+    return legacy_chunk_sentences(sentences, chunk_size, overlap_size)
+
+
+def legacy_chunk_sentences(sentences, chunk_size, overlap_size):
+    chunks = []
+    i = 0
+    while i < len(sentences):
+        chunk = sentences[i]
+        overlap = ''
+        prev = i - 1
+        while prev >= 0 and len(sentences[prev])+len(overlap) <= overlap_size:
+            overlap = sentences[prev] + ' ' + overlap
+            prev -= 1
+        chunk = overlap+chunk
+        next = i + 1
+        while next < len(sentences) and len(sentences[next])+len(chunk) <= chunk_size:
+            chunk = chunk + ' ' + sentences[next]
+            next += 1
+        chunks.append(chunk)
+        i = next
+    return chunks
+
+
+def best_of(fn, repeat):
+    '''重复执行，返回最短耗时（秒）与最后一次的结果'''
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_case(name, paragraphs, chunk_size, overlap_size, repeat):
+    legacy_time, legacy_chunks = best_of(
+        lambda: legacy_split_text(paragraphs, chunk_size, overlap_size), repeat)
+    new_time, new_chunks = best_of(
+        lambda: split_text(paragraphs, chunk_size, overlap_size), repeat)
+    assert new_chunks == legacy_chunks, f"{name}: 切分结果与原实现不一致"
+    print(f"{name:<32} chunks={len(new_chunks):<6} legacy={legacy_time * 1000:9.2f}ms "
+          f"new={new_time * 1000:9.2f}ms speedup={legacy_time / new_time:5.2f}x")
+
+    # 只比较切分本身，排除两者共有的 sent_tokenize 开销
+    sentences = [s.strip() for p in paragraphs for s in sent_tokenize(p)]
+    legacy_time, _ = best_of(
+        lambda: legacy_chunk_sentences(sentences, chunk_size, overlap_size), repeat)
+    new_time, _ = best_of(
+        lambda: [c for c, _, _ in _iter_sentence_chunks(sentences, chunk_size, overlap_size)], repeat)
+    print(f"{'  (chunking only)':<32} {'':<13} legacy={legacy_time * 1000:9.2f}ms "
+          f"new={new_time * 1000:9.2f}ms speedup={legacy_time / new_time:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf", default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "llama2.pdf"))
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    paragraphs = extract_text_from_pdf(args.pdf, min_line_length=10)
+    for chunk_size, overlap_size in [(300, 100), (1000, 300), (2000, 1000)]:
+        run_case(f"llama2.pdf {chunk_size}/{overlap_size}", paragraphs,
+                 chunk_size, overlap_size, args.repeat)
+
+    # 大量短句 + 大重叠窗口，原实现的逐句拼接在此时开销最大
+    short = [' '.join(f"Item {i} is short." for i in range(j, j + 50)) for j in range(0, 20000, 50)]
+    run_case("20k short sentences 4k/2k", short, 4000, 2000, max(1, args.repeat // 5))
+
+    # 流式切分：只消费第一个 chunk，不需要处理全部段落
+    start = time.perf_counter()
+    next(iter_chunks(iter(paragraphs), 300, 100))
+    print(f"time to first chunk (streaming): {(time.perf_counter() - start) * 1000:.2f}ms")
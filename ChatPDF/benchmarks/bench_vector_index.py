@@ -0,0 +1,146 @@
+'''
+对比 LocalCollection（float32 / float16 / int8，暴力检索与 IVF）、chromadb 与 FAISS（已安装时）
+在随机向量上的写入耗时、单个与批量检索延迟，以及相对精确结果的 recall@k。
+
+用法（在 ChatPDF 目录下）:
+    python benchmarks/bench_vector_index.py --n 20000 --dim 1536 --queries 200
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_index import LocalCollection
+
+
+def make_data(n, dim, n_queries, clusters=64, seed=0):
+    '''生成带聚类结构的向量（真实的 Embedding 也是成簇分布的），问题向量取自同一分布'''
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(clusters, size=n + n_queries)
+    data = centers[labels] + 0.5 * rng.standard_normal((n + n_queries, dim)).astype(np.float32)
+    return data[:n], data[n:]
+
+
+def exact_top_k(data, queries, k):
+    distances = (queries ** 2).sum(1)[:, None] + (data ** 2).sum(1)[None, :] - 2 * queries @ data.T
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def recall(found, truth):
+    return np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+
+
+def run_collection(name, add, query_one, query_batch, data, queries, truth, k, batch_size=1000):
+    ids = [str(i) for i in range(len(data))]
+    start = time.perf_counter()
+    for i in range(0, len(data), batch_size):
+        add(ids[i:i + batch_size], data[i:i + batch_size])
+    build = time.perf_counter() - start
+
+    latencies = []
+    found = []
+    for q in queries:
+        start = time.perf_counter()
+        found.append([int(i) for i in query_one(q, k)])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    query_batch(queries, k)
+    batch = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    print(f"{name:<24} build={build:7.2f}s  p50={np.percentile(latencies, 50):7.3f}ms "
+          f"p95={np.percentile(latencies, 95):7.3f}ms  batch/query={batch / len(queries) * 1000:7.3f}ms  "
+          f"recall@{k}={recall(found, truth):.3f}")
+
+
+def bench_local(data, queries, truth, k, dtype, ivf):
+    collection = LocalCollection(dtype=dtype, ivf_threshold=len(data) // 2 if ivf else None)
+
+    def add(ids, vectors):
+        collection.add(ids, vectors)
+
+    def query_one(q, k):
+        return collection.query([q], k, include=())["ids"][0]
+
+    def query_batch(qs, k):
+        return collection.query(qs, k, include=())
+
+    run_collection(f"local {dtype}{' ivf' if ivf else ''}", add, query_one, query_batch,
+                   data, queries, truth, k)
+    return collection
+
+
+def bench_chroma(data, queries, truth, k):
+    try:
+        import chromadb
+    except ImportError:
+        print("chromadb not installed, skipped")
+        return
+    collection = chromadb.Client().get_or_create_collection("bench_vector_index")
+
+    def add(ids, vectors):
+        collection.add(ids=ids, embeddings=vectors.tolist())
+
+    def query_one(q, k):
+        return collection.query(query_embeddings=[q.tolist()], n_results=k, include=[])["ids"][0]
+
+    def query_batch(qs, k):
+        return collection.query(query_embeddings=qs.tolist(), n_results=k, include=[])
+
+    run_collection("chromadb (hnsw)", add, query_one, query_batch, data, queries, truth, k)
+
+
+def bench_faiss(data, queries, truth, k):
+    try:
+        import faiss
+    except ImportError:
+        print("faiss not installed, skipped")
+        return
+    for name, index in [("faiss flat", faiss.IndexFlatL2(data.shape[1])),
+                        ("faiss hnsw", faiss.IndexHNSWFlat(data.shape[1], 32))]:
+        def add(ids, vectors, index=index):
+            index.add(vectors)
+
+        def query_one(q, k, index=index):
+            return index.search(q[None, :], k)[1][0]
+
+        def query_batch(qs, k, index=index):
+            return index.search(qs, k)
+
+        run_collection(name, add, query_one, query_batch, data, queries, truth, k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000, help="向量数")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    data, queries = make_data(args.n, args.dim, args.queries)
+    truth = exact_top_k(data, queries, args.k)
+    print(f"n={args.n} dim={args.dim} queries={args.queries}")
+
+    for dtype in ("float32", "float16", "int8"):
+        collection = bench_local(data, queries, truth, args.k, dtype, ivf=False)
+    bench_local(data, queries, truth, args.k, "float32", ivf=True)
+    bench_chroma(data, queries, truth, args.k)
+    bench_faiss(data, queries, truth, args.k)
+
+    # 保存与按内存映射方式加载（int8）
+    path = os.path.join(tempfile.mkdtemp(), "bench_vector_index")
+    start = time.perf_counter()
+    collection.save(path)
+    saved = time.perf_counter() - start
+    start = time.perf_counter()
+    loaded = LocalCollection.load(path)
+    print(f"int8 save={saved:.3f}s load(mmap, {loaded.count()} vectors)={time.perf_counter() - start:.3f}s "
+          f"vectors on disk={os.path.getsize(os.path.join(path, 'vectors.npy')) / 2 ** 20:.1f}MiB")
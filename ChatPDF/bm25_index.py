@@ -0,0 +1,155 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+
+# 英文单词与数字（保留 7B、2.0、llama-2 这类型号与版本号），以及连续的中日韩字符
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-_][a-z0-9]+)*|[぀-ヿ㐀-䶿一-鿿가-힯]+")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]")
+_JOINER_RE = re.compile(r"[\-_]")
+
+
+def tokenize(text):
+    '''
+    切分检索词：英文与数字按单词切分并转小写，中日韩文本没有空格分隔，切成单字与相邻两字（bigram），
+    不依赖分词词典也能匹配中文词语。
+    用连字符或下划线连接的词（如 llama-2-chat）同时保留整体与各部分，问题中只写 llama 或 chat 也能匹配。
+    '''
+    tokens = []
+    for match in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(match):
+            tokens.extend(match)
+            tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+        else:
+            tokens.append(match)
+            parts = [part for part in _JOINER_RE.split(match) if part]
+            if len(parts) > 1:
+                tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75, filter_keys=("source", "namespace")):
+        """
+        内存中的 BM25 倒排索引，支持增量添加与删除片段。
+
+        倒排表以整数编号记录片段，检索时只遍历问题中出现的词的倒排表，
+        与片段总数无关，关键词检索通常在 1 毫秒以内。
+
+        参数:
+        k1: 浮点数，词频饱和参数。
+        b: 浮点数，文档长度归一化参数。
+        filter_keys: 记录在索引中的 metadata 字段，检索时可按这些字段过滤。
+        """
+        self.k1 = k1
+        self.b = b
+        self.filter_keys = filter_keys
+        self._lock = threading.Lock()
+        self._postings = {}     # 词 -> {片段编号: 词频}
+        self._doc_ids = {}      # 片段 id -> 片段编号
+        self._docs = {}         # 片段编号 -> (片段 id, 词表, 长度, 过滤字段)
+        self._next = 0
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, ids, documents, metadatas=None):
+        '''添加片段，id 已存在时替换'''
+        metadatas = metadatas or [None] * len(ids)
+        prepared = [(chunk_id, Counter(tokenize(doc)), metadata)
+                    for chunk_id, doc, metadata in zip(ids, documents, metadatas)]
+        with self._lock:
+            for chunk_id, counts, metadata in prepared:
+                self._remove(chunk_id)
+                number = self._next
+                self._next += 1
+                length = sum(counts.values())
+                fields = {k: metadata[k] for k in self.filter_keys if metadata and k in metadata}
+                self._doc_ids[chunk_id] = number
+                self._docs[number] = (chunk_id, tuple(counts), length, fields)
+                self._total_length += length
+                for term, tf in counts.items():
+                    self._postings.setdefault(term, {})[number] = tf
+
+    def update_metadata(self, ids, metadatas):
+        '''更新片段的过滤字段，片段内容不变'''
+        with self._lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                number = self._doc_ids.get(chunk_id)
+                if number is not None:
+                    _, terms, length, fields = self._docs[number]
+                    fields = dict(fields, **{k: metadata[k] for k in self.filter_keys if k in metadata})
+                    self._docs[number] = (chunk_id, terms, length, fields)
+
+    def _remove(self, chunk_id):
+        '''删除片段，需持有锁'''
+        number = self._doc_ids.pop(chunk_id, None)
+        if number is None:
+            return
+        _, terms, length, _ = self._docs.pop(number)
+        self._total_length -= length
+        for term in terms:
+            postings = self._postings[term]
+            del postings[number]
+            if not postings:
+                del self._postings[term]
+
+    def remove(self, ids):
+        '''删除片段'''
+        with self._lock:
+            for chunk_id in ids:
+                self._remove(chunk_id)
+
+    def remove_where(self, **fields):
+        '''删除过滤字段全部匹配的片段，如 remove_where(namespace="...")'''
+        with self._lock:
+            for chunk_id in [d[0] for d in self._docs.values()
+                             if all(d[3].get(k) == v for k, v in fields.items())]:
+                self._remove(chunk_id)
+
+    def search(self, query, top_n, **filters):
+        '''
+        检索与问题关键词最匹配的片段，返回 [(片段 id, BM25 分数)]，按分数从高到低排列。
+
+        filters: 按过滤字段精确匹配，值为 None 的条件忽略，如 search(q, 5, namespace="...")
+        '''
+        filters = {k: v for k, v in filters.items() if v is not None}
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs or not terms:
+                return []
+            avg_length = self._total_length / n_docs
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for number, tf in postings.items():
+                    length = self._docs[number][2]
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[number] = scores.get(number, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            if filters:
+                scores = {n: s for n, s in scores.items()
+                          if all(self._docs[n][3].get(k) == v for k, v in filters.items())}
+            best = heapq.nlargest(top_n, scores.items(), key=lambda item: item[1])
+            return [(self._docs[n][0], score) for n, score in best]
+
+
+def reciprocal_rank_fusion(rankings, k=60, weights=None):
+    '''
+    倒数排名融合（RRF）：每个排序结果中排第 r 名的条目得分 weight / (k + r)，按总分排序。
+    只使用名次，不需要把向量距离与 BM25 分数换算到同一尺度。
+
+    rankings: 多个按相关度排好序的 id 列表
+    返回 [(id, 融合分数)]，按分数从高到低排列
+    '''
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
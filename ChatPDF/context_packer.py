@@ -0,0 +1,158 @@
+import logging
+
+from nltk.tokenize import sent_tokenize
+
+from embedding_engine import estimate_tokens
+from utilities import token_counter
+
+logger = logging.getLogger(__name__)
+
+# 常用模型的上下文窗口（token 数）
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+
+
+def _document_key(metadata):
+    '''同一文档的片段才能按字符区间合并'''
+    return metadata.get("namespace"), metadata.get("doc_hash") or metadata.get("source")
+
+
+def _sentence_key(sentence):
+    return ' '.join(sentence.split()).lower()
+
+
+def merge_spans(documents, metadatas=None):
+    '''
+    将同一文档中重叠或相邻的片段按字符区间（iter_page_chunks 写入的 start / end）还原为连续文本。
+
+    返回 [(文本, metadata, 排名)]，按排名（最相关的片段在 documents 中的下标）排序；
+    合并后的 metadata 取最小的 page / start 与最大的 page_end / end。没有字符区间的片段原样保留。
+    '''
+    metadatas = metadatas or [{}] * len(documents)
+    spans = []
+    groups = {}
+    for rank, (doc, metadata) in enumerate(zip(documents, metadatas)):
+        metadata = metadata or {}
+        if "start" in metadata and "end" in metadata:
+            groups.setdefault(_document_key(metadata), []).append((metadata["start"], rank, doc, metadata))
+        else:
+            spans.append((doc, metadata, rank))
+
+    for items in groups.values():
+        items.sort(key=lambda item: (item[0], item[1]))
+        text, metadata, rank = None, None, None
+        for start, item_rank, doc, item_metadata in items:
+            # 切分时句子以单个空格连接，end 处的字符就是下一句前的空格
+            if text is not None and start <= metadata["end"] + 1:
+                if start + len(doc) > metadata["end"]:
+                    text += (' ' + doc) if start == metadata["end"] + 1 else doc[metadata["end"] - start:]
+                metadata = dict(
+                    metadata,
+                    end=max(metadata["end"], start + len(doc)),
+                    page=min(metadata.get("page", 0), item_metadata.get("page", 0)),
+                    page_end=max(metadata.get("page_end", 0), item_metadata.get("page_end", 0)))
+                rank = min(rank, item_rank)
+                continue
+            if text is not None:
+                spans.append((text, metadata, rank))
+            text, metadata, rank = doc, dict(item_metadata), item_rank
+        spans.append((text, metadata, rank))
+    spans.sort(key=lambda span: span[2])
+    return spans
+
+
+class ContextPacker:
+    def __init__(self, model="gpt-3.5-turbo-1106", max_tokens=None, reserve_tokens=1024, count_tokens=None):
+        """
+        组装 Prompt 中的已知信息：
+
+        1. 同一文档中重叠或相邻的片段（split_text 的 overlap 部分）合并为连续文本；
+        2. 去掉之前的片段中已出现过的句子；
+        3. 按相关度依次放入，不超过 token 预算；放不下的片段只保留能放下的前几句。
+
+        参数:
+        model: 字符串，LLM 模型名，用于选择 tokenizer 与默认预算。
+        max_tokens: 整数，已知信息的 token 上限；默认为模型上下文窗口减去 reserve_tokens。
+        reserve_tokens: 整数，为 Prompt 模板、问题与回答预留的 token 数。
+        count_tokens: 函数，计算文本的 token 数；默认使用模型的 tokenizer（tiktoken），
+            未安装 tiktoken、模型未知或编码文件无法下载（离线环境）时按字符估算。
+        """
+        self.model = model
+        if max_tokens is None:
+            max_tokens = CONTEXT_WINDOWS.get(model, 4096) - reserve_tokens
+        self.max_tokens = max_tokens
+        if count_tokens is None:
+            try:
+                count_tokens = token_counter(model)
+            except (ImportError, KeyError):
+                count_tokens = estimate_tokens
+            except Exception as e:
+                # tiktoken 首次使用时需要下载编码文件，离线时抛出网络错误
+                logger.warning("无法加载 %s 的 tokenizer，按字符估算 token 数：%s", model, e)
+                count_tokens = estimate_tokens
+        self.count_tokens = count_tokens
+
+    def _fit(self, sentences, budget):
+        '''取能放进 budget 的前几句，返回 (句数, 文本, token 数)'''
+        count, text, tokens = 0, '', 0
+        for sentence in sentences:
+            candidate = f"{text} {sentence}" if text else sentence
+            n = self.count_tokens(candidate)
+            if n > budget:
+                break
+            count, text, tokens = count + 1, candidate, n
+        return count, text, tokens
+
+    def pack(self, documents, metadatas=None):
+        '''
+        返回字典:
+        context: 放入 Prompt 的文本列表（按相关度排序，可直接传给 build_prompt）
+        metadatas: 对应的 metadata（合并后的页码与字符区间）
+        tokens: context 的 token 数
+        original_tokens: 直接拼接全部片段的 token 数
+        saved_tokens: 节省的 token 数
+        '''
+        original_tokens = self.count_tokens('\n\n'.join(documents)) if documents else 0
+        seen = set()
+        context, context_metadatas = [], []
+        tokens = 0
+        separator = self.count_tokens('\n\n')
+        for text, metadata, _ in merge_spans(documents, metadatas):
+            sentences, keys = [], []
+            for sentence in sent_tokenize(text):
+                key = _sentence_key(sentence)
+                if key and key not in seen and key not in keys:
+                    keys.append(key)
+                    sentences.append(sentence.strip())
+            if not sentences:
+                continue
+            budget = self.max_tokens - tokens - (separator if context else 0)
+            if budget <= 0:
+                break
+            text = ' '.join(sentences)
+            n = self.count_tokens(text)
+            if n > budget:
+                count, text, n = self._fit(sentences, budget)
+                if not count:
+                    continue
+                keys = keys[:count]
+            # 只有放入的句子才算出现过，被预算截掉的句子仍可出现在后面的片段中
+            seen.update(keys)
+            context.append(text)
+            context_metadatas.append(metadata)
+            tokens += n + (separator if len(context) > 1 else 0)
+        # 分词结果在拼接处可能与分别计数略有不同，按实际拼接的文本计算
+        tokens = self.count_tokens('\n\n'.join(context)) if context else 0
+        return {
+            "context": context,
+            "metadatas": context_metadatas,
+            "tokens": tokens,
+            "original_tokens": original_tokens,
+            "saved_tokens": original_tokens - tokens,
+        }
@@ -0,0 +1,160 @@
+import hashlib
+import sqlite3
+import threading
+from array import array
+
+from tracing import tracer
+
+
+def normalize_text(text):
+    '''归一化文本：合并连续空白，去掉首尾空白'''
+    return ' '.join(text.split())
+
+
+class EmbeddingCache:
+    def __init__(self, path="embedding_cache.db", max_entries=200000):
+        """
+        基于 SQLite 的持久化 Embedding 缓存。
+
+        缓存键为 (model, dimensions, 归一化文本的 sha256)，相同内容的文本
+        无论来自哪个文件、哪次上传都只需要计算一次向量。超过 max_entries
+        时按最近使用时间 (LRU) 淘汰。
+
+        参数:
+        path: 字符串，缓存数据库文件路径，传入 ":memory:" 则只在内存中缓存。
+        max_entries: 整数，缓存的最大条目数。
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Gradio 在线程池中执行回调，因此允许跨线程使用同一个连接，由 _lock 串行化
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        row = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM embeddings").fetchone()
+        self._size, self._clock = row
+
+    @staticmethod
+    def make_key(text, model, dimensions=None):
+        '''计算缓存键'''
+        digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+        return f"{model}:{dimensions or 0}:{digest}"
+
+    def get_many(self, keys):
+        '''批量查询，返回 {key: 向量}，命中的条目会刷新 LRU 时间'''
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            # SQLite 单条语句的参数个数有限制，分批查询
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+            if found:
+                self._clock += 1
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(self._clock, k) for k in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, items):
+        '''批量写入 [(key, 向量)]，必要时按 LRU 淘汰旧条目'''
+        if not items:
+            return
+        with self._lock:
+            self._clock += 1
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(k, array('f', v).tobytes(), self._clock) for k, v in items],
+            )
+            self._size += self._conn.total_changes - before
+            if self._size > self.max_entries:
+                overflow = self._size - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+                self._size -= overflow
+            self._conn.commit()
+
+    def record(self, hits, misses):
+        '''累计命中统计；多个线程同时查询缓存，计数在锁内更新'''
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        '''返回命中统计'''
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, self._size
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": size,
+        }
+
+    def clear(self):
+        '''清空缓存与统计'''
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        self._conn.close()
+
+
+def cached_embedding_fn(embedding_fn, cache, model="text-embedding-ada-002", dimensions=None):
+    '''
+    在任意 embedding 函数前加一层缓存，返回的函数可直接传给 MyVectorDBConnector。
+
+    model / dimensions 只用于区分缓存命名空间，需与 embedding_fn 实际使用的参数一致，
+    例如 cached_embedding_fn(partial(get_embeddings, model=m), cache, model=m)。
+    '''
+    def wrapper(texts):
+        keys = [cache.make_key(t, model, dimensions) for t in texts]
+        found = cache.get_many(list(set(keys)))
+
+        # 未命中的文本去重后一次性计算
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        misses = sum(1 for k in keys if k in missing)
+        cache.record(len(texts) - misses, misses)
+        # 记在当前阶段（如 embed_query）的 span 上
+        tracer.current().add("cache_hits", len(texts) - misses).add("cache_misses", misses)
+        tracer.count("embedding_cache_total", len(texts) - misses, result="hit")
+        tracer.count("embedding_cache_total", misses, result="miss")
+
+        if missing:
+            vectors = embedding_fn(list(missing.values()))
+            computed = list(zip(missing.keys(), vectors))
+            cache.put_many(computed)
+            found.update(computed)
+        return [found[k] for k in keys]
+
+    return wrapper
@@ -0,0 +1,136 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def estimate_tokens(text):
+    '''粗略估算 token 数：ASCII 约 4 个字符一个 token，中文等非 ASCII 字符约一个字符一个 token'''
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def pack_batches(texts, max_tokens=8000, max_items=256, count_tokens=estimate_tokens):
+    '''按 token 预算和条目数上限将文本顺序打包，返回每个批次的下标列表'''
+    batches = []
+    current, current_tokens = [], 0
+    for i, text in enumerate(texts):
+        n_tokens = count_tokens(text)
+        if current and (current_tokens + n_tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        # 单条超出预算的文本独占一个批次，由服务端决定截断或报错
+        current.append(i)
+        current_tokens += n_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def is_retryable(error):
+    '''
+    连接错误、超时、限流（429）与服务端 5xx 错误可以重试，与 async_llm 的判断一致；
+    其他 4xx 错误（参数错误、鉴权失败、输入超长）重试也不会成功。
+    本模块不依赖 openai，按异常的状态码与类名判断，openai、httpx 与 requests 的异常都适用。
+    '''
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # openai 的 APIConnectionError / APITimeoutError、httpx 的 ConnectError / TimeoutException 等
+    return any("Connect" in cls.__name__ or "Timeout" in cls.__name__ for cls in type(error).__mro__)
+
+
+class EmbeddingEngine:
+    def __init__(self, embed_batch_fn, max_tokens_per_batch=8000, max_items_per_batch=256,
+                 max_workers=4, max_retries=3, backoff=0.5, retry_on=is_retryable,
+                 count_tokens=estimate_tokens):
+        """
+        批量、并发的 Embedding 计算引擎。
+
+        将输入文本按 token / 条目预算打包成多个请求，用线程池并发发送，
+        失败的批次按指数退避加随机抖动重试，最终按输入顺序返回向量。
+        实例本身可以直接作为 embedding_fn 传给 MyVectorDBConnector。
+
+        参数:
+        embed_batch_fn: 函数，接收文本列表返回等长的向量列表，例如 llm_api.get_embeddings。
+        max_tokens_per_batch: 整数，单个请求的估算 token 上限。
+        max_items_per_batch: 整数，单个请求的文本条数上限。
+        max_workers: 整数，同时在途的请求数上限（所有调用方共享）。
+        max_retries: 整数，单个批次失败后的最大重试次数。
+        backoff: 浮点数，首次重试前的等待秒数，之后每次翻倍。
+        retry_on: 需要重试的异常类型元组，或接收异常、返回是否重试的函数；
+            默认只重试连接错误、超时、限流与 5xx 错误（见 is_retryable）。
+        count_tokens: 函数，估算单条文本的 token 数。
+        """
+        self.embed_batch_fn = embed_batch_fn
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_items_per_batch = max_items_per_batch
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_on = retry_on
+        self.count_tokens = count_tokens
+        self.requests = 0
+        self.retries = 0
+        self._stats_lock = threading.Lock()
+        # 长期存在的线程池，max_workers 即全局在途请求上限
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embedding")
+
+    def __call__(self, texts):
+        return self.embed(texts)
+
+    def embed(self, texts):
+        '''计算一组文本的向量，按输入顺序返回'''
+        texts = list(texts)
+        if not texts:
+            return []
+        batches = pack_batches(
+            texts, self.max_tokens_per_batch, self.max_items_per_batch, self.count_tokens)
+        if len(batches) == 1:
+            # 单批次无需经过线程池
+            return self._embed_with_retry(texts)
+
+        futures = [
+            self._executor.submit(self._embed_with_retry, [texts[i] for i in batch])
+            for batch in batches
+        ]
+        vectors = [None] * len(texts)
+        for batch, future in zip(batches, futures):
+            for i, vector in zip(batch, future.result()):
+                vectors[i] = vector
+        return vectors
+
+    def _embed_with_retry(self, batch):
+        attempt = 0
+        while True:
+            with self._stats_lock:
+                self.requests += 1
+            try:
+                vectors = self.embed_batch_fn(batch)
+            except Exception as e:
+                if attempt >= self.max_retries or not self._should_retry(e):
+                    raise
+                with self._stats_lock:
+                    self.retries += 1
+                delay = self.backoff * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+                attempt += 1
+                continue
+            if len(vectors) != len(batch):
+                raise ValueError(f"期望 {len(batch)} 个向量，实际返回 {len(vectors)} 个")
+            return vectors
+
+    def _should_retry(self, error):
+        if isinstance(self.retry_on, tuple):
+            return isinstance(error, self.retry_on)
+        return self.retry_on(error)
+
+    def stats(self):
+        '''返回请求与重试次数'''
+        return {"requests": self.requests, "retries": self.retries}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,18 @@
+'''
+内容哈希：识别重复上传的文档与未变化的片段。只依赖标准库，langchain-ChatPDF 也直接使用本模块。
+'''
+import hashlib
+
+
+def content_hash(text):
+    '''计算文本内容的 sha256 哈希'''
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def file_sha256(filename):
+    '''计算文件内容的 sha256 哈希，用于识别重复上传的文档'''
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,318 @@
+import json
+import os
+import queue
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from hashing import file_sha256
+from vector_db import NamespaceDeletedError
+
+# 未结束的任务状态：queued 等待执行，running 由租约未过期的进程执行，租约过期后可被重新领取
+_PENDING = ("queued", "running")
+_COLUMNS = ("id", "source", "namespace", "doc_hash", "status", "attempts", "pages", "total_pages",
+            "chunks", "indexed", "error", "stats", "created", "updated")
+
+
+class JobCancelled(Exception):
+    '''任务在执行过程中被取消（所属命名空间已删除）或租约已被其他进程接管'''
+
+
+class IngestJobQueue:
+    def __init__(self, pipeline, path="ingest_jobs.db", upload_dir="ingest_uploads", workers=2,
+                 persist_interval=30.0, lease_seconds=60.0, poll_interval=5.0, namespaces=None):
+        """
+        后台导入任务队列：上传的文件登记为任务后立即返回，由 workers 个后台线程调用 IngestPipeline 导入。
+
+        - 任务表保存在 SQLite 中，每写入一批片段记录一次进度（检查点），可随时查询任务状态；
+        - 任务由执行它的进程以租约领取（owner 与 lease_until），领取是一条带条件的 UPDATE，
+          多个进程共用一个任务表时同一任务只会被领取一次；执行期间定期续约；
+        - 进程中途退出后，租约过期的任务由任意进程重新领取并继续：已写入的片段按内容哈希识别，
+          沿用已有向量，只为剩余片段计算向量；
+        - 命名空间被删除时（cancel_namespace）其任务标记为 cancelled，正在执行的任务在下一批写入前停止；
+          所属命名空间已失效的任务不再执行；
+        - 片段逐批写入向量数据库，导入过程中即可检索文档中已写入的部分。
+
+        参数:
+        pipeline: IngestPipeline 实例。
+        path: 字符串，任务数据库文件路径。
+        upload_dir: 字符串，待导入文件的保存目录（上传的临时文件可能被清理，任务完成前保留一份副本）。
+        workers: 整数，同时执行的任务数。
+        persist_interval: 秒数，导入过程中保存向量数据库的最短间隔（local 后端；chroma 写入时已持久化），
+            中断后重新计算向量的片段不超过这段时间内写入的片段。
+        lease_seconds: 秒数，领取任务的租约时长，每三分之一租约续约一次；
+            进程退出后其任务在租约过期后才会被重新领取。
+        poll_interval: 秒数，空闲时查找可领取任务（其他进程提交或租约过期）的间隔。
+        namespaces: NamespaceRegistry 实例，可选；所属命名空间已失效的任务直接取消。
+        """
+        self.pipeline = pipeline
+        self.path = path
+        self.upload_dir = upload_dir
+        self.workers = workers
+        self.persist_interval = persist_interval
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.namespaces = namespaces
+        # 本进程（本实例）的标识，写入领取的任务
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._threads = []
+        self._stop = threading.Event()
+        os.makedirs(upload_dir, exist_ok=True)
+        # 后台线程与请求线程共用一个连接，由 _lock 串行化
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " source TEXT NOT NULL,"
+            " namespace TEXT,"
+            " doc_hash TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " pages INTEGER NOT NULL DEFAULT 0,"
+            " total_pages INTEGER NOT NULL DEFAULT 0,"
+            " chunks INTEGER NOT NULL DEFAULT 0,"
+            " indexed INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " stats TEXT,"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL,"
+            " owner TEXT,"
+            " lease_until REAL)"
+        )
+        # 兼容没有租约列的旧任务表
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_document ON jobs(namespace, doc_hash)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created)")
+        self._conn.commit()
+
+    def _file_path(self, job_id):
+        return os.path.join(self.upload_dir, f"{job_id}.pdf")
+
+    def _remove_file(self, job_id):
+        try:
+            os.remove(self._file_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _execute(self, sql, params=()):
+        '''执行一条写语句并提交，返回受影响的行数'''
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor.rowcount
+
+    def _update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        self._execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                      (*fields.values(), job_id))
+
+    def _update_owned(self, job_id, **fields):
+        '''
+        更新本实例正在执行的任务并续约，返回是否成功；
+        任务已被取消或租约已被其他进程接管时返回 False
+        '''
+        now = time.time()
+        fields["updated"] = now
+        fields["lease_until"] = now + self.lease_seconds
+        return self._execute(
+            f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)}"
+            " WHERE id = ? AND owner = ? AND status = 'running'",
+            (*fields.values(), job_id, self.owner)) == 1
+
+    def _row(self, row):
+        job = dict(zip(_COLUMNS, row))
+        job["stats"] = json.loads(job["stats"]) if job["stats"] else None
+        return job
+
+    def get(self, job_id):
+        '''查询任务状态，返回字典（status 为 queued / running / done / failed / cancelled），不存在时返回 None'''
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def list(self, namespace=None, limit=100):
+        '''按提交时间倒序列出任务（指定 namespace 时只列出该命名空间的任务）'''
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM jobs"
+        params = ()
+        if namespace is not None:
+            sql += " WHERE namespace = ?"
+            params = (namespace,)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY created DESC LIMIT ?", (*params, limit)).fetchall()
+        return [self._row(row) for row in rows]
+
+    def submit(self, filename, source=None, namespace=None):
+        '''
+        登记导入任务并立即返回任务状态。
+
+        同一命名空间中内容相同的文档已有未完成、失败或被取消的任务时，继续该任务而不是新建，
+        避免部分写入的文档被误判为已导入。内容相同的文档已导入过时，任务的 source 为片段上已有的 source。
+        返回的 source 可能与传入的文件名不同，按文档检索时应使用返回的 source。
+        '''
+        source = source or os.path.basename(filename)
+        doc_hash = file_sha256(filename)
+        source = self.pipeline.vector_db.document_source(doc_hash, namespace) or source
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status FROM jobs WHERE namespace IS ? AND doc_hash = ? AND status != 'done'"
+                " ORDER BY created DESC LIMIT 1", (namespace, doc_hash)).fetchone()
+        if row is not None:
+            job_id, status = row
+            if status in ("failed", "cancelled"):
+                shutil.copyfile(filename, self._file_path(job_id))
+                self._update(job_id, status="queued", error=None, owner=None, lease_until=None)
+                self._queue.put(job_id)
+            return self.get(job_id)
+
+        job_id = uuid.uuid4().hex
+        shutil.copyfile(filename, self._file_path(job_id))
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, source, namespace, doc_hash, status, created, updated)"
+            " VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, source, namespace, doc_hash, now, now))
+        self._queue.put(job_id)
+        return self.get(job_id)
+
+    def retry(self, job_id):
+        '''重新执行失败的任务（从检查点继续），返回任务状态'''
+        job = self.get(job_id)
+        if job is not None and job["status"] == "failed" and os.path.exists(self._file_path(job_id)):
+            self._update(job_id, status="queued", error=None, owner=None, lease_until=None)
+            self._queue.put(job_id)
+            return self.get(job_id)
+        return job
+
+    def cancel_namespace(self, namespace, reason="namespace deleted"):
+        '''
+        取消命名空间中未结束的任务，返回取消的任务数。
+
+        等待中的任务不再执行；正在执行的任务在下一次记录进度时发现已被取消并停止，
+        由执行它的线程删除待导入文件
+        '''
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE namespace IS ? AND status = 'queued'", (namespace,)).fetchall()
+        cancelled = self._execute(
+            f"UPDATE jobs SET status = 'cancelled', error = ?, updated = ?"
+            f" WHERE namespace IS ? AND status IN ({','.join('?' * len(_PENDING))})",
+            (reason, time.time(), namespace, *_PENDING))
+        for (job_id,) in rows:
+            self._remove_file(job_id)
+        return cancelled
+
+    def _claim(self, job_id):
+        '''领取任务：只有等待中或租约已过期的任务能被领取，成功时返回任务状态'''
+        now = time.time()
+        claimed = self._execute(
+            "UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, attempts = attempts + 1,"
+            " updated = ? WHERE id = ? AND (status = 'queued' OR (status = 'running' AND lease_until < ?))",
+            (self.owner, now + self.lease_seconds, now, job_id, now))
+        return self.get(job_id) if claimed == 1 else None
+
+    def _claim_next(self):
+        '''按提交顺序领取下一个可执行的任务，没有时返回 None'''
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)"
+                " ORDER BY created LIMIT 16", (time.time(),)).fetchall()
+        for (job_id,) in rows:
+            job = self._claim(job_id)
+            if job is not None:
+                return job
+        return None
+
+    def start(self):
+        '''
+        启动后台线程。上次退出时未完成的任务不在这里重置：等待中的任务直接领取，
+        执行中的任务在其租约过期后领取，多个进程同时启动时不会重复执行
+        '''
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ingest-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="ingest-job-lease", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        '''停止后台线程（正在执行的任务完成后退出），未执行的任务留在任务表中，下次启动时继续'''
+        self._stop.set()
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _heartbeat(self):
+        '''为本实例正在执行的任务续约（解析 PDF 等阶段可能长时间不记录进度）'''
+        while not self._stop.wait(self.lease_seconds / 3):
+            self._execute(
+                "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, self.owner))
+
+    def _work(self):
+        while not self._stop.is_set():
+            job = self._claim_next()
+            if job is not None:
+                self._run(job)
+                continue
+            # 没有可领取的任务时等待本进程提交新任务，或到时再查找其他进程提交的与租约过期的任务
+            try:
+                if self._queue.get(timeout=self.poll_interval) is None:
+                    return
+            except queue.Empty:
+                pass
+
+    def _run(self, job):
+        job_id = job["id"]
+        if self.namespaces is not None and not self.namespaces.is_live(job["namespace"]):
+            # 会话已结束（如进程重启前的 Gradio 会话），导入的片段没有人能检索到
+            self._update_owned(job_id, status="cancelled", error="namespace expired")
+            self._remove_file(job_id)
+            return
+        last_persist = time.monotonic()
+
+        def checkpoint(stats):
+            nonlocal last_persist
+            if not self._update_owned(job_id, pages=stats["pages"], total_pages=stats["total_pages"],
+                                      chunks=stats["chunks"], indexed=stats["indexed"]):
+                raise JobCancelled(job_id)
+            if time.monotonic() - last_persist >= self.persist_interval:
+                with self.pipeline.vector_db.write_lock:
+                    self.pipeline.vector_db.persist()
+                last_persist = time.monotonic()
+
+        # 之前中断的导入没有完成标记，不会被当作已导入：已写入的片段沿用已有向量，只补齐剩余片段
+        try:
+            stats = self.pipeline.run(self._file_path(job_id), job["source"], job["doc_hash"],
+                                      progress=checkpoint, namespace=job["namespace"])
+        except (JobCancelled, NamespaceDeletedError):
+            # 已被 cancel_namespace 取消时不会再更新；命名空间被直接删除时在这里标记。
+            # 取消后又重新提交的任务使用同一个文件，只在任务仍是取消状态时删除
+            self._update_owned(job_id, status="cancelled", error="namespace deleted")
+            job = self.get(job_id)
+            if job is not None and job["status"] == "cancelled":
+                self._remove_file(job_id)
+            return
+        except Exception as e:
+            self._update_owned(job_id, status="failed", error=f"{type(e).__name__}: {e}")
+            return
+        self._update_owned(job_id, status="done", stats=json.dumps(stats), pages=stats["pages"],
+                           total_pages=stats["total_pages"], chunks=stats["chunks"], indexed=stats["indexed"])
+        self._remove_file(job_id)
+
+    def close(self):
+        self.stop()
+        self._conn.close()
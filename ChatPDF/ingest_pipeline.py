@@ -0,0 +1,190 @@
+import os
+import queue
+import threading
+import time
+
+from hashing import file_sha256
+from utilities import count_pdf_pages, create_extract_pool, iter_page_chunks, iter_pages_from_pdf
+
+# 阶段结束标记
+_DONE = object()
+
+
+class IngestPipeline:
+    def __init__(self, vector_db, chunk_size=300, overlap_size=100, min_line_length=10,
+                 batch_size=64, queue_size=4, embed_workers=2, extract_workers=1,
+                 length_function=None):
+        """
+        PDF 导入流水线：解析 → 切分 → 计算向量 → 写入向量数据库。
+
+        每个阶段在独立线程中运行，阶段之间用有界队列连接：下游处理不过来时上游阻塞（背压），
+        解析 PDF 的 CPU 时间与计算向量的网络等待相互重叠，总耗时接近最慢的阶段而不是各阶段之和。
+        写入基于 MyVectorDBConnector.start_sync，与 sync_document 一样是增量的。
+
+        参数:
+        vector_db: MyVectorDBConnector 实例。
+        chunk_size / overlap_size / length_function: 切分参数，同 split_text。
+        min_line_length: 解析参数，同 extract_text_from_pdf。
+        batch_size: 整数，每批计算向量与写入的片段数。
+        queue_size: 整数，阶段之间队列的容量。
+        embed_workers: 整数，同时计算向量的批次数。
+        extract_workers: 整数，解析 PDF 的进程数，同 iter_pages_from_pdf 的 workers。
+            大于 1 时创建一个进程池，由全部导入共用，close 时关闭。
+        """
+        self.vector_db = vector_db
+        self.chunk_size = chunk_size
+        self.overlap_size = overlap_size
+        self.min_line_length = min_line_length
+        self.length_function = length_function
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.embed_workers = embed_workers
+        self.extract_workers = extract_workers
+        self._extract_pool = create_extract_pool(extract_workers) if extract_workers > 1 else None
+
+    def run(self, filename, source=None, doc_hash=None, progress=None, namespace=None, resume=False):
+        '''
+        导入一个 PDF 文件，返回统计信息字典。
+
+        source: 文档标识，默认为文件名
+        doc_hash: 文档内容哈希，默认为文件的 sha256
+        progress: 回调函数，每写入一批片段调用一次，参数为统计信息字典的副本
+        namespace: 命名空间（如用户会话），同一命名空间中同一文档的导入串行执行，
+            不同命名空间或不同文档的导入可以并发
+        resume: 不检查导入完成标记，总是与已写入的片段比对一遍。中断的导入没有完成标记，
+            不指定 resume 也会继续：已写入的片段内容未变，沿用已有向量，只为剩余片段计算向量
+        '''
+        source = source or os.path.basename(filename)
+        doc_hash = doc_hash or file_sha256(filename)
+        with self.vector_db.document_lock(source, namespace):
+            return self._run(filename, source, doc_hash, progress, namespace, resume)
+
+    def _run(self, filename, source, doc_hash, progress, namespace, resume=False):
+        stats = {
+            "source": source, "namespace": namespace, "skipped": False,
+            "pages": 0, "total_pages": 0, "chunks": 0,
+            "embedded": 0, "indexed": 0, "deleted": 0, "seconds": 0.0,
+        }
+        start_time = time.perf_counter()
+
+        # 内容完全相同的文档已导入过（可能用的是另一个文件名），返回片段上的 source
+        if not resume:
+            stored_source = self.vector_db.document_source(doc_hash, namespace)
+            if stored_source is not None:
+                stats["skipped"] = True
+                stats["source"] = stored_source
+                return stats
+
+        stats["total_pages"] = count_pdf_pages(filename)
+        sync = self.vector_db.start_sync(source, doc_hash, namespace)
+        pages_queue = queue.Queue(self.queue_size)
+        batches_queue = queue.Queue(self.queue_size)
+        vectors_queue = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        errors = []
+        lock = threading.Lock()
+
+        def put(q, item):
+            '''放入队列，队列满时等待；流水线出错中止时返回 False'''
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def drain(q, producers=1):
+            '''逐个取出队列中的元素，直到收到 producers 个结束标记或流水线中止'''
+            finished = 0
+            while finished < producers and not stop.is_set():
+                try:
+                    item = q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    finished += 1
+                else:
+                    yield item
+
+        def extract():
+            for page in iter_pages_from_pdf(filename, None, self.min_line_length, self.extract_workers,
+                                            executor=self._extract_pool):
+                with lock:
+                    stats["pages"] += 1
+                if not put(pages_queue, page):
+                    return
+            put(pages_queue, _DONE)
+
+        def split():
+            batch, metadatas = [], []
+            for chunk, metadata in iter_page_chunks(
+                    drain(pages_queue), self.chunk_size, self.overlap_size, self.length_function):
+                batch.append(chunk)
+                metadatas.append(metadata)
+                if len(batch) >= self.batch_size:
+                    if not put(batches_queue, sync.prepare(batch, metadatas)):
+                        return
+                    with lock:
+                        stats["chunks"] += len(batch)
+                    batch, metadatas = [], []
+            if batch:
+                put(batches_queue, sync.prepare(batch, metadatas))
+                with lock:
+                    stats["chunks"] += len(batch)
+            for _ in range(self.embed_workers):
+                put(batches_queue, _DONE)
+
+        def embed():
+            for kept, added in drain(batches_queue):
+                # 内容未变的片段沿用已有向量，只为新增片段计算
+                embeddings = self.vector_db.embedding_fn([doc for _, doc, _ in added]) if added else []
+                with lock:
+                    stats["embedded"] += len(added)
+                if not put(vectors_queue, (kept, added, embeddings)):
+                    return
+            put(vectors_queue, _DONE)
+
+        def guarded(target):
+            def wrapper():
+                try:
+                    target()
+                except Exception as e:
+                    errors.append(e)
+                    stop.set()
+            return wrapper
+
+        threads = [threading.Thread(target=guarded(extract), name="ingest-extract", daemon=True),
+                   threading.Thread(target=guarded(split), name="ingest-split", daemon=True)]
+        threads += [threading.Thread(target=guarded(embed), name=f"ingest-embed-{i}", daemon=True)
+                    for i in range(self.embed_workers)]
+        for t in threads:
+            t.start()
+
+        # 写入阶段在当前线程执行
+        try:
+            for kept, added, embeddings in drain(vectors_queue, self.embed_workers):
+                sync.write(kept, added, embeddings)
+                with lock:
+                    stats["indexed"] += len(kept) + len(added)
+                    snapshot = dict(stats)
+                if progress is not None:
+                    progress(snapshot)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            for t in threads:
+                t.join()
+
+        if errors:
+            raise errors[0]
+
+        _, stats["deleted"] = sync.finish()
+        stats["seconds"] = time.perf_counter() - start_time
+        return stats
+
+    def close(self):
+        '''关闭解析 PDF 的进程池'''
+        if self._extract_pool is not None:
+            self._extract_pool.shutdown(wait=True, cancel_futures=True)
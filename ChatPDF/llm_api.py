@@ -26,4 +26,17 @@ def get_embeddings(texts, model="text-embedding-ada-002", dimensions=None):
             input=texts, model=model, dimensions=dimensions).data
     else:
         data = client.embeddings.create(input=texts, model=model).data
-    return [x.embedding for x in data]
\ No newline at end of file
+    return [x.embedding for x in data]
+
+def get_completion_stream(prompt, model="gpt-3.5-turbo-1106"):
+    '''封装 openai 流式接口，逐段 yield 生成的文本'''
+    messages = [{"role": "user", "content": prompt}]
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0,
+        stream=True,
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
@@ -0,0 +1,117 @@
+import os
+import threading
+
+import numpy as np
+
+# bge-*-zh-v1.5 推荐的检索问题前缀，文档不加前缀
+BGE_QUERY_INSTRUCTION = "为这个句子生成表示以用于检索相关文章："
+
+
+class BGEEmbedder:
+    def __init__(self, model_name="BAAI/bge-large-zh-v1.5", batch_size=32, max_length=512, normalize=True,
+                 backend="torch", quantize=False, onnx_dir="onnx_models",
+                 query_instruction=BGE_QUERY_INSTRUCTION):
+        """
+        本地 BGE Embedding，可直接作为 MyVectorDBConnector 的 embedding_fn（与 llm_api.get_embeddings 用法相同）。
+
+        - 模型只加载一次并常驻内存，所有请求共用；推理用锁串行化，延迟更稳定；
+        - 一次调用中的全部文本按长度排序后分批编码，同一批长度相近，padding 少；相同文本只编码一次；
+        - 输出单位向量，点积即余弦相似度；
+        - backend="onnx" 使用 ONNX Runtime 推理，quantize=True 时使用 int8 动态量化
+          （torch 后端量化 Linear 层，onnx 后端导出量化模型到 onnx_dir），CPU 上更快、内存更小。
+
+        参数:
+        model_name: 字符串，sentence-transformers 模型名或本地路径。
+        batch_size: 整数，每批编码的文本数。
+        max_length: 整数，每个文本的最大 token 数，超出部分截断。
+        normalize: 布尔值，是否输出单位向量。
+        backend: "torch" 或 "onnx"。
+        quantize: 布尔值，是否使用 int8 动态量化。
+        onnx_dir: 字符串，onnx 后端量化模型的保存目录。
+        query_instruction: 字符串，query_fn 给检索问题加的前缀，默认为 BGE_QUERY_INSTRUCTION
+            （与 langchain 版的 LocalBGEEmbeddings.embed_query 相同）；None 表示不加。
+        """
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"unsupported backend {backend!r}")
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.normalize = normalize
+        self.backend = backend
+        self.quantize = quantize
+        self.onnx_dir = onnx_dir
+        self.query_instruction = query_instruction
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+
+    @property
+    def name(self):
+        '''区分模型与运行方式的名称，用于缓存键与集合名'''
+        suffix = f"-{self.backend}" + ("-int8" if self.quantize else "")
+        return self.model_name + suffix
+
+    def _load(self):
+        with self._load_lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+
+                if self.backend == "onnx" and self.quantize:
+                    self._model = self._load_quantized_onnx()
+                else:
+                    model = SentenceTransformer(self.model_name, device="cpu", backend=self.backend)
+                    if self.quantize:
+                        import torch
+                        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                    self._model = model
+                self._model.max_seq_length = self.max_length
+        return self._model
+
+    def _load_quantized_onnx(self):
+        '''首次使用时导出 int8 量化的 ONNX 模型，之后直接加载'''
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+        path = os.path.join(self.onnx_dir, self.model_name.replace('/', '__'))
+        file_name = "onnx/model_qint8_avx2.onnx"
+        if not os.path.exists(os.path.join(path, file_name)):
+            model = SentenceTransformer(self.model_name, device="cpu", backend="onnx")
+            model.save(path)
+            export_dynamic_quantized_onnx_model(model, "avx2", path)
+        return SentenceTransformer(path, device="cpu", backend="onnx", model_kwargs={"file_name": file_name})
+
+    def warmup(self):
+        '''预先加载模型并完成一次编码，避免第一个请求承担加载耗时'''
+        self.encode(["warmup"])
+
+    def encode(self, texts):
+        '''编码一组文本，返回 (文本数, 维度) 的 float32 矩阵，顺序与输入一致'''
+        texts = list(texts)
+        model = self._load()
+        unique = list(dict.fromkeys(texts))
+        # 按长度排序后分批，同一批的 padding 最少
+        order = sorted(range(len(unique)), key=lambda i: len(unique[i]))
+        vectors = [None] * len(unique)
+        with self._encode_lock:
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                encoded = model.encode([unique[i] for i in batch], batch_size=len(batch),
+                                       normalize_embeddings=self.normalize, convert_to_numpy=True)
+                for i, vector in zip(batch, encoded):
+                    vectors[i] = vector
+        if not unique:
+            return np.zeros((0, 0), dtype=np.float32)
+        position = {text: i for i, text in enumerate(unique)}
+        matrix = np.stack(vectors).astype(np.float32)
+        return matrix[[position[text] for text in texts]]
+
+    def __call__(self, texts):
+        '''与 llm_api.get_embeddings 相同：输入文本列表，返回向量列表'''
+        return self.encode(texts).tolist()
+
+    def query_fn(self):
+        '''返回给问题加 query_instruction 前缀的 embedding 函数，作为 MyVectorDBConnector 的 query_embedding_fn'''
+        prefix = self.query_instruction or ""
+
+        def get_query_embeddings(texts):
+            return self.encode([prefix + t for t in texts]).tolist()
+        return get_query_embeddings
@@ -0,0 +1,616 @@
+import base64
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from similarity import CHUNK_ROWS, normalize, squared_norms, top_k
+
+# metadata 中建立倒排的字段，按这些字段等值过滤时无需逐条比较
+_INDEXED_FIELDS = ("source", "namespace", "doc_hash")
+
+
+def _match_value(value, condition):
+    if not isinstance(condition, dict):
+        return value == condition
+    for op, target in condition.items():
+        if op == "$eq":
+            ok = value == target
+        elif op == "$ne":
+            ok = value != target
+        elif op == "$in":
+            ok = value in target
+        elif op == "$nin":
+            ok = value not in target
+        elif value is None:
+            ok = False
+        elif op == "$gt":
+            ok = value > target
+        elif op == "$gte":
+            ok = value >= target
+        elif op == "$lt":
+            ok = value < target
+        elif op == "$lte":
+            ok = value <= target
+        else:
+            raise ValueError(f"unsupported operator {op!r}")
+        if not ok:
+            return False
+    return True
+
+
+def match_where(metadata, where):
+    '''判断 metadata 是否满足 chroma 风格的 where 条件（支持 $and/$or/$eq/$ne/$gt/$gte/$lt/$lte/$in/$nin）'''
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(match_where(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(match_where(metadata, c) for c in condition):
+                return False
+        elif not _match_value(metadata.get(key), condition):
+            return False
+    return True
+
+
+def _encode_vectors(vectors):
+    '''向量矩阵编码为 {"shape", "data"(base64 的 float32)}，写入 JSON 日志'''
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return {"shape": list(vectors.shape), "data": base64.b64encode(vectors.tobytes()).decode("ascii")}
+
+
+def _decode_vectors(encoded):
+    return np.frombuffer(base64.b64decode(encoded["data"]), dtype=np.float32).reshape(encoded["shape"])
+
+
+def _kmeans(data, k, iterations=10, seed=0):
+    '''在 data 上训练 k 个聚类中心（Lloyd 算法），返回 float32 矩阵'''
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assign = _nearest_centroid(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=k)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+    return centroids
+
+
+def _nearest_centroid(data, centroids):
+    '''返回每一行最近的聚类中心编号（L2 距离）'''
+    c2 = squared_norms(centroids)
+    assign = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), CHUNK_ROWS):
+        block = np.asarray(data[start:start + CHUNK_ROWS], dtype=np.float32)
+        assign[start:start + len(block)] = np.argmin(c2[None, :] - 2 * block @ centroids.T, axis=1)
+    return assign
+
+
+class LocalCollection:
+    def __init__(self, name="local", dtype="float32", metric="l2", ivf_threshold=50000, nprobe=16):
+        """
+        纯 NumPy 实现的向量集合，接口与 chroma 的 Collection 相同（add / update / delete / get / query / count），
+        可作为 MyVectorDBConnector 的后端替换 chroma。
+
+        向量保存在一个连续的矩阵中，检索时一次矩阵乘法计算全部距离，再用 argpartition 取前 k 个；
+        多个问题同时检索时合并为一次矩阵乘法。片段数超过 ivf_threshold 后自动建立 IVF 分区，
+        检索时只计算距离最近的 nprobe 个分区，以少量召回率换取检索速度。
+
+        参数:
+        name: 字符串，集合名称。
+        dtype: 向量存储类型，"float32"、"float16"（内存减半）或 "int8"（按行缩放量化，内存为 1/4）。
+            后两者检索时分块转换为 float32 计算，单个问题的检索比 float32 慢，批量检索时转换开销被分摊。
+        metric: 距离，"l2"（平方 L2，与 chroma 默认一致）、"cosine"（1 - 余弦相似度）或 "ip"（负内积）。
+        ivf_threshold: 整数，建立 IVF 分区的片段数，None 表示始终暴力检索。
+        nprobe: 整数，IVF 检索时计算的分区数。
+        """
+        if dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"unsupported dtype {dtype!r}")
+        if metric not in ("l2", "cosine", "ip"):
+            raise ValueError(f"unsupported metric {metric!r}")
+        self.name = name
+        self.dtype = dtype
+        self.metric = metric
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+
+        self._ids = []          # 行号 -> id，已删除的行为 None
+        self._documents = []
+        self._metadatas = []
+        self._rows = {}         # id -> 行号
+        self._fields = {}       # 字段 -> 值 -> 行号集合
+        self._vectors = None    # (容量, 维度)，按 dtype 存储
+        self._scales = None     # int8 的每行缩放系数
+        self._norms = None      # 每行原始向量的平方范数，计算 L2 距离使用
+        self._alive = np.zeros(0, dtype=bool)
+        self._size = 0          # 已使用的行数（含已删除的行）
+        self._centroids = None  # IVF 聚类中心
+        self._assign = None     # 每行所属的分区
+        self._lists = None      # 分区 -> 行号数组，延迟构建
+        self._ivf_size = 0      # 建立 IVF 时的片段数
+        self._journal = None    # 保存或加载后记录的写入操作，flush 时追加到日志；None 表示不记录
+        self._journal_rows = 0  # 上次完整保存以来日志涉及的行数
+
+    # ---- 存储 ----
+
+    def count(self):
+        return len(self._rows)
+
+    def _prepare(self, embeddings):
+        '''将向量转换为存储格式，返回 (存储的向量, 缩放系数, 平方范数)'''
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if self.metric == "cosine":
+            vectors = normalize(vectors)
+        sq_norms = squared_norms(vectors)
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32), sq_norms
+        return vectors.astype(self.dtype), None, sq_norms
+
+    def _reserve(self, n, dim):
+        '''保证还能写入 n 行，容量不足时按倍数扩容；从磁盘映射的只读矩阵在此复制到内存'''
+        if self._vectors is None:
+            capacity = max(1024, n)
+            self._vectors = np.zeros((capacity, dim), dtype=self.dtype)
+            self._scales = np.ones(capacity, dtype=np.float32)
+            self._norms = np.zeros(capacity, dtype=np.float32)
+            self._alive = np.zeros(capacity, dtype=bool)
+            self._assign = np.full(capacity, -1, dtype=np.int32)
+            return
+        if self._vectors.shape[1] != dim:
+            raise ValueError(f"embedding dimension {dim} does not match collection dimension {self._vectors.shape[1]}")
+        needed = self._size + n
+        if needed <= len(self._vectors) and self._vectors.flags.writeable:
+            return
+        capacity = max(needed, len(self._vectors) * 2, 1024)
+
+        def grow(array, fill=0):
+            grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            grown[:self._size] = array[:self._size]
+            return grown
+
+        self._vectors = grow(self._vectors)
+        self._scales = grow(self._scales, 1)
+        self._norms = grow(self._norms)
+        self._alive = grow(self._alive, False)
+        self._assign = grow(self._assign, -1)
+
+    def _index_fields(self, row, metadata, add=True):
+        for key in _INDEXED_FIELDS:
+            if metadata and key in metadata:
+                rows = self._fields.setdefault(key, {}).setdefault(metadata[key], set())
+                if add:
+                    rows.add(row)
+                else:
+                    rows.discard(row)
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        '''添加片段，与 chroma 一致，已存在的 id 会被忽略'''
+        with self._lock:
+            documents = documents or [None] * len(ids)
+            metadatas = metadatas or [None] * len(ids)
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in self._rows]
+            if len(set(ids[i] for i in keep)) != len(keep):
+                raise ValueError("duplicate ids in add")
+            if not keep:
+                return
+            vectors, scales, sq_norms = self._prepare([embeddings[i] for i in keep])
+            self._reserve(len(keep), vectors.shape[1])
+            start, end = self._size, self._size + len(keep)
+            self._vectors[start:end] = vectors
+            if scales is not None:
+                self._scales[start:end] = scales
+            self._norms[start:end] = sq_norms
+            self._alive[start:end] = True
+            for row, i in enumerate(keep, start):
+                self._ids.append(ids[i])
+                self._documents.append(documents[i])
+                self._metadatas.append(dict(metadatas[i]) if metadatas[i] else None)
+                self._rows[ids[i]] = row
+                self._index_fields(row, metadatas[i])
+            self._size = end
+            if self._journal is not None:
+                self._journal.append({
+                    "op": "add", "ids": [ids[i] for i in keep],
+                    "documents": [documents[i] for i in keep], "metadatas": [metadatas[i] for i in keep],
+                    "embeddings": _encode_vectors([embeddings[i] for i in keep])})
+            if self._centroids is not None:
+                self._assign[start:end] = _nearest_centroid(self._decode(start, end), self._centroids)
+                self._lists = None
+            self._maybe_build_ivf()
+
+    def update(self, ids, embeddings=None, metadatas=None, documents=None):
+        '''更新片段，与 chroma 一致，metadata 与原有 metadata 合并'''
+        with self._lock:
+            rows = [self._rows.get(chunk_id) for chunk_id in ids]
+            if embeddings is not None:
+                self._reserve(0, len(embeddings[0]))
+                vectors, scales, sq_norms = self._prepare(embeddings)
+            for i, row in enumerate(rows):
+                if row is None:
+                    continue
+                if metadatas is not None and metadatas[i] is not None:
+                    self._index_fields(row, self._metadatas[row], add=False)
+                    self._metadatas[row] = dict(self._metadatas[row] or {}, **metadatas[i])
+                    self._index_fields(row, self._metadatas[row])
+                if documents is not None:
+                    self._documents[row] = documents[i]
+                if embeddings is not None:
+                    self._vectors[row] = vectors[i]
+                    if scales is not None:
+                        self._scales[row] = scales[i]
+                    self._norms[row] = sq_norms[i]
+                    if self._centroids is not None:
+                        self._assign[row] = _nearest_centroid(self._decode(row, row + 1), self._centroids)[0]
+                        self._lists = None
+            if self._journal is not None:
+                op = {"op": "update", "ids": list(ids), "metadatas": metadatas, "documents": documents}
+                if embeddings is not None:
+                    op["embeddings"] = _encode_vectors(embeddings)
+                self._journal.append(op)
+
+    def delete(self, ids=None, where=None):
+        '''按 id 或 where 条件删除片段；与 chroma 相同，两者都不指定时报错，不会清空集合'''
+        if ids is None and where is None:
+            raise ValueError("delete requires ids or where")
+        with self._lock:
+            rows = self._filter_rows(where, ids)
+            if self._journal is not None and len(rows):
+                self._journal.append({"op": "delete", "ids": [self._ids[row] for row in rows.tolist()]})
+            for row in rows.tolist():
+                self._index_fields(row, self._metadatas[row], add=False)
+                del self._rows[self._ids[row]]
+                self._ids[row] = self._documents[row] = self._metadatas[row] = None
+                self._alive[row] = False
+            self._lists = None
+            dead = self._size - len(self._rows)
+            if dead > 1024 and dead > len(self._rows):
+                self._compact()
+
+    def _compact(self):
+        '''去掉已删除的行，需持有锁'''
+        rows = np.flatnonzero(self._alive[:self._size])
+        self._vectors = self._vectors[rows]
+        self._scales = self._scales[rows]
+        self._norms = self._norms[rows]
+        self._alive = self._alive[rows]
+        self._assign = self._assign[rows]
+        self._ids = [self._ids[r] for r in rows]
+        self._documents = [self._documents[r] for r in rows]
+        self._metadatas = [self._metadatas[r] for r in rows]
+        self._size = len(rows)
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._fields = {}
+        for row, metadata in enumerate(self._metadatas):
+            self._index_fields(row, metadata)
+        self._lists = None
+
+    # ---- IVF ----
+
+    def _maybe_build_ivf(self):
+        n = len(self._rows)
+        if self.ivf_threshold is None or n < self.ivf_threshold:
+            return
+        # 片段数比上次建立时翻倍后重新训练聚类中心
+        if self._centroids is None or n >= 2 * self._ivf_size:
+            self.build_ivf()
+
+    def build_ivf(self, nlist=None, sample_size=None):
+        '''
+        建立 IVF 分区：在（采样的）向量上训练 nlist 个聚类中心，把每一行分到最近的中心。
+
+        nlist: 分区数，默认约为 sqrt(片段数)
+        sample_size: 训练使用的向量数，默认为 nlist 的 64 倍
+        '''
+        with self._lock:
+            alive = np.flatnonzero(self._alive[:self._size])
+            if not len(alive):
+                return
+            nlist = min(nlist or int(np.sqrt(len(alive))), len(alive))
+            sample_size = min(sample_size or nlist * 64, len(alive))
+            sample = np.random.default_rng(0).choice(alive, sample_size, replace=False)
+            sample.sort()
+            self._centroids = _kmeans(self._decode_rows(sample), nlist)
+            for start in range(0, self._size, CHUNK_ROWS):
+                end = min(start + CHUNK_ROWS, self._size)
+                self._assign[start:end] = _nearest_centroid(self._decode(start, end), self._centroids)
+            self._ivf_size = len(alive)
+            self._lists = None
+
+    def _ivf_lists(self):
+        if self._lists is None:
+            rows = np.flatnonzero(self._alive[:self._size])
+            assign = self._assign[rows]
+            order = np.argsort(assign, kind='stable')
+            bounds = np.searchsorted(assign[order], np.arange(len(self._centroids) + 1))
+            self._lists = [rows[order[bounds[i]:bounds[i + 1]]] for i in range(len(self._centroids))]
+        return self._lists
+
+    # ---- 检索 ----
+
+    def _decode(self, start, end):
+        '''取出 [start, end) 行的 float32 向量'''
+        block = np.asarray(self._vectors[start:end], dtype=np.float32)
+        if self.dtype == "int8":
+            block *= self._scales[start:end, None]
+        return block
+
+    def _decode_rows(self, rows):
+        block = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self.dtype == "int8":
+            block *= self._scales[rows, None]
+        return block
+
+    def _distances(self, queries, rows=None):
+        '''
+        计算 queries 到指定行（None 表示 [0, size) 全部行）的距离矩阵 (问题数, 行数)，越小越相关。
+        float32 的全部行直接一次矩阵乘法；其余情况分块转换后计算。
+        '''
+        n = self._size if rows is None else len(rows)
+        dots = np.empty((len(queries), n), dtype=np.float32)
+        if rows is None and self.dtype == "float32":
+            dots[:] = queries @ self._vectors[:n].T
+        else:
+            for start in range(0, n, CHUNK_ROWS):
+                if rows is None:
+                    end = min(start + CHUNK_ROWS, n)
+                    block = np.asarray(self._vectors[start:end], dtype=np.float32)
+                    scales = self._scales[start:end]
+                else:
+                    chunk = rows[start:start + CHUNK_ROWS]
+                    block = np.asarray(self._vectors[chunk], dtype=np.float32)
+                    scales = self._scales[chunk]
+                block_dots = queries @ block.T
+                if self.dtype == "int8":
+                    block_dots *= scales[None, :]
+                dots[:, start:start + len(block)] = block_dots
+        if self.metric == "l2":
+            norms = self._norms[:n] if rows is None else self._norms[rows]
+            q_norms = squared_norms(queries)
+            return np.maximum(q_norms[:, None] + norms[None, :] - 2 * dots, 0)
+        if self.metric == "cosine":
+            return 1 - dots
+        return -dots
+
+    def _filter_rows(self, where=None, ids=None):
+        '''返回满足条件的行号数组；可以用倒排字段直接求交集时不逐条比较 metadata'''
+        if ids is not None:
+            rows = np.array(sorted(self._rows[i] for i in set(ids) if i in self._rows), dtype=np.int64)
+        else:
+            rows = None
+        if where:
+            indexed, rest = [], {}
+            conditions = where["$and"] if list(where) == ["$and"] else [{k: v} for k, v in where.items()]
+            for condition in conditions:
+                key, value = next(iter(condition.items())) if len(condition) == 1 else (None, None)
+                if key in _INDEXED_FIELDS and not isinstance(value, dict):
+                    indexed.append(self._fields.get(key, {}).get(value, set()))
+                else:
+                    rest = {"$and": [rest, condition]} if rest else condition
+            if indexed:
+                matched = set.intersection(*indexed)
+                candidate = np.array(sorted(matched), dtype=np.int64)
+                rows = candidate if rows is None else np.intersect1d(rows, candidate)
+            if rows is None:
+                rows = np.flatnonzero(self._alive[:self._size])
+            if rest:
+                rows = np.array([r for r in rows.tolist() if match_where(self._metadatas[r], rest)],
+                                dtype=np.int64)
+            return rows
+        if rows is None:
+            rows = np.flatnonzero(self._alive[:self._size])
+        return rows
+
+    def _records(self, rows, include):
+        result = {"ids": [self._ids[r] for r in rows]}
+        if "documents" in include:
+            result["documents"] = [self._documents[r] for r in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self._metadatas[r] for r in rows]
+        if "embeddings" in include:
+            result["embeddings"] = self._decode_rows(np.asarray(rows, dtype=np.int64)).tolist() if rows else []
+        return result
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("metadatas", "documents")):
+        '''按 id 或 where 条件取回片段，按写入顺序排列'''
+        with self._lock:
+            rows = self._filter_rows(where, ids).tolist()
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            return self._records(rows, include)
+
+    def query(self, query_embeddings, n_results=10, where=None,
+              include=("metadatas", "documents", "distances")):
+        '''检索每个问题向量最近的 n_results 个片段，返回与 chroma query 相同结构的结果'''
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        if self.metric == "cosine":
+            queries = normalize(queries)
+
+        with self._lock:
+            if self._vectors is None or not self._rows:
+                rows_per_query = [np.empty(0, dtype=np.int64)] * len(queries)
+                distances = [np.empty(0, dtype=np.float32)] * len(queries)
+            elif self._centroids is not None:
+                rows_per_query, distances = self._query_ivf(queries, n_results, where)
+            else:
+                rows_per_query, distances = self._query_flat(queries, n_results, where)
+
+            results = {key: [] for key in ("ids",) + tuple(include)}
+            for rows, dist in zip(rows_per_query, distances):
+                records = self._records(rows.tolist(), include)
+                for key, value in records.items():
+                    results[key].append(value)
+                if "distances" in include:
+                    results["distances"].append(dist.tolist())
+            return results
+
+    def _query_flat(self, queries, n_results, where):
+        if where:
+            rows = self._filter_rows(where)
+            distances = self._distances(queries, rows)
+        else:
+            rows = None
+            distances = self._distances(queries)
+            # 已删除的行不参与排序
+            distances[:, ~self._alive[:self._size]] = np.inf
+        k = min(n_results, len(self._rows) if rows is None else len(rows))
+        if k == 0:
+            return [np.empty(0, dtype=np.int64)] * len(queries), [np.empty(0, dtype=np.float32)] * len(queries)
+        top, top_distances = top_k(distances, k, largest=False)
+        if rows is not None:
+            top = rows[top]
+        return list(top), list(top_distances)
+
+    def _query_ivf(self, queries, n_results, where):
+        '''
+        IVF 检索。有 where 条件时先过滤：满足条件的行不多于 nprobe 个分区的平均行数时直接精确检索；
+        否则在分区中检索，过滤后不足 n_results 个的问题改为在满足条件的行中精确检索，
+        小命名空间或单个文档不会因为分区选得不对而漏掉结果
+        '''
+        lists = self._ivf_lists()
+        nprobe = min(self.nprobe, len(lists))
+        allowed = filtered = None
+        if where:
+            filtered = self._filter_rows(where)
+            if len(filtered) <= nprobe * len(self._rows) / len(lists):
+                return self._query_flat(queries, n_results, where)
+            allowed = np.zeros(self._size, dtype=bool)
+            allowed[filtered] = True
+        c2 = squared_norms(self._centroids)
+        probes = np.argpartition(c2[None, :] - 2 * queries @ self._centroids.T, nprobe - 1, axis=1)[:, :nprobe]
+        rows_per_query, distances_per_query = [], []
+        for query, probe in zip(queries, probes):
+            rows = np.concatenate([lists[p] for p in probe])
+            if allowed is not None:
+                rows = rows[allowed[rows]]
+                if len(rows) < min(n_results, len(filtered)):
+                    rows = filtered
+            k = min(n_results, len(rows))
+            if k == 0:
+                rows_per_query.append(np.empty(0, dtype=np.int64))
+                distances_per_query.append(np.empty(0, dtype=np.float32))
+                continue
+            distances = self._distances(query[None, :], rows)
+            top, top_distances = top_k(distances[0], k, largest=False)
+            rows_per_query.append(rows[top])
+            distances_per_query.append(top_distances)
+        return rows_per_query, distances_per_query
+
+    # ---- 持久化 ----
+
+    def save(self, path):
+        '''
+        完整保存到目录：向量为 .npy 文件（可按内存映射方式加载），文本与 metadata 为 JSON Lines，不使用 pickle。
+        先写入临时目录再替换，保存中途出错不会破坏已有数据。之后的写入由 flush 追加到日志。
+        '''
+        with self._lock:
+            tmp = path + ".tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            rows = np.flatnonzero(self._alive[:self._size]) if self._vectors is not None else np.empty(0, int)
+            if self._vectors is not None:
+                np.save(os.path.join(tmp, "vectors.npy"), self._vectors[rows])
+                np.save(os.path.join(tmp, "scales.npy"), self._scales[rows])
+                np.save(os.path.join(tmp, "norms.npy"), self._norms[rows])
+                np.save(os.path.join(tmp, "assign.npy"), self._assign[rows])
+            if self._centroids is not None:
+                np.save(os.path.join(tmp, "centroids.npy"), self._centroids)
+            with open(os.path.join(tmp, "records.jsonl"), "w", encoding="utf-8") as f:
+                for row in rows.tolist():
+                    f.write(json.dumps({"id": self._ids[row], "document": self._documents[row],
+                                        "metadata": self._metadatas[row]}, ensure_ascii=False) + "\n")
+            with open(os.path.join(tmp, "collection.json"), "w", encoding="utf-8") as f:
+                json.dump({"name": self.name, "dtype": self.dtype, "metric": self.metric,
+                           "ivf_threshold": self.ivf_threshold, "nprobe": self.nprobe,
+                           "ivf_size": self._ivf_size}, f)
+            if os.path.exists(path):
+                old = path + ".old"
+                shutil.rmtree(old, ignore_errors=True)
+                os.rename(path, old)
+                os.rename(tmp, path)
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                os.rename(tmp, path)
+            # 新目录中没有日志，之前记录的操作都已包含在快照中
+            self._journal = []
+            self._journal_rows = 0
+
+    def flush(self, path, compact_ratio=0.5):
+        '''
+        增量保存：把上次保存以来的写入（添加的向量、metadata 更新、删除）追加到 path/journal.jsonl，
+        耗时只与新写入的片段数有关。目录中还没有快照，或日志涉及的行数超过片段数的 compact_ratio 倍
+        （且超过 1024 行）时改为完整保存，日志随之清空。
+        '''
+        with self._lock:
+            if (self._journal is None or not os.path.exists(os.path.join(path, "collection.json"))
+                    or self._journal_rows > max(1024, compact_ratio * len(self._rows))):
+                self.save(path)
+                return
+            if not self._journal:
+                return
+            with open(os.path.join(path, "journal.jsonl"), "a", encoding="utf-8") as f:
+                for op in self._journal:
+                    f.write(json.dumps(op, ensure_ascii=False) + "\n")
+                    self._journal_rows += len(op["ids"])
+            self._journal = []
+
+    def _replay(self, path):
+        '''重放快照之后的日志；进程在追加日志时退出可能留下不完整的最后一行，忽略该行'''
+        journal_path = os.path.join(path, "journal.jsonl")
+        if not os.path.exists(journal_path):
+            return
+        with open(journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if op["op"] == "add":
+                    self.add(op["ids"], _decode_vectors(op["embeddings"]), op["documents"], op["metadatas"])
+                elif op["op"] == "update":
+                    embeddings = _decode_vectors(op["embeddings"]) if "embeddings" in op else None
+                    self.update(op["ids"], embeddings, op["metadatas"], op["documents"])
+                else:
+                    self.delete(op["ids"])
+                self._journal_rows += len(op["ids"])
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''从 save 保存的目录加载；mmap 为 True 时向量矩阵按内存映射方式只读打开，首次写入时才复制到内存'''
+        with open(os.path.join(path, "collection.json"), encoding="utf-8") as f:
+            config = json.load(f)
+        collection = cls(config["name"], config["dtype"], config["metric"],
+                         config["ivf_threshold"], config["nprobe"])
+        with open(os.path.join(path, "records.jsonl"), encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                record = json.loads(line)
+                collection._ids.append(record["id"])
+                collection._documents.append(record["document"])
+                collection._metadatas.append(record["metadata"])
+                collection._rows[record["id"]] = row
+                collection._index_fields(row, record["metadata"])
+        collection._size = len(collection._ids)
+        vectors_path = os.path.join(path, "vectors.npy")
+        if os.path.exists(vectors_path):
+            mode = 'r' if mmap else None
+            collection._vectors = np.load(vectors_path, mmap_mode=mode, allow_pickle=False)
+            collection._scales = np.load(os.path.join(path, "scales.npy"), allow_pickle=False)
+            collection._norms = np.load(os.path.join(path, "norms.npy"), allow_pickle=False)
+            collection._assign = np.load(os.path.join(path, "assign.npy"), allow_pickle=False)
+            collection._alive = np.ones(collection._size, dtype=bool)
+        centroids_path = os.path.join(path, "centroids.npy")
+        if os.path.exists(centroids_path):
+            collection._centroids = np.load(centroids_path, allow_pickle=False)
+            collection._ivf_size = config["ivf_size"]
+        collection._replay(path)
+        collection._journal = []
+        return collection
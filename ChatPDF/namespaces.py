@@ -0,0 +1,114 @@
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class NamespaceRegistry:
+    def __init__(self, path="namespaces.db", ttl=24 * 3600, touch_interval=60.0):
+        """
+        命名空间（如 Gradio 会话）的最近使用时间登记表，用于清理已结束会话留下的片段。
+
+        会话正常结束时由 unload 删除命名空间；进程退出、浏览器崩溃等情况下 unload 不会执行，
+        片段会一直留在持久化目录中。超过 ttl 秒没有导入或问答的命名空间视为失效，由 sweep 删除。
+        未指定命名空间（None）的共享文档不登记，也不会被清理。
+
+        参数:
+        path: 字符串，登记表的 SQLite 文件路径。
+        ttl: 秒数，命名空间最后一次使用后保留的时间。
+        touch_interval: 秒数，同一命名空间两次写入使用时间的最短间隔，避免每次问答都写数据库。
+        """
+        self.path = path
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS namespaces (namespace TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+        self._conn.commit()
+
+    def touch(self, namespace):
+        '''记录命名空间被使用'''
+        if namespace is None:
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._touched.get(namespace, 0) < self.touch_interval:
+                return
+            self._touched[namespace] = now
+            self._conn.execute(
+                "INSERT INTO namespaces (namespace, last_seen) VALUES (?, ?) "
+                "ON CONFLICT(namespace) DO UPDATE SET last_seen = excluded.last_seen", (namespace, now))
+            self._conn.commit()
+
+    def forget(self, namespace):
+        '''命名空间已删除，不再登记'''
+        with self._lock:
+            self._touched.pop(namespace, None)
+            self._conn.execute("DELETE FROM namespaces WHERE namespace = ?", (namespace,))
+            self._conn.commit()
+
+    def is_live(self, namespace):
+        '''命名空间是否仍在使用：已登记且未超过 ttl；None（共享文档）总是有效'''
+        if namespace is None:
+            return True
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_seen FROM namespaces WHERE namespace = ?", (namespace,)).fetchone()
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def expired(self):
+        '''超过 ttl 未使用的命名空间'''
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT namespace FROM namespaces WHERE last_seen < ?", (time.time() - self.ttl,)).fetchall()
+        return [row[0] for row in rows]
+
+    def sweep(self, delete_fn, stored=()):
+        '''
+        删除失效的命名空间，返回被删除的命名空间列表。
+
+        delete_fn: 删除一个命名空间的函数，如 RAGService.delete_namespace（会调用 forget）。
+        stored: 数据中已有的命名空间。没有登记的（如登记表建立之前写入的）从现在开始计时，
+            超过 ttl 后再删除，而不是立即删除。
+        '''
+        for namespace in stored:
+            if namespace is not None:
+                with self._lock:
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO namespaces (namespace, last_seen) VALUES (?, ?)",
+                        (namespace, time.time()))
+                    self._conn.commit()
+        expired = self.expired()
+        for namespace in expired:
+            delete_fn(namespace)
+            self.forget(namespace)
+        return expired
+
+    def start(self, delete_fn, stored=(), interval=600.0):
+        '''启动时清理一次，之后在后台线程中每 interval 秒清理一次'''
+        self.sweep(delete_fn, stored)
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.sweep(delete_fn)
+                except Exception:
+                    # 清理失败不影响服务，下一轮再试
+                    logger.exception("清理命名空间失败")
+
+        self._thread = threading.Thread(target=loop, name="namespace-sweeper", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self._conn.close()
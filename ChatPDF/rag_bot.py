@@ -1,20 +1,282 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from prompt_base import prompt_template
 from utilities import build_prompt
+from tracing import NOOP_SPAN, tracer
 
 class RAG_Bot:    
-    def __init__(self, vector_db, llm_api, n_results=2):
+    def __init__(self, vector_db, llm_api, n_results=2, llm_stream_api=None,
+                 answer_cache=None, model="gpt-3.5-turbo-1106", reranker=None, rerank_candidates=8,
+                 context_packer=None):
         self.vector_db = vector_db
         self.llm_api = llm_api
         self.n_results = n_results
+        # 流式接口，逐段 yield 文本；未提供时 chat_stream 退化为一次性输出
+        self.llm_stream_api = llm_stream_api
+        # 回答缓存（AnswerCache），model 为 llm_api 使用的模型名，用于区分缓存
+        self.answer_cache = answer_cache
+        self.model = model
+        # 重排（CrossEncoderReranker）：先检索 rerank_candidates 个候选，重排后保留 n_results 个
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        # 已知信息组装（ContextPacker）：合并重叠片段、去重句子并限制 token 数；未提供时直接拼接片段
+        self.context_packer = context_packer
+
+    def _cache_namespace(self, source, namespace=None):
+        if self.answer_cache is None:
+            return None
+        return self.answer_cache.make_namespace(
+            self.vector_db.namespace_version(namespace), self.model, prompt_template, source, namespace)
+
+    def cached_answer(self, user_query, source=None, namespace=None):
+        '''查询回答缓存，命中时返回与 answer 相同结构的结果（cached 为 True），否则返回 None'''
+        if self.answer_cache is None:
+            return None
+        start = time.perf_counter()
+        with tracer.span("answer_cache") as span:
+            result = self.answer_cache.lookup(user_query, self._cache_namespace(source, namespace))
+            span.set(hit=result is not None)
+        tracer.count("answer_cache_total", result="hit" if result is not None else "miss")
+        if result is None:
+            return None
+        return dict(result, cached=True, timings={'cache': time.perf_counter() - start})
+
+    def _store_answer(self, user_query, cache_namespace, result):
+        # cache_namespace 在检索前取得：生成期间有新写入时，回答记在旧版本下，不会被新版本命中
+        if self.answer_cache is not None:
+            self.answer_cache.store(user_query, cache_namespace, result)
+
+    def retrieve(self, user_query, source=None, namespace=None):
+        '''
+        检索与问题相关的文档，返回 documents、对应的 metadatas 与 distances（越小越相关）
+
+        source: 只在指定来源的文档中检索，默认检索全部文档
+        namespace: 只在指定命名空间（如用户会话）的文档中检索
+        '''
+        return self._rerank(user_query, self._search(user_query, source, namespace))
+
+    def _search(self, user_query, source=None, namespace=None):
+        return self._search_batch([user_query], source, namespace)[0]
+
+    def _search_batch(self, user_queries, source=None, namespace=None):
+        top_n = self.rerank_candidates if self.reranker is not None else self.n_results
+        with tracer.span("retrieve", queries=len(user_queries), top_n=top_n):
+            if len(user_queries) == 1:
+                search_results = self.vector_db.search(
+                    user_queries[0], top_n, source=source, namespace=namespace)
+            else:
+                search_results = self.vector_db.search_batch(
+                    user_queries, top_n, source=source, namespace=namespace)
+        empty = [[]] * len(user_queries)
+        return [
+            {"documents": documents, "metadatas": metadatas, "distances": distances}
+            for documents, metadatas, distances in zip(
+                search_results['documents'],
+                search_results.get('metadatas') or empty,
+                search_results.get('distances') or empty)
+        ]
+
+    def _rerank(self, user_query, retrieved):
+        '''用 reranker 重排候选并保留 n_results 个；未配置 reranker 或超出耗时上限时按检索顺序截取'''
+        if self.reranker is None:
+            return retrieved
+        with tracer.span("rerank", candidates=len(retrieved['documents'])) as span:
+            ranked = self.reranker.rerank(user_query, retrieved['documents'], self.n_results)
+            span.set(skipped=ranked is None)
+        if ranked is None:
+            return {key: values[:self.n_results] for key, values in retrieved.items()}
+        result = {key: [values[i] for i, _ in ranked] if values else values
+                  for key, values in retrieved.items()}
+        result["rerank_scores"] = [score for _, score in ranked]
+        return result
+
+    def build_prompt(self, user_query, retrieved):
+        '''构建 Prompt，返回 (prompt, 组装统计)；未配置 context_packer 时统计为 None'''
+        with tracer.span("build_prompt", documents=len(retrieved['documents'])) as span:
+            if self.context_packer is None:
+                return build_prompt(prompt_template, context=retrieved['documents'], query=user_query), None
+            packed = self.context_packer.pack(retrieved['documents'], retrieved.get('metadatas'))
+            stats = {key: packed[key] for key in ("tokens", "original_tokens", "saved_tokens")}
+            span.set(context_tokens=packed['tokens'], saved_tokens=packed['saved_tokens'])
+            return build_prompt(prompt_template, context=packed['context'], query=user_query), stats
+
+    def _generate(self, prompt):
+        '''调用 LLM；token 用量与重试次数由 LLM 客户端记到 generate span 上'''
+        with tracer.span("generate", model=self.model, prompt_chars=len(prompt)):
+            return self.llm_api(prompt)
+
+    def answer(self, user_query, source=None, namespace=None):
+        '''
+        检索并生成回答，只检索一次。
+
+        返回字典:
+        answer: LLM 的回答
+        documents: 检索到的文档片段
+        distances: 对应的向量距离，越小越相关
+        metadatas: 文档片段的来源、页码等信息
+        timings: 各阶段耗时（秒），包括 retrieve / rerank（配置了 reranker 时）/ prompt / generate
+        context_tokens: 配置了 context_packer 时，已知信息的 token 数与节省的 token 数
+        cached: 是否来自回答缓存
+        '''
+        with tracer.span("answer") as span:
+            result = self._answer(user_query, source, namespace)
+            span.set(cached=result['cached'])
+            return result
+
+    def _answer(self, user_query, source=None, namespace=None):
+        cached = self.cached_answer(user_query, source, namespace)
+        if cached is not None:
+            return cached
+
+        cache_namespace = self._cache_namespace(source, namespace)
+        timings = {}
 
-    def chat(self, user_query):
         # 1. 检索
-        search_results = self.vector_db.search(user_query, self.n_results)
+        start = time.perf_counter()
+        retrieved = self._search(user_query, source, namespace)
+        timings['retrieve'] = time.perf_counter() - start
+
+        # 2. 重排（可选）
+        if self.reranker is not None:
+            start = time.perf_counter()
+            retrieved = self._rerank(user_query, retrieved)
+            timings['rerank'] = time.perf_counter() - start
+
+        # 3. 构建 Prompt
+        start = time.perf_counter()
+        prompt, context_tokens = self.build_prompt(user_query, retrieved)
+        timings['prompt'] = time.perf_counter() - start
+
+        # 4. 调用 LLM
+        start = time.perf_counter()
+        response = self._generate(prompt)
+        timings['generate'] = time.perf_counter() - start
+
+        result = {
+            "answer": response,
+            "documents": retrieved['documents'],
+            "metadatas": retrieved['metadatas'],
+            "distances": retrieved['distances'],
+        }
+        self._store_answer(user_query, cache_namespace, result)
+        return dict(result, cached=False, timings=timings, context_tokens=context_tokens)
+
+    def answer_batch(self, user_queries, source=None, namespace=None, max_workers=8):
+        '''
+        回答针对同一范围（如同一文档）的一组问题，结果按问题顺序排列，每个结果与 answer 的返回值结构相同。
+
+        命中缓存的问题直接返回；其余问题的向量一次计算、一次检索，再并发调用 LLM（最多 max_workers 个），
+        timings 中的 retrieve 为批量检索耗时按问题数平均。
+        '''
+        user_queries = list(user_queries)
+        with tracer.span("answer_batch", queries=len(user_queries)):
+            return self._answer_batch(user_queries, source, namespace, max_workers)
+
+    def _answer_batch(self, user_queries, source, namespace, max_workers):
+        results = [self.cached_answer(q, source, namespace) for q in user_queries]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+
+        cache_namespace = self._cache_namespace(source, namespace)
+        start = time.perf_counter()
+        retrieved = self._search_batch([user_queries[i] for i in pending], source, namespace)
+        retrieve_time = (time.perf_counter() - start) / len(pending)
+
+        def generate(item):
+            i, hits = item
+            timings = {'retrieve': retrieve_time}
+            if self.reranker is not None:
+                start = time.perf_counter()
+                hits = self._rerank(user_queries[i], hits)
+                timings['rerank'] = time.perf_counter() - start
+            start = time.perf_counter()
+            prompt, context_tokens = self.build_prompt(user_queries[i], hits)
+            timings['prompt'] = time.perf_counter() - start
+            start = time.perf_counter()
+            response = self._generate(prompt)
+            timings['generate'] = time.perf_counter() - start
+            result = {
+                "answer": response,
+                "documents": hits['documents'],
+                "metadatas": hits['metadatas'],
+                "distances": hits['distances'],
+            }
+            self._store_answer(user_queries[i], cache_namespace, result)
+            return dict(result, cached=False, timings=timings, context_tokens=context_tokens)
+
+        # 线程池不传递上下文，每个任务在提交线程的上下文副本中执行，span 仍属于 answer_batch
+        contexts = [contextvars.copy_context() for _ in pending]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+            outcomes = executor.map(lambda context, item: context.run(generate, item),
+                                    contexts, zip(pending, retrieved))
+            for i, result in zip(pending, outcomes):
+                results[i] = result
+        return results
+
+    def chat(self, user_query, source=None, namespace=None):
+        return self.answer(user_query, source, namespace)["answer"]
+
+    def chat_stream(self, user_query, retrieved=None, source=None, namespace=None, trace=None):
+        '''
+        流式回答，逐段 yield 文本。
+
+        retrieved: retrieve 的返回值，传入时不再重复检索
+        trace: 所属的 span（如 RAGService.query_stream 的根 span），默认新建 chat_stream span
+        完整的回答生成后写入回答缓存；调用方可先用 cached_answer 查询缓存
+        '''
+        # 生成器的每次恢复可能在不同的上下文中执行，span 不跨 yield 设为当前 span，只在各阶段内临时激活
+        root = trace or tracer.start("chat_stream")
+        generate = NOOP_SPAN
+        try:
+            with tracer.activate(root):
+                cache_namespace = self._cache_namespace(source, namespace)
+                if retrieved is None:
+                    retrieved = self.retrieve(user_query, source, namespace)
+                prompt, _ = self.build_prompt(user_query, retrieved)
 
-        # 2. 构建 Prompt
-        prompt = build_prompt(
-            prompt_template, context=search_results['documents'][0], query=user_query)
+            generate = tracer.start("generate", parent=root or None, model=self.model,
+                                    prompt_chars=len(prompt), stream=True)
+            if self.llm_stream_api is None:
+                with tracer.activate(generate):
+                    response = self.llm_api(prompt)
+                yield response
+            else:
+                parts = []
+                stream = self.llm_stream_api(prompt)
+                start = time.perf_counter()
+                done = object()
+                while True:
+                    # 每次读取在 generate span 中进行，建立连接时的重试记在该 span 上
+                    with tracer.activate(generate):
+                        token = next(stream, done)
+                    if token is done:
+                        break
+                    if not parts:
+                        generate.set(first_token_seconds=time.perf_counter() - start)
+                    parts.append(token)
+                    yield token
+                generate.set(chunks=len(parts))
+                response = ''.join(parts)
+            generate.end()
+        except GeneratorExit:
+            # 调用方提前停止读取（如客户端断开）
+            generate.set(cancelled=True).end()
+            raise
+        except Exception as e:
+            generate.end(e)
+            if trace is None:
+                root.end(e)
+            raise
+        finally:
+            if trace is None:
+                root.end()
 
-        # 3. 调用 LLM
-        response = self.llm_api(prompt)
-        return response
\ No newline at end of file
+        self._store_answer(user_query, cache_namespace, {
+            "answer": response,
+            "documents": retrieved['documents'],
+            "metadatas": retrieved.get('metadatas', []),
+            "distances": retrieved.get('distances', []),
+        })
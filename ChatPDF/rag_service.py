@@ -0,0 +1,263 @@
+'''
+问答服务的核心：LLM 客户端、Embedding、向量数据库、RAG_Bot 与导入流水线，由 Gradio 界面（app.py）
+与 HTTP 服务（api_server.py）共用。配置读取环境变量，见 create_service。
+'''
+import os
+import time
+
+from vector_db import MyVectorDBConnector
+from rag_bot import RAG_Bot
+from async_llm import AsyncLLMClient
+from embedding_cache import EmbeddingCache, cached_embedding_fn
+from embedding_engine import EmbeddingEngine
+from ingest_pipeline import IngestPipeline
+from ingest_jobs import IngestJobQueue
+from answer_cache import AnswerCache
+from reranker import CrossEncoderReranker
+from context_packer import ContextPacker
+from local_embedding import BGEEmbedder
+from namespaces import NamespaceRegistry
+from tracing import configure_from_env, tracer
+
+
+class RAGService:
+    def __init__(self, vector_db, bot, ingest_pipeline, llm_client=None, embedding_cache=None,
+                 ingest_concurrency=2, query_concurrency=16, jobs=None, namespaces=None):
+        """
+        问答服务的操作接口：导入文档、问答（一次性、流式与批量）、删除命名空间、健康检查与指标。
+        api_client.APIClient 通过 HTTP 提供相同的方法，Gradio 界面可以使用任意一个。
+
+        参数:
+        ingest_concurrency: 整数，同时进行的导入数上限（由调用方的队列或信号量执行）。
+        query_concurrency: 整数，同时进行的问答数上限，通常与 LLM 客户端的并发上限相同。
+        jobs: IngestJobQueue 实例（已启动），提供后台导入；为空时 submit_ingest 不可用。
+        namespaces: NamespaceRegistry 实例，记录命名空间的使用时间，长时间未使用的由 sweep_namespaces 删除。
+        """
+        self.vector_db = vector_db
+        self.bot = bot
+        self.ingest_pipeline = ingest_pipeline
+        self.llm_client = llm_client
+        self.embedding_cache = embedding_cache
+        self.ingest_concurrency = ingest_concurrency
+        self.query_concurrency = query_concurrency
+        self.jobs = jobs
+        self.namespaces = namespaces
+        self.started = time.time()
+
+    def _touch(self, namespace):
+        if self.namespaces is not None:
+            self.namespaces.touch(namespace)
+
+    def ingest(self, filename, source=None, namespace=None, progress=None):
+        '''导入 PDF 文件，返回导入统计（见 IngestPipeline.run）'''
+        self._touch(namespace)
+        return self.ingest_pipeline.run(filename, source, progress=progress, namespace=namespace)
+
+    def submit_ingest(self, filename, source=None, namespace=None):
+        '''提交后台导入任务，立即返回任务状态（见 IngestJobQueue.get）'''
+        if self.jobs is None:
+            raise RuntimeError("background ingestion is not configured")
+        self._touch(namespace)
+        return self.jobs.submit(filename, source, namespace)
+
+    def job_status(self, job_id):
+        '''查询导入任务状态，不存在时返回 None'''
+        return self.jobs.get(job_id) if self.jobs is not None else None
+
+    def document_count(self, namespace=None):
+        '''命名空间中的片段数'''
+        return self.vector_db.collection_size(namespace)
+
+    def has_documents(self, namespace=None):
+        '''命名空间中是否有文档，比 document_count 开销小，问答前检查用'''
+        self._touch(namespace)
+        return self.vector_db.has_documents(namespace)
+
+    def query(self, question, source=None, namespace=None):
+        '''检索并生成回答，返回 RAG_Bot.answer 的结果'''
+        self._touch(namespace)
+        return self.bot.answer(question, source=source, namespace=namespace)
+
+    def query_batch(self, questions, source=None, namespace=None):
+        '''批量回答同一范围内的一组问题，检索合并为一次，返回 RAG_Bot.answer_batch 的结果'''
+        self._touch(namespace)
+        return self.bot.answer_batch(questions, source=source, namespace=namespace,
+                                     max_workers=self.query_concurrency)
+
+    def query_stream(self, question, source=None, namespace=None):
+        '''
+        流式问答，逐个 yield 事件字典:
+        {"event": "references", "documents": [...], "metadatas": [...], "cached": 布尔值}：检索到的片段，最先产生；
+        {"event": "token", "text": 文本}：回答的一段，命中缓存时只有一段完整的回答
+        '''
+        self._touch(namespace)
+        # 生成器跨 yield 时上下文可能不同，根 span 只在各阶段内临时激活
+        root = tracer.start("query_stream")
+        try:
+            with tracer.activate(root):
+                cached = self.bot.cached_answer(question, source=source, namespace=namespace)
+            root.set(cached=cached is not None)
+            if cached is not None:
+                yield {"event": "references", "documents": cached['documents'],
+                       "metadatas": cached['metadatas'], "cached": True}
+                yield {"event": "token", "text": cached['answer']}
+                return
+
+            # 只检索一次，参考文档与生成共用本次检索结果
+            with tracer.activate(root):
+                retrieved = self.bot.retrieve(question, source=source, namespace=namespace)
+            yield {"event": "references", "documents": retrieved['documents'],
+                   "metadatas": retrieved['metadatas'], "cached": False}
+            for token in self.bot.chat_stream(question, retrieved=retrieved, source=source,
+                                              namespace=namespace, trace=root or None):
+                yield {"event": "token", "text": token}
+        except Exception as e:
+            root.end(e)
+            raise
+        finally:
+            root.end()
+
+    def delete_namespace(self, namespace):
+        '''删除命名空间（如已结束的会话）下的全部片段，并取消其未完成的导入任务'''
+        if self.jobs is not None:
+            self.jobs.cancel_namespace(namespace)
+        self.vector_db.delete_namespace(namespace)
+        if self.namespaces is not None:
+            self.namespaces.forget(namespace)
+
+    def sweep_namespaces(self):
+        '''删除长时间未使用的命名空间（如没有正常结束的会话），返回被删除的命名空间列表'''
+        if self.namespaces is None:
+            return []
+        return self.namespaces.sweep(self.delete_namespace)
+
+    def health(self):
+        return {"status": "ok", "documents": self.document_count(),
+                "uptime": time.time() - self.started}
+
+    def metrics(self):
+        '''各组件的统计：片段数、LLM 请求、回答缓存、Embedding 缓存与重排'''
+        metrics = {"documents": self.document_count(), "collection_version": self.vector_db.version}
+        if self.llm_client is not None:
+            metrics["llm"] = self.llm_client.stats()
+        if self.bot.answer_cache is not None:
+            metrics["answer_cache"] = self.bot.answer_cache.stats()
+        if self.embedding_cache is not None:
+            metrics["embedding_cache"] = self.embedding_cache.stats()
+        if self.bot.reranker is not None:
+            metrics["reranker"] = self.bot.reranker.stats()
+        if tracer.enabled:
+            metrics["tracing"] = tracer.snapshot()
+        return metrics
+
+    def prometheus_metrics(self):
+        '''Prometheus 文本格式的指标：各阶段的耗时直方图与计数器，以及 metrics 中各组件的数值统计（gauge）'''
+        lines = [tracer.prometheus_text().rstrip("\n")]
+        for component, values in self.metrics().items():
+            if not isinstance(values, dict):
+                values = {None: values}
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"{tracer.prefix}_{component}" + (f"_{key}" if key else "")
+                    lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def create_service():
+    '''
+    按环境变量创建问答服务:
+    LOCAL_EMBEDDING_MODEL: 设置后使用本地 BGE Embedding，EMBEDDING_BACKEND / EMBEDDING_QUANTIZE 选择运行方式
+    RERANK_MODEL: 设置后启用 cross-encoder 重排
+    LLM_CONCURRENCY: 同时在途的 LLM 请求数，默认 16
+    INGEST_CONCURRENCY: 同时进行的导入数，默认 2
+    TRACING / TRACE_FILE: 启用分阶段追踪与 JSON lines 追踪文件，见 tracing.configure_from_env
+    '''
+    configure_from_env()
+
+    # 所有用户共用的 LLM 客户端：连接池、全局并发上限、超时重试，相同的在途请求只调用一次
+    llm_client = AsyncLLMClient(max_concurrency=int(os.getenv("LLM_CONCURRENCY", "16")))
+
+    # Embedding 缓存，重复上传的文档和重复的问题不再重新计算向量
+    embedding_cache = EmbeddingCache("embedding_cache.db")
+
+    if os.getenv("LOCAL_EMBEDDING_MODEL"):
+        # 本地 Embedding（如 BAAI/bge-large-zh-v1.5）：离线运行、无调用费用，需要 sentence-transformers；
+        # EMBEDDING_BACKEND=onnx 使用 ONNX Runtime，EMBEDDING_QUANTIZE=1 使用 int8 量化
+        embedder = BGEEmbedder(
+            os.getenv("LOCAL_EMBEDDING_MODEL"),
+            backend=os.getenv("EMBEDDING_BACKEND", "torch"),
+            quantize=os.getenv("EMBEDDING_QUANTIZE") == "1"
+        )
+        embedder.warmup()
+        embedding_fn = cached_embedding_fn(embedder, embedding_cache, model=embedder.name)
+        # 检索问题加 BGE 推荐的前缀（文档不加），加前缀后向量不同，缓存单独区分
+        query_embedding_fn = cached_embedding_fn(embedder.query_fn(), embedding_cache,
+                                                 model=f"{embedder.name}-query")
+        # 向量维度与 OpenAI 不同，使用单独的集合
+        collection_name = "demo_text_split_local"
+    else:
+        # 分批并发计算 Embedding，避免大文档超出单次请求的限制；重试由 llm_client 负责
+        embedding_engine = EmbeddingEngine(llm_client.embedding_fn(), max_workers=4, max_retries=0)
+
+        # 带缓存的 Embedding 函数，检索与回答缓存共用
+        embedding_fn = cached_embedding_fn(embedding_engine, embedding_cache)
+        query_embedding_fn = embedding_fn
+        collection_name = "demo_text_split"
+
+    # 创建一个向量数据库对象，数据持久化到本地目录。文档按会话划分命名空间，新会话需要重新上传；
+    # 同一会话中已导入的文档不重复计算向量
+    vector_db = MyVectorDBConnector(
+        collection_name,
+        embedding_fn,
+        persist_path="chroma_db",
+        # 向量检索与 BM25 关键词检索融合，型号、数字、章节标题等精确词也能召回
+        keyword_index=True,
+        search_mode="hybrid",
+        query_embedding_fn=query_embedding_fn
+    )
+
+    # 可选的重排：设置 RERANK_MODEL（如 cross-encoder/ms-marco-MiniLM-L-6-v2）后启用，需要 transformers 与 torch。
+    # 检索 8 个候选，重排后只把最相关的 2 个放进 Prompt；单次重排预计超过 0.3 秒时跳过
+    reranker = None
+    if os.getenv("RERANK_MODEL"):
+        reranker = CrossEncoderReranker(os.getenv("RERANK_MODEL"), budget=0.3)
+        reranker.warmup()
+
+    # 创建一个RAG机器人
+    bot = RAG_Bot(
+        vector_db,
+        llm_api=llm_client.completion_fn(),
+        llm_stream_api=llm_client.completion_stream_fn(),
+        # 重复或相近的问题直接返回缓存的回答，导入新文档后自动失效
+        answer_cache=AnswerCache(query_embedding_fn),
+        reranker=reranker,
+        rerank_candidates=8,
+        # 合并检索结果中重叠的片段、去掉重复的句子，已知信息不超过 2000 token
+        context_packer=ContextPacker(model="gpt-3.5-turbo-1106", max_tokens=2000)
+    )
+
+    # 导入流水线，页数较多时按页分组并行解析；解析进程池由全部导入共用，进程数默认为 2，
+    # 不随 CPU 核数增加，以免与向量计算、问答争用 CPU
+    ingest_pipeline = IngestPipeline(vector_db, extract_workers=int(os.getenv("EXTRACT_WORKERS", "2")))
+
+    # 导入是 CPU 密集的，同时进行的导入数量较少；问答主要等待 LLM，并发上限与 LLM 客户端相同
+    ingest_concurrency = int(os.getenv("INGEST_CONCURRENCY", "2"))
+
+    # 会话没有正常结束（进程退出、浏览器崩溃）时 unload 不会删除它的文档；
+    # 超过 NAMESPACE_TTL 秒（默认一天）未使用的命名空间在启动时与之后每 10 分钟清理一次
+    namespaces = NamespaceRegistry("namespaces.db", ttl=float(os.getenv("NAMESPACE_TTL", 24 * 3600)))
+
+    # 后台导入任务：任务表与待导入文件保存在本地，进程重启后未完成的任务从检查点继续；
+    # 所属会话已失效的任务不再执行
+    jobs = IngestJobQueue(ingest_pipeline, "ingest_jobs.db", "ingest_uploads", workers=ingest_concurrency,
+                          namespaces=namespaces).start()
+
+    service = RAGService(
+        vector_db, bot, ingest_pipeline, llm_client, embedding_cache,
+        ingest_concurrency=ingest_concurrency,
+        query_concurrency=llm_client.max_concurrency,
+        jobs=jobs,
+        namespaces=namespaces
+    )
+    namespaces.start(service.delete_namespace, stored=vector_db.stored_namespaces())
+    return service
@@ -0,0 +1,151 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from embedding_cache import normalize_text
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size=32, max_length=512,
+                 cache_size=10000, budget=None, score_pairs=None, probe_interval=30.0):
+        """
+        Cross-encoder 重排：对 (问题, 片段) 逐对打分，比向量距离更准确。
+
+        - 全部候选一次批量前向计算（按长度排序分批，减少 padding），而不是逐对调用模型；
+        - (问题, 片段) 的分数按 LRU 缓存，重复的问题与片段不再计算；
+        - 记录每对的平均耗时，预计超过 budget 秒时跳过重排，调用方沿用向量检索的顺序；
+          跳过期间每 probe_interval 秒放行一次重排重新测量，一次偶然的慢测量不会让重排永久停用。
+
+        参数:
+        model_name: 字符串，HuggingFace 上的 cross-encoder 模型。
+        batch_size: 整数，每次前向计算的 (问题, 片段) 对数。
+        max_length: 整数，每对的最大 token 数，超出部分截断。
+        cache_size: 整数，缓存的分数个数。
+        budget: 秒数，单次重排的耗时上限，None 表示不限。
+        score_pairs: 函数，输入 [(问题, 片段)]，返回分数列表；默认加载 model_name 模型在 CPU 上计算。
+        probe_interval: 秒数，因超出 budget 跳过重排时，距上次测量超过这段时间则放行一次重新测量。
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.budget = budget
+        self.score_pairs = score_pairs or self._score_with_model
+        self.probe_interval = probe_interval
+        self._model = None
+        self._tokenizer = None
+        self._model_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 每对的平均打分耗时（指数滑动平均），首次打分前未知
+        self.pair_seconds = None
+        # 上次打分（或放行测量）的时间
+        self._measured_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def _load(self):
+        '''加载模型（只加载一次，之后所有请求共用）'''
+        with self._model_lock:
+            if self._model is None:
+                from transformers import AutoModelForSequenceClassification, AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+                model.eval()
+                self._model = model
+        return self._model, self._tokenizer
+
+    def warmup(self):
+        '''预先加载模型并完成一次计算，避免第一个请求承担加载耗时'''
+        self.score_pairs([("warmup", "warmup")])
+
+    def _score_with_model(self, pairs):
+        import torch
+
+        model, tokenizer = self._load()
+        # 长度相近的放在同一批，减少 padding
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]))
+        scores = [0.0] * len(pairs)
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                features = tokenizer(
+                    [pairs[i][0] for i in batch], [pairs[i][1] for i in batch],
+                    padding=True, truncation=True, max_length=self.max_length, return_tensors="pt")
+                logits = model(**features).logits.squeeze(-1).tolist()
+                for i, score in zip(batch, logits if isinstance(logits, list) else [logits]):
+                    scores[i] = score
+        return scores
+
+    @staticmethod
+    def _key(query, document):
+        return (normalize_text(query), hashlib.sha1(document.encode('utf-8')).hexdigest())
+
+    def score(self, query, documents, budget=None):
+        '''
+        计算问题与每个片段的相关度分数（越大越相关）。
+
+        budget: 本次的耗时上限（秒），默认使用构造时的 budget；
+            需要计算的对数预计超出上限时返回 None
+        '''
+        budget = self.budget if budget is None else budget
+        keys = [self._key(query, doc) for doc in documents]
+        scores = [None] * len(documents)
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+            missing = [i for i, s in enumerate(scores) if s is None]
+            self.hits += len(documents) - len(missing)
+            if not missing:
+                return scores
+            probe = False
+            if budget is not None and self.pair_seconds is not None and self.pair_seconds * len(missing) > budget:
+                if time.monotonic() - self._measured_at < self.probe_interval:
+                    self.skipped += 1
+                    return None
+                # 估计值可能来自一次偶然的慢测量（如模型冷启动、机器繁忙），放行这一次重新测量；
+                # 同时到达的其他请求仍然跳过
+                probe = True
+                self._measured_at = time.monotonic()
+
+        start = time.perf_counter()
+        computed = self.score_pairs([(query, documents[i]) for i in missing])
+        elapsed = (time.perf_counter() - start) / len(missing)
+        with self._cache_lock:
+            # 放行测量时直接采用新测量值，否则按指数滑动平均更新
+            if self.pair_seconds is None or probe:
+                self.pair_seconds = elapsed
+            else:
+                self.pair_seconds = 0.8 * self.pair_seconds + 0.2 * elapsed
+            self._measured_at = time.monotonic()
+            self.misses += len(missing)
+            for i, score in zip(missing, computed):
+                scores[i] = score
+                self._cache[keys[i]] = score
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return scores
+
+    def rerank(self, query, documents, top_k, budget=None):
+        '''
+        按相关度重排，返回前 top_k 个片段的 (下标, 分数)；超出耗时上限时返回 None
+        '''
+        scores = self.score(query, documents, budget)
+        if scores is None:
+            return None
+        order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)[:top_k]
+        return [(i, scores[i]) for i in order]
+
+    def stats(self):
+        '''返回缓存命中、计算与跳过的次数'''
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "pair_ms": self.pair_seconds * 1000 if self.pair_seconds is not None else None,
+            "cached": len(self._cache),
+        }
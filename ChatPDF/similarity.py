@@ -0,0 +1,133 @@
+'''
+向量相似度的批量计算：一次矩阵乘法算出 (问题数, 片段数) 的分数矩阵，代替逐对调用 cos_sim / l2 的 Python 循环。
+
+输入为 NumPy 数组（或可转换为数组的列表），一维数组视为单个向量。
+'''
+import numpy as np
+
+# 分块计算时每块的片段数，限制临时矩阵与 float32 转换的内存
+CHUNK_ROWS = 65536
+
+
+def _as_matrix(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x[None, :] if x.ndim == 1 else x
+
+
+def squared_norms(x):
+    '''每一行的平方范数'''
+    x = _as_matrix(x)
+    return np.einsum('ij,ij->i', x, x)
+
+
+def normalize(x):
+    '''按行归一化为单位向量，零向量保持不变'''
+    x = _as_matrix(x)
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms == 0, 1, norms)
+
+
+def dot_similarity(queries, corpus):
+    '''内积矩阵 (问题数, 片段数) -- 越大越相似'''
+    return _as_matrix(queries) @ _as_matrix(corpus).T
+
+
+def cosine_similarity(queries, corpus):
+    '''余弦相似度矩阵 (问题数, 片段数) -- 越大越相似'''
+    return normalize(queries) @ normalize(corpus).T
+
+
+def squared_l2(queries, corpus, query_norms=None, corpus_norms=None):
+    '''
+    平方欧氏距离矩阵 (问题数, 片段数) -- 越小越相似。
+
+    按 |q|^2 + |d|^2 - 2 q·d 展开，主要计算量是一次矩阵乘法；
+    片段的平方范数可预先算好通过 corpus_norms 传入，避免每次检索重复计算。
+    '''
+    queries, corpus = _as_matrix(queries), _as_matrix(corpus)
+    if query_norms is None:
+        query_norms = squared_norms(queries)
+    if corpus_norms is None:
+        corpus_norms = squared_norms(corpus)
+    distances = query_norms[:, None] + corpus_norms[None, :] - 2 * (queries @ corpus.T)
+    # 浮点误差可能产生很小的负数
+    return np.maximum(distances, 0, out=distances)
+
+
+def l2_distance(queries, corpus):
+    '''欧氏距离矩阵 (问题数, 片段数) -- 越小越相似'''
+    return np.sqrt(squared_l2(queries, corpus))
+
+
+_METRICS = {
+    # 度量 -> (分数函数, 分数越大越相似)
+    "cosine": (cosine_similarity, True),
+    "dot": (dot_similarity, True),
+    "l2": (squared_l2, False),
+}
+
+
+def top_k(scores, k, largest=True):
+    '''
+    每一行取分数最大（largest=False 时最小）的 k 个位置，按分数排序，返回 (位置, 分数)。
+
+    先用 argpartition 在 O(n) 内选出 k 个，再只对这 k 个排序，不对整行排序。
+    '''
+    scores = np.asarray(scores)
+    if scores.ndim == 1:
+        positions, values = top_k(scores[None, :], k, largest)
+        return positions[0], values[0]
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        empty = np.empty((len(scores), 0))
+        return empty.astype(np.int64), empty.astype(scores.dtype)
+    keyed = -scores if largest else scores
+    if k < n:
+        top = np.argpartition(keyed, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(n), (len(scores), n))
+    order = np.argsort(np.take_along_axis(keyed, top, axis=1), axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    return top, np.take_along_axis(scores, top, axis=1)
+
+
+def search(queries, corpus, k, metric="cosine", chunk_rows=CHUNK_ROWS):
+    '''
+    在 corpus 中检索每个问题最相似的 k 个片段，返回 (位置, 分数)，每个都是 (问题数, k) 的矩阵。
+
+    corpus 按 chunk_rows 行分块计算，每块只保留前 k 个再与之前的结果合并，
+    内存占用与片段总数无关；corpus 可以是 np.load(..., mmap_mode='r') 得到的内存映射数组，
+    也可以是依次产生向量块的可迭代对象（如逐个读取的文件），用于放不进内存的语料。
+
+    metric: "cosine"、"dot" 或 "l2"（平方欧氏距离，分数越小越相似）。
+    '''
+    if metric not in _METRICS:
+        raise ValueError(f"unsupported metric {metric!r}")
+    score_fn, largest = _METRICS[metric]
+    queries = _as_matrix(queries)
+    if metric == "cosine":
+        # 问题只归一化一次，各块只归一化片段
+        queries = normalize(queries)
+        score_fn = dot_similarity
+
+    if isinstance(corpus, np.ndarray) or isinstance(corpus, list):
+        corpus = np.asarray(corpus)
+        blocks = (corpus[start:start + chunk_rows] for start in range(0, len(corpus), chunk_rows))
+    else:
+        blocks = iter(corpus)
+
+    best_positions = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    offset = 0
+    for block in blocks:
+        block = _as_matrix(block)
+        if metric == "cosine":
+            block = normalize(block)
+        positions, scores = top_k(score_fn(queries, block), k, largest)
+        merged_scores = np.concatenate([best_scores, scores], axis=1)
+        merged_positions = np.concatenate([best_positions, positions + offset], axis=1)
+        top, best_scores = top_k(merged_scores, k, largest)
+        best_positions = np.take_along_axis(merged_positions, top, axis=1)
+        offset += len(block)
+    return best_positions, best_scores
@@ -0,0 +1,206 @@
+'''
+本地的 OpenAI 兼容桩服务，用于在不访问 OpenAI 的情况下测试和压测 Embedding 与对话补全调用。
+
+用法:
+    python stub_server.py --port 8001 --latency 0.05 --max-inputs 64 --tokens-per-second 50
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub python app.py
+'''
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_embedding(text, dimensions=1536):
+    '''根据文本哈希生成确定性的单位向量，相同文本总是得到相同向量'''
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def fake_completion(messages, max_words=40):
+    '''根据最后一条消息生成确定性的回答'''
+    content = messages[-1]["content"] if messages else ""
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    words = [f"token{digest[i % 64]}{i}" for i in range(max_words)]
+    return "stub answer: " + ' '.join(words)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # 保持连接，便于测试客户端的连接池
+    protocol_version = "HTTP/1.1"
+    # 由 make_stub_server 按实例配置覆盖
+    latency = 0.0
+    max_inputs = 2048
+    failure_rate = 0.0
+    dimensions = 1536
+    tokens_per_second = 0.0
+    answer_words = 40
+    stats = None
+    stats_lock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.rstrip('/')
+        with self.stats_lock:
+            self.stats[path] = self.stats.get(path, 0) + 1
+        if path.endswith("/embeddings"):
+            self._handle_embeddings(request)
+        elif path.endswith("/chat/completions"):
+            self._handle_chat(request)
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def _handle_chat(self, request):
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            self._send_json(503, {"error": {"message": "stub overloaded", "type": "server_error"}})
+            return
+
+        answer = fake_completion(request.get("messages", []), self.answer_words)
+        tokens = answer.split(' ')
+        delay = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        model = request.get("model", "stub")
+        created = int(time.time())
+        usage = {"prompt_tokens": sum(len(m.get("content") or "") for m in request.get("messages", [])) // 4,
+                 "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not request.get("stream"):
+            time.sleep(delay * len(tokens))
+            self._send_json(200, {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": answer}}],
+                "usage": usage,
+            })
+            return
+
+        # 以 SSE 逐个 token 返回，按 tokens_per_second 控制生成速度
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for i, token in enumerate(tokens):
+            time.sleep(delay)
+            chunk = {
+                "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": None,
+                             "delta": {"content": token if i == 0 else ' ' + token}}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        final = {
+            "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}],
+        }
+        self.wfile.write(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+        # 与 OpenAI 相同：请求 stream_options.include_usage 时，最后再发送一个 choices 为空、带用量的 chunk
+        if (request.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = {
+                "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [], "usage": usage,
+            }
+            self.wfile.write(f"data: {json.dumps(usage_chunk)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _handle_embeddings(self, request):
+        texts = request.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        if len(texts) > self.max_inputs:
+            self._send_json(400, {"error": {
+                "message": f"too many inputs: {len(texts)} > {self.max_inputs}",
+                "type": "invalid_request_error"}})
+            return
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            self._send_json(503, {"error": {"message": "stub overloaded", "type": "server_error"}})
+            return
+
+        dimensions = request.get("dimensions") or self.dimensions
+        data = []
+        for i, text in enumerate(texts):
+            vector = fake_embedding(text, dimensions)
+            if request.get("encoding_format") == "base64":
+                vector = base64.b64encode(array('f', vector).tobytes()).decode('ascii')
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        n_tokens = sum(len(t) for t in texts) // 4
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "stub"),
+            "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens},
+        })
+
+
+def make_stub_server(host="127.0.0.1", port=0, latency=0.0, max_inputs=2048,
+                     failure_rate=0.0, dimensions=1536, tokens_per_second=0.0, answer_words=40):
+    '''
+    创建桩服务（未启动），port=0 时自动分配端口，可通过 server.server_address 获取。
+    server.stats 记录每个路径收到的请求数。
+    '''
+    stats = {}
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "latency": latency,
+        "max_inputs": max_inputs,
+        "failure_rate": failure_rate,
+        "dimensions": dimensions,
+        "tokens_per_second": tokens_per_second,
+        "answer_words": answer_words,
+        "stats": stats,
+        "stats_lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.stats = stats
+    return server
+
+
+def start_stub_server(**kwargs):
+    '''在后台线程中启动桩服务，返回 (server, base_url)'''
+    server = make_stub_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的模拟延迟（秒）")
+    parser.add_argument("--max-inputs", type=int, default=2048, help="单个请求允许的最大文本条数")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="随机返回 503 的概率")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="对话补全的生成速度，0 表示不限速")
+    parser.add_argument("--answer-words", type=int, default=40, help="对话补全回答的词数")
+    args = parser.parse_args()
+
+    server = make_stub_server(args.host, args.port, args.latency, args.max_inputs,
+                              args.failure_rate, args.dimensions,
+                              args.tokens_per_second, args.answer_words)
+    print(f"stub server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,55 @@
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utilities  # noqa: E402
+from async_llm import AsyncLLMClient  # noqa: E402
+from stub_server import start_stub_server  # noqa: E402
+
+PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "llama2.pdf")
+
+
+@pytest.fixture(autouse=True)
+def sentence_splitter(monkeypatch):
+    '''没有下载 NLTK punkt 数据时按句末标点切分句子'''
+    try:
+        utilities.sent_tokenize("One. Two.")
+    except LookupError:
+        monkeypatch.setattr(utilities, "sent_tokenize",
+                            lambda text: [s for s in re.split(r"(?<=[.!?])\s+", text) if s])
+
+
+@pytest.fixture(scope="session")
+def stub():
+    '''本地桩服务与连接它的客户端（不重试，失败直接抛出）'''
+    server, base_url = start_stub_server(dimensions=16)
+    client = AsyncLLMClient(base_url=base_url, api_key="stub", max_retries=0)
+    yield server, client
+    client.close()
+    server.shutdown()
+
+
+class FlakyEmbedding:
+    '''经桩服务计算向量；fail_after 次调用之后抛出异常，用于模拟导入中途失败'''
+
+    def __init__(self, client, fail_after=None):
+        self.embed = client.embedding_fn(dimensions=16)
+        self.fail_after = fail_after
+        self.calls = 0
+        self.texts = 0
+
+    def __call__(self, texts):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise ConnectionError("embedding service unavailable")
+        self.texts += len(texts)
+        return self.embed(texts)
+
+
+@pytest.fixture
+def flaky_embedding(stub):
+    return lambda fail_after=None: FlakyEmbedding(stub[1], fail_after)
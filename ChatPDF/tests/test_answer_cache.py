@@ -0,0 +1,67 @@
+import answer_cache
+from answer_cache import AnswerCache
+
+
+def embedding(vectors):
+    '''按问题返回指定的向量，未指定的问题返回与其他问题正交的向量'''
+    def fn(texts):
+        return [vectors.get(text, [0.0, 0.0, 1.0]) for text in texts]
+    return fn
+
+
+def namespace(version=1, scope="s"):
+    return AnswerCache.make_namespace(version, "gpt", "template", scope=scope)
+
+
+def test_exact_and_semantic_hits():
+    cache = AnswerCache(embedding({"What is Llama 2?": [1.0, 0.0, 0.0],
+                                   "What's Llama 2?": [0.99, 0.01, 0.0],
+                                   "Who trained it?": [0.0, 1.0, 0.0]}))
+    cache.store("What is Llama 2?", namespace(), "a family of models")
+    assert cache.lookup("  What is   Llama 2? ", namespace()) == "a family of models"
+    assert cache.lookup("What's Llama 2?", namespace()) == "a family of models"
+    assert cache.lookup("Who trained it?", namespace()) is None
+    # 其他会话的条目不命中
+    assert cache.lookup("What is Llama 2?", namespace(scope="t")) is None
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["similar_hits"] == 1
+
+
+def test_questions_differing_only_in_a_number_do_not_share_answers():
+    cache = AnswerCache(embedding({"How many tokens was Llama 2 7B trained on?": [1.0, 0.0, 0.0],
+                                   "How many tokens was Llama 2 70B trained on?": [0.999, 0.04, 0.0],
+                                   "how many tokens was llama 2 7b trained on": [0.998, 0.05, 0.0]}))
+    cache.store("How many tokens was Llama 2 7B trained on?", namespace(), "2T")
+    assert cache.lookup("How many tokens was Llama 2 70B trained on?", namespace()) is None
+    assert cache.lookup("how many tokens was llama 2 7b trained on", namespace()) == "2T"
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    cache = AnswerCache(ttl=60)
+    cache.store("q", namespace(), "a")
+    now[0] += 59
+    assert cache.lookup("q", namespace()) == "a"
+    now[0] += 2
+    assert cache.lookup("q", namespace()) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(max_entries=2)
+    cache.store("a", namespace(), 1)
+    cache.store("b", namespace(), 2)
+    assert cache.lookup("a", namespace()) == 1
+    cache.store("c", namespace(), 3)
+    assert cache.lookup("b", namespace()) is None
+    assert cache.lookup("a", namespace()) == 1 and cache.lookup("c", namespace()) == 3
+
+
+def test_new_namespace_version_invalidates_entries_of_that_scope_only():
+    cache = AnswerCache()
+    cache.store("q", namespace(version=1), "old")
+    cache.store("q", namespace(version=1, scope="t"), "other session")
+    assert cache.lookup("q", namespace(version=2)) is None
+    # 旧版本的条目已被清理，另一个会话的条目不受影响
+    assert cache.lookup("q", namespace(version=1)) is None
+    assert cache.lookup("q", namespace(version=1, scope="t")) == "other session"
@@ -0,0 +1,29 @@
+import time
+
+from fastapi.testclient import TestClient
+
+from api_server import create_app
+
+
+class SlowStreamService:
+    ingest_concurrency = 1
+    query_concurrency = 4
+
+    def query_stream(self, question, source=None, namespace=None):
+        yield {"event": "references", "documents": [], "metadatas": [], "cached": False}
+        for token in ("a", "b", "c"):
+            time.sleep(0.1)
+            yield {"event": "token", "text": token}
+
+    def metrics(self):
+        return {}
+
+
+def test_stream_duration_is_recorded_at_end_of_body():
+    with TestClient(create_app(SlowStreamService, threads=4)) as client:
+        response = client.post("/v1/query/stream", json={"question": "q"})
+        assert response.status_code == 200
+        assert len(response.text.splitlines()) == 4
+        stats = client.get("/metrics").json()["http"]["/v1/query/stream"]
+        assert stats["requests"] == 1
+        assert stats["seconds"] >= 0.3
@@ -0,0 +1,58 @@
+import asyncio
+import concurrent.futures
+
+import pytest
+
+from async_llm import AsyncLLMClient
+from stub_server import start_stub_server
+from tracing import tracer
+
+
+def test_streamed_completion_records_token_usage(stub):
+    _, client = stub
+    tracer.configure(True)
+    tracer.reset()
+    try:
+        with tracer.span("generate") as span:
+            answer = "".join(client.completion_stream_fn()("hello"))
+        assert answer.startswith("stub answer:")
+        assert span.get("completion_tokens") == len(answer.split(" "))
+        counters = tracer.snapshot()["counters"]
+        assert counters["llm_tokens_total{kind=completion}"] == len(answer.split(" "))
+        assert "llm_tokens_total{kind=prompt}" in counters
+    finally:
+        tracer.configure(False)
+        tracer.reset()
+
+
+def test_abandoned_stream_releases_concurrency_slot():
+    server, base_url = start_stub_server(tokens_per_second=200, answer_words=20)
+    client = AsyncLLMClient(base_url=base_url, api_key="stub", max_concurrency=1, max_retries=0)
+    try:
+        # 读取一段后既不继续读取也不关闭，生成器保持引用不被回收
+        abandoned = client.completion_stream_fn()("first")
+        assert next(abandoned).startswith("stub")
+        answer = concurrent.futures.ThreadPoolExecutor(1).submit(
+            client.completion_fn(), "second").result(timeout=10)
+        assert answer.startswith("stub answer:")
+        del abandoned
+    finally:
+        client.close()
+        server.shutdown()
+
+
+def test_stream_timeout_raises_and_releases_slot():
+    server, base_url = start_stub_server(tokens_per_second=20, answer_words=40)
+    client = AsyncLLMClient(base_url=base_url, api_key="stub", max_concurrency=1,
+                            max_retries=0, stream_timeout=0.5)
+
+    async def read_all():
+        return "".join([text async for text in client.complete_stream("slow")])
+
+    try:
+        with pytest.raises(TimeoutError):
+            client.run(read_all())
+        assert client.run(asyncio.wait_for(client.complete("after timeout"), 10)).startswith("stub answer:")
+    finally:
+        client.close()
+        server.shutdown()
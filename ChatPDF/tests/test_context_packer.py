@@ -0,0 +1,14 @@
+import tiktoken
+
+import context_packer
+from context_packer import ContextPacker
+
+
+def test_falls_back_to_estimate_when_tokenizer_cannot_be_downloaded(monkeypatch, caplog):
+    def offline(model):
+        raise ConnectionError("could not fetch encoding")
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", offline)
+    packer = ContextPacker()
+    assert packer.count_tokens is context_packer.estimate_tokens
+    assert "could not fetch encoding" in caplog.text
@@ -0,0 +1,61 @@
+import threading
+
+from embedding_cache import EmbeddingCache, cached_embedding_fn
+
+
+def counting(calls):
+    def embed(texts):
+        calls.extend(texts)
+        return [[float(len(t)), 1.0] for t in texts]
+    return embed
+
+
+def test_whitespace_variants_share_a_key_and_models_do_not(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    assert cache.make_key("  Llama 2\n is  open ", "m") == cache.make_key("Llama 2 is open", "m")
+    assert cache.make_key("Llama 2 is open", "m") != cache.make_key("Llama 2 is open", "other")
+    assert cache.make_key("x", "m", 256) != cache.make_key("x", "m")
+
+    calls = []
+    embed = cached_embedding_fn(counting(calls), cache, model="m")
+    assert embed(["a  b", "a b", " a b "]) == [[4.0, 1.0]] * 3
+    assert calls == ["a  b"]
+    assert embed(["a\tb"]) == [[4.0, 1.0]]
+    assert calls == ["a  b"]
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.put_many([("a", [1.0]), ("b", [2.0])])
+    assert cache.get_many(["a"]) == {"a": [1.0]}
+    cache.put_many([("c", [3.0])])
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+    assert cache.stats()["entries"] == 2
+
+
+def test_entries_and_lru_order_survive_reopen(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache(path, max_entries=2)
+    cache.put_many([("a", [1.0]), ("b", [2.0])])
+    cache.get_many(["a"])
+    cache.close()
+
+    cache = EmbeddingCache(path, max_entries=2)
+    assert cache.stats()["entries"] == 2
+    assert cache.get_many(["a", "b"]) == {"a": [1.0], "b": [2.0]}
+    cache.get_many(["a"])
+    cache.put_many([("c", [3.0])])
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+
+
+def test_hit_counts_are_exact_under_concurrent_calls(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"))
+    embed = cached_embedding_fn(counting([]), cache, model="m")
+    embed(["warm"])
+    threads = [threading.Thread(target=lambda: [embed(["warm"]) for _ in range(200)]) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert cache.stats()["hits"] == 1600 and cache.stats()["misses"] == 1
@@ -0,0 +1,36 @@
+import httpx
+import openai
+import pytest
+
+from embedding_engine import EmbeddingEngine
+
+
+def status_error(code):
+    request = httpx.Request("POST", "http://127.0.0.1/v1/embeddings")
+    return openai.APIStatusError("error", response=httpx.Response(code, request=request), body=None)
+
+
+def failing(errors):
+    calls = []
+
+    def embed(texts):
+        calls.append(texts)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return [[0.0] for _ in texts]
+    return embed, calls
+
+
+def test_client_errors_are_not_retried():
+    embed, calls = failing([status_error(400)])
+    engine = EmbeddingEngine(embed, backoff=0)
+    with pytest.raises(openai.APIStatusError):
+        engine(["too long"])
+    assert len(calls) == 1
+
+
+def test_rate_limits_server_and_connection_errors_are_retried():
+    embed, calls = failing([status_error(429), status_error(503), ConnectionError("reset")])
+    engine = EmbeddingEngine(embed, backoff=0)
+    assert engine(["text"]) == [[0.0]]
+    assert len(calls) == 4 and engine.stats()["retries"] == 3
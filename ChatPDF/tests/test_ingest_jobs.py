@@ -0,0 +1,162 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from conftest import PDF
+from ingest_jobs import IngestJobQueue
+from ingest_pipeline import IngestPipeline
+from namespaces import NamespaceRegistry
+from vector_db import MyVectorDBConnector
+
+
+def make_pipeline(embedding_fn):
+    vector_db = MyVectorDBConnector(f"test_{uuid.uuid4().hex[:8]}", embedding_fn, backend="local",
+                                    keyword_index=True)
+    return IngestPipeline(vector_db, batch_size=16, embed_workers=1)
+
+
+def make_queue(pipeline, tmp_path, **kwargs):
+    kwargs.setdefault("poll_interval", 0.05)
+    return IngestJobQueue(pipeline, str(tmp_path / "jobs.db"), str(tmp_path / "uploads"), workers=1,
+                          **kwargs)
+
+
+def wait_for(jobs, job_id, statuses=("done", "failed", "cancelled"), timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} still {jobs.get(job_id)['status']}")
+
+
+def test_partial_failure_resumes_from_written_chunks(tmp_path, flaky_embedding):
+    embedding = flaky_embedding(fail_after=2)
+    pipeline = make_pipeline(embedding)
+    jobs = make_queue(pipeline, tmp_path).start()
+    try:
+        job = wait_for(jobs, jobs.submit(PDF, namespace="s")["id"])
+        assert job["status"] == "failed"
+        assert "embedding service unavailable" in job["error"]
+        written = pipeline.vector_db.collection_size("s")
+        assert written == 32
+        # 部分写入的文档没有完成标记，不能被当作已导入
+        assert not pipeline.vector_db.has_document(job["doc_hash"], "s")
+
+        embedding.fail_after = None
+        embedded_before = embedding.texts
+        job = wait_for(jobs, jobs.retry(job["id"])["id"])
+        assert job["status"] == "done"
+        assert job["attempts"] == 2
+        # 已写入的片段沿用已有向量，只为剩余片段计算
+        assert embedding.texts - embedded_before == job["chunks"] - written
+        assert pipeline.vector_db.collection_size("s") == job["chunks"]
+        assert pipeline.vector_db.has_document(job["doc_hash"], "s")
+    finally:
+        jobs.close()
+
+
+def test_restart_resumes_job_of_dead_process(tmp_path, flaky_embedding):
+    pipeline = make_pipeline(flaky_embedding(fail_after=1))
+    jobs = make_queue(pipeline, tmp_path)
+    job = jobs.submit(PDF, namespace="s")
+    # 模拟上一个进程领取任务、写入一批片段后退出：任务仍是 running，租约已过期
+    with pytest.raises(ConnectionError):
+        pipeline.run(PDF, doc_hash=job["doc_hash"], namespace="s")
+    jobs._update(job["id"], status="running", attempts=1, owner="dead-process", lease_until=time.time() - 1)
+    jobs.close()
+
+    pipeline.vector_db.embedding_fn = flaky_embedding()
+    jobs = make_queue(pipeline, tmp_path).start()
+    try:
+        job = wait_for(jobs, job["id"])
+        assert job["status"] == "done"
+        assert job["attempts"] == 2
+        assert pipeline.vector_db.has_document(job["doc_hash"], "s")
+    finally:
+        jobs.close()
+
+
+def test_running_job_with_live_lease_is_not_taken_over(tmp_path, flaky_embedding):
+    pipeline = make_pipeline(flaky_embedding())
+    first = make_queue(pipeline, tmp_path)
+    second = make_queue(pipeline, tmp_path)
+    try:
+        job = first.submit(PDF, namespace="s")
+        # 同一任务只能被领取一次
+        assert first._claim(job["id"]) is not None
+        assert second._claim(job["id"]) is None
+        # 另一个进程启动时不会把执行中的任务改回 queued
+        second.start()
+        time.sleep(0.2)
+        job = second.get(job["id"])
+        assert job["status"] == "running"
+        assert job["attempts"] == 1
+    finally:
+        first.close()
+        second.close()
+
+
+def test_deleting_namespace_cancels_running_job(tmp_path, flaky_embedding):
+    embedding = flaky_embedding()
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking_embedding(texts):
+        if embedding.calls == 1:
+            started.set()
+            release.wait(10)
+        return embedding(texts)
+
+    pipeline = make_pipeline(blocking_embedding)
+    jobs = make_queue(pipeline, tmp_path).start()
+    try:
+        job = jobs.submit(PDF, namespace="s")
+        # 第二批计算向量时删除命名空间（会话结束），之后的写入被跳过
+        assert started.wait(10)
+        assert jobs.cancel_namespace("s") == 1
+        pipeline.vector_db.delete_namespace("s")
+        release.set()
+        job = wait_for(jobs, job["id"])
+        assert job["status"] == "cancelled"
+        assert pipeline.vector_db.collection_size("s") == 0
+    finally:
+        release.set()
+        jobs.close()
+
+
+def test_job_of_expired_namespace_is_not_run(tmp_path, flaky_embedding):
+    embedding = flaky_embedding()
+    pipeline = make_pipeline(embedding)
+    registry = NamespaceRegistry(str(tmp_path / "namespaces.db"))
+    jobs = make_queue(pipeline, tmp_path, namespaces=registry)
+    # 提交后进程退出，会话没有再出现：重启时任务不再执行
+    job = jobs.submit(PDF, namespace="gone")
+    jobs.start()
+    try:
+        job = wait_for(jobs, job["id"])
+        assert job["status"] == "cancelled"
+        assert embedding.calls == 0
+        assert pipeline.vector_db.collection_size("gone") == 0
+    finally:
+        jobs.close()
+        registry.close()
+
+
+def test_same_content_under_another_name_keeps_stored_source(tmp_path, flaky_embedding):
+    pipeline = make_pipeline(flaky_embedding())
+    jobs = make_queue(pipeline, tmp_path).start()
+    try:
+        first = wait_for(jobs, jobs.submit(PDF, "report.pdf", namespace="s")["id"])
+        assert first["status"] == "done"
+        # 片段上仍是首次导入时的文件名，按新文件名检索会找不到
+        job = jobs.submit(PDF, "report (1).pdf", namespace="s")
+        assert job["source"] == "report.pdf"
+        job = wait_for(jobs, job["id"])
+        assert job["stats"]["skipped"] and job["stats"]["source"] == "report.pdf"
+        assert pipeline.vector_db.search("report", 1, source=job["source"], namespace="s")["documents"][0]
+    finally:
+        jobs.close()
@@ -0,0 +1,22 @@
+import uuid
+
+from bm25_index import BM25Index, tokenize
+from vector_db import MyVectorDBConnector
+
+
+def test_hyphenated_terms_also_match_their_parts():
+    assert tokenize("Llama-2-chat 7B") == ["llama-2-chat", "llama", "2", "chat", "7b"]
+    index = BM25Index(filter_keys=())
+    index.add(["a", "b"], ["fine-tuned llama-2-chat models", "gpt models"])
+    assert [i for i, _ in index.search("llama chat", 2)] == ["a"]
+
+
+def test_keyword_mode_filters_before_taking_top_n(flaky_embedding):
+    vector_db = MyVectorDBConnector(f"test_{uuid.uuid4().hex[:8]}", flaky_embedding(), backend="local",
+                                    keyword_index=True)
+    # 关键词得分最高的片段都不满足 where 条件
+    documents = [f"attention attention note {i}" for i in range(10)] + ["attention in the appendix"]
+    metadatas = [{"page": 1}] * 10 + [{"page": 9}]
+    vector_db.add_documents(documents, metadatas, source="paper.pdf")
+    results = vector_db.search("attention", 2, where={"page": 9}, mode="keyword")
+    assert results["documents"][0] == ["attention in the appendix"]
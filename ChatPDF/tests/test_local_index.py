@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from local_index import LocalCollection
+
+
+def test_flush_appends_only_new_writes_and_load_replays_them(tmp_path):
+    path = str(tmp_path / "collection")
+    rng = np.random.default_rng(0)
+    collection = LocalCollection("test")
+    collection.add([f"a{i}" for i in range(10)], rng.random((10, 8)), [f"a{i}" for i in range(10)],
+                   [{"source": "a"}] * 10)
+    collection.flush(path)
+    snapshot = os.path.getmtime(os.path.join(path, "vectors.npy"))
+
+    collection.add(["b0", "b1"], rng.random((2, 8)), ["b0", "b1"], [{"source": "b"}] * 2)
+    collection.update(["a1"], metadatas=[{"complete_hash": "h"}])
+    collection.delete(ids=["a2"])
+    collection.flush(path)
+    # 快照未重写，新写入只追加到日志
+    assert os.path.getmtime(os.path.join(path, "vectors.npy")) == snapshot
+    with open(os.path.join(path, "journal.jsonl"), encoding="utf-8") as f:
+        assert len(f.readlines()) == 3
+    # 追加日志时中断留下的不完整行被忽略
+    with open(os.path.join(path, "journal.jsonl"), "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "ids": ["c0"')
+
+    loaded = LocalCollection.load(path)
+    assert sorted(loaded.get(include=[])["ids"]) == sorted(collection.get(include=[])["ids"])
+    assert loaded.get(ids=["a1"])["metadatas"] == [{"source": "a", "complete_hash": "h"}]
+    query = rng.random((1, 8))
+    assert loaded.query(query, 3)["ids"] == collection.query(query, 3)["ids"]
+
+
+def test_large_journal_is_compacted_into_a_snapshot(tmp_path):
+    path = str(tmp_path / "collection")
+    rng = np.random.default_rng(0)
+    collection = LocalCollection("test")
+    collection.add(["a"], rng.random((1, 8)))
+    collection.flush(path)
+    collection.add([f"b{i}" for i in range(2000)], rng.random((2000, 8)))
+    collection.flush(path)
+    collection.add(["c"], rng.random((1, 8)))
+    collection.flush(path)
+    # 日志超过上限后下一次 flush 完整保存，日志清空
+    assert not os.path.exists(os.path.join(path, "journal.jsonl"))
+    assert LocalCollection.load(path).count() == 2002
+
+
+def test_filtered_ivf_query_finds_all_rows_of_a_small_namespace():
+    rng = np.random.default_rng(0)
+    collection = LocalCollection("test", ivf_threshold=1000, nprobe=4)
+    collection.add([f"a{i}" for i in range(5000)], rng.random((5000, 16)),
+                   metadatas=[{"namespace": "big"}] * 5000)
+    small = rng.random((5, 16))
+    collection.add([f"s{i}" for i in range(5)], small, metadatas=[{"namespace": "small"}] * 5)
+    assert collection._centroids is not None
+    for query in rng.random((50, 16)):
+        found = collection.query([query], 2, where={"namespace": "small"})["ids"][0]
+        expected = np.argsort(((small - query) ** 2).sum(axis=1))[:2]
+        assert found == [f"s{i}" for i in expected]
+    # 满足条件的行较多时仍走分区检索，结果数不少于 n_results
+    assert len(collection.query(rng.random((1, 16)), 10, where={"namespace": "big"})["ids"][0]) == 10
+
+
+def test_delete_without_ids_or_where_is_rejected():
+    collection = LocalCollection("test")
+    collection.add(["a"], np.ones((1, 4)))
+    with pytest.raises(ValueError):
+        collection.delete()
+    assert collection.count() == 1
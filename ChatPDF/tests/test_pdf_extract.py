@@ -0,0 +1,10 @@
+from conftest import PDF
+from utilities import create_extract_pool, iter_pages_from_pdf
+
+
+def test_shared_pool_extracts_pages_in_order():
+    sequential = list(iter_pages_from_pdf(PDF))
+    with create_extract_pool(2) as pool:
+        # 两次导入共用同一个进程池
+        for _ in range(2):
+            assert list(iter_pages_from_pdf(PDF, workers=2, pages_per_task=1, executor=pool)) == sequential
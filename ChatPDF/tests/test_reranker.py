@@ -0,0 +1,23 @@
+import time
+
+from reranker import CrossEncoderReranker
+
+
+def test_slow_measurement_does_not_disable_reranking_forever():
+    slow = [True]
+
+    def score_pairs(pairs):
+        if slow[0]:
+            time.sleep(0.05 * len(pairs))
+        return [len(document) for _, document in pairs]
+
+    reranker = CrossEncoderReranker(score_pairs=score_pairs, budget=0.1, probe_interval=0.2)
+    assert reranker.rerank("q1", ["a", "bb", "ccc"], 2) == [(2, 3), (1, 2)]
+    # 第一次测量很慢，之后的重排预计超出上限而跳过
+    slow[0] = False
+    assert reranker.rerank("q2", ["a", "bb", "ccc"], 2) is None
+    # 超过 probe_interval 后放行一次重新测量，恢复重排
+    time.sleep(0.25)
+    assert reranker.rerank("q3", ["a", "bb", "ccc"], 2) == [(2, 3), (1, 2)]
+    assert reranker.rerank("q4", ["a", "bb", "ccc"], 2) == [(2, 3), (1, 2)]
+    assert reranker.stats()["skipped"] == 1
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from similarity import search, top_k
+
+
+def brute_force(queries, corpus, metric):
+    '''逐对计算的参考实现'''
+    scores = np.empty((len(queries), len(corpus)))
+    for i, q in enumerate(queries):
+        for j, d in enumerate(corpus):
+            if metric == "cosine":
+                scores[i, j] = q @ d / (np.linalg.norm(q) * np.linalg.norm(d))
+            elif metric == "dot":
+                scores[i, j] = q @ d
+            else:
+                scores[i, j] = ((q - d) ** 2).sum()
+    return scores
+
+
+def test_top_k_matches_full_sort():
+    rng = np.random.default_rng(0)
+    scores = rng.random((4, 50))
+    for largest in (True, False):
+        positions, values = top_k(scores, 5, largest)
+        expected = np.argsort(-scores if largest else scores, axis=1)[:, :5]
+        assert (positions == expected).all()
+        assert np.allclose(values, np.take_along_axis(scores, expected, axis=1))
+    # k 大于片段数时返回全部片段
+    assert top_k(scores[0], 80)[0].shape == (50,)
+
+
+@pytest.mark.parametrize("metric", ["cosine", "dot", "l2"])
+def test_chunked_search_matches_brute_force(metric):
+    rng = np.random.default_rng(1)
+    queries, corpus = rng.normal(size=(3, 8)), rng.normal(size=(101, 8))
+    reference = brute_force(queries, corpus, metric)
+    expected = np.argsort(reference if metric == "l2" else -reference, axis=1)[:, :7]
+    # 分块大小不整除片段数，跨块合并结果
+    for corpus_input in (corpus, (corpus[i:i + 10] for i in range(0, 101, 10))):
+        positions, scores = search(queries, corpus_input, 7, metric=metric, chunk_rows=10)
+        assert (positions == expected).all()
+        assert np.allclose(scores, np.take_along_axis(reference, expected, axis=1), atol=1e-4)
@@ -0,0 +1,33 @@
+from transcript import TranscriptRenderer
+
+
+def test_user_and_model_text_is_escaped():
+    html = TranscriptRenderer().render([("User", "<img src=x onerror=alert(1)>"),
+                                        ("Assistant", "<script>alert(1)</script>\nok & done")])
+    assert "<script>" not in html and "<img" not in html
+    assert "&lt;script&gt;alert(1)&lt;/script&gt;<br>ok &amp; done" in html
+
+
+def test_finished_turns_are_rendered_once():
+    renderer = TranscriptRenderer()
+    calls = []
+    render_turn = renderer.render_turn
+    renderer.render_turn = lambda speaker, text: calls.append(text) or render_turn(speaker, text)
+    history = [("User", "q1"), ("Assistant", "a1"), ("User", "q2"), ("Assistant", "a")]
+    first = renderer.render(history)
+    # 正在生成的最后一条每次都重新渲染，之前的消息使用缓存
+    second = renderer.render(history[:-1] + [("Assistant", "a2")])
+    assert calls == ["q1", "a1", "q2", "a", "a2"]
+    assert first.replace(">a<", ">a2<") == second
+
+
+def test_older_turns_are_folded_and_can_be_paged_in():
+    renderer = TranscriptRenderer(max_turns=4)
+    history = [("User", f"message {i}") for i in range(10)]
+    html = renderer.render(history)
+    assert "较早的 6 条消息已折叠" in html
+    assert "message 5" not in html and "message 6" in html and "message 9" in html
+    html = renderer.render(history, pages=2)
+    assert "较早的 2 条消息已折叠" in html and "message 2" in html and "message 1" not in html
+    html = renderer.render(history, pages=3)
+    assert "已折叠" not in html and "message 0" in html
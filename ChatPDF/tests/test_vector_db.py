@@ -0,0 +1,19 @@
+import uuid
+
+from vector_db import MyVectorDBConnector
+
+
+def test_queries_use_query_embedding_fn_and_documents_do_not():
+    embedded = {"documents": [], "queries": []}
+
+    def embed(kind):
+        def fn(texts):
+            embedded[kind].extend(texts)
+            return [[1.0, float(len(t))] for t in texts]
+        return fn
+
+    vector_db = MyVectorDBConnector(f"test_{uuid.uuid4().hex[:8]}", embed("documents"), backend="local",
+                                    query_embedding_fn=embed("queries"))
+    vector_db.add_documents(["a short chunk", "another chunk"], source="doc.pdf")
+    vector_db.search("question", 1)
+    assert embedded == {"documents": ["a short chunk", "another chunk"], "queries": ["question"]}
@@ -0,0 +1,317 @@
+'''
+轻量的分阶段追踪与指标：一次问答由若干 span 组成（检索、向量计算、向量检索、Prompt 构建、LLM 调用等），
+每个 span 记录耗时与属性（token 数、缓存命中、重试次数等）。
+
+- 每个 span 结束时计入按名称分组的耗时直方图，可导出为 Prometheus 文本格式（prometheus_text）；
+- 指定 trace_path 时，每个 span 作为一行 JSON 追加到文件中，同一次问答的 span 有相同的 trace_id；
+- 未启用时 span / start 返回共用的空 span，count 直接返回，几乎没有额外开销。
+
+当前 span 保存在 contextvars 中，随 run_in_threadpool、asyncio 任务与 run_coroutine_threadsafe 传递；
+ThreadPoolExecutor 不传递上下文，需要在提交时用 contextvars.copy_context() 包装。
+
+用法:
+    from tracing import tracer
+    with tracer.span("retrieve", top_n=2) as span:
+        ...
+        span.set(hits=len(results))
+    tracer.count("answer_cache_total", result="hit")
+'''
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 耗时直方图的桶上限（秒），覆盖从本地计算到 LLM 生成的范围
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current = contextvars.ContextVar("chatpdf_span", default=None)
+
+
+class _NoopSpan:
+    '''未启用追踪时使用的空 span，所有操作都不做任何事'''
+    __slots__ = ()
+
+    def set(self, **attributes):
+        return self
+
+    def add(self, key, value=1):
+        return self
+
+    def get(self, key, default=None):
+        return default
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __bool__(self):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "attributes",
+                 "start_time", "_start", "_token", "_ended")
+
+    def __init__(self, tracer, name, parent=None, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes or {}
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self._token = None
+        self._ended = False
+
+    def set(self, **attributes):
+        '''设置属性，如 span.set(hits=2, cached=False)'''
+        self.attributes.update(attributes)
+        return self
+
+    def add(self, key, value=1):
+        '''累加数值属性，如重试次数、token 数'''
+        self.attributes[key] = self.attributes.get(key, 0) + value
+        return self
+
+    def get(self, key, default=None):
+        return self.attributes.get(key, default)
+
+    def end(self, error=None):
+        '''结束 span，重复调用只记录一次'''
+        if self._ended:
+            return
+        self._ended = True
+        self.tracer._finish(self, time.perf_counter() - self._start, error)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.end(exc)
+        return False
+
+    def __bool__(self):
+        return True
+
+
+class _Activation:
+    __slots__ = ("span", "_token")
+
+    def __init__(self, span):
+        self.span = span
+
+    def __enter__(self):
+        self._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        return False
+
+
+class Tracer:
+    def __init__(self, enabled=False, trace_path=None, buckets=DEFAULT_BUCKETS, prefix="chatpdf"):
+        """
+        参数:
+        enabled: 布尔值，是否记录 span 与计数。
+        trace_path: 字符串，JSON lines 追踪文件路径，为空时只汇总指标不写文件。
+        buckets: 耗时直方图的桶上限（秒）。
+        prefix: 导出指标名的前缀。
+        """
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._errors = {}
+        self._counters = {}
+        self._trace_file = None
+        self.enabled = False
+        self.configure(enabled, trace_path)
+
+    def configure(self, enabled=True, trace_path=None):
+        '''启用或关闭追踪；模块中的 tracer 被各处直接导入，配置时修改同一个实例'''
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+            if enabled and trace_path:
+                self._trace_file = open(trace_path, "a", encoding="utf-8")
+            self.enabled = enabled
+        return self
+
+    def current(self):
+        '''当前上下文中的 span，没有时返回空 span'''
+        return _current.get() or NOOP_SPAN
+
+    def span(self, name, parent=None, **attributes):
+        '''
+        创建 span，用作上下文管理器：进入时成为当前 span，退出时结束并记录，异常记为错误。
+
+        parent 默认为当前 span。在生成器中不要跨 yield 使用（恢复执行时上下文可能不同），改用 start
+        '''
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, parent or _current.get(), attributes)
+
+    def start(self, name, parent=None, **attributes):
+        '''创建 span 但不设为当前 span，由调用方调用 end() 结束，适用于流式生成等跨 yield 的阶段'''
+        return self.span(name, parent, **attributes)
+
+    def activate(self, span):
+        '''临时把 span 设为当前 span（不结束它），用于在生成器的两次 yield 之间执行属于该 span 的子阶段'''
+        if not span:
+            return NOOP_SPAN
+        return _Activation(span)
+
+    def count(self, name, value=1, **labels):
+        '''累加计数器，如 count("llm_tokens_total", 120, kind="prompt")'''
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def _finish(self, span, seconds, error):
+        record = None
+        if self._trace_file is not None:
+            record = json.dumps({
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "name": span.name,
+                "start": span.start_time,
+                "duration_ms": seconds * 1000,
+                "status": "error" if error is not None else "ok",
+                "error": f"{type(error).__name__}: {error}" if error is not None else None,
+                "attributes": span.attributes,
+            }, ensure_ascii=False, default=str)
+        with self._lock:
+            histogram = self._histograms.get(span.name)
+            if histogram is None:
+                histogram = self._histograms[span.name] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+            if error is not None:
+                self._errors[span.name] = self._errors.get(span.name, 0) + 1
+            if record is not None and self._trace_file is not None:
+                self._trace_file.write(record + "\n")
+                self._trace_file.flush()
+
+    def snapshot(self):
+        '''各阶段的调用次数、错误数、平均与总耗时，以及全部计数器'''
+        with self._lock:
+            spans = {
+                name: {"count": count, "errors": self._errors.get(name, 0), "seconds": total,
+                       "mean_seconds": total / count if count else 0.0}
+                for name, (_, count, total) in self._histograms.items()
+            }
+            counters = {
+                name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""): value
+                for (name, labels), value in self._counters.items()
+            }
+        return {"enabled": self.enabled, "spans": spans, "counters": counters}
+
+    def prometheus_text(self):
+        '''以 Prometheus 文本格式（0.0.4）导出耗时直方图、错误数与计数器'''
+        metric = f"{self.prefix}_span_duration_seconds"
+        lines = [f"# HELP {metric} Duration of each pipeline stage.", f"# TYPE {metric} histogram"]
+        with self._lock:
+            histograms = {name: ([*buckets], count, total)
+                          for name, (buckets, count, total) in self._histograms.items()}
+            errors = dict(self._errors)
+            counters = dict(self._counters)
+        for name, (buckets, count, total) in sorted(histograms.items()):
+            label = f'span="{_escape(name)}"'
+            for bound, n in zip(self.buckets, buckets):
+                lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {n}')
+            lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum{{{label}}} {total}")
+            lines.append(f"{metric}_count{{{label}}} {count}")
+
+        metric = f"{self.prefix}_span_errors_total"
+        lines += [f"# HELP {metric} Pipeline stages that raised an error.", f"# TYPE {metric} counter"]
+        for name, n in sorted(errors.items()):
+            lines.append(f'{metric}{{span="{_escape(name)}"}} {n}')
+
+        typed = set()
+        for (name, labels), value in sorted(counters.items()):
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            label = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(f"{metric}{{{label}}} {value}" if label else f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        '''清空已汇总的指标'''
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+            self._counters.clear()
+
+    def close(self):
+        self.configure(False)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# 全局共用的 tracer，默认关闭，由 configure_from_env 或 tracer.configure 启用
+tracer = Tracer()
+
+
+def configure_from_env():
+    '''
+    按环境变量配置 tracer:
+    TRACING: 为 1 时启用
+    TRACE_FILE: JSON lines 追踪文件路径，默认不写文件
+    '''
+    return tracer.configure(os.getenv("TRACING") == "1", os.getenv("TRACE_FILE"))
+
+
+def serve_metrics(port, host="0.0.0.0", render=None):
+    '''
+    在后台线程中启动只提供 /metrics（Prometheus 文本格式）的 HTTP 服务，供没有 api_server 的 Gradio 界面使用，
+    返回 server（调用 shutdown() 停止）
+
+    render: 返回指标文本的函数，默认为 tracer.prometheus_text，可传入 RAGService.prometheus_metrics
+    '''
+    render = render or tracer.prometheus_text
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
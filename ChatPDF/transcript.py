@@ -0,0 +1,73 @@
+import html
+import threading
+from collections import OrderedDict
+
+_HEADER = "<div><strong>对话历史</strong></div>"
+_STYLES = {
+    "User": ("right", "#daf7a6"),
+    "Assistant": ("left", "#ffcccc"),
+}
+
+
+class TranscriptRenderer:
+    def __init__(self, max_turns=50, cache_size=4096):
+        """
+        将对话历史渲染为 HTML。
+
+        - 消息内容做 HTML 转义，模型输出中的标签不会被浏览器执行；
+        - 每条消息渲染后的片段按 LRU 缓存，历史消息不再重复渲染，每次更新只渲染新增或正在生成的消息；
+        - 只显示最近 max_turns 条消息（一页），更早的消息折叠为一行提示，仍保留在对话状态中，
+          可按页展开（render 的 pages），对话再长，每次更新的渲染耗时与发送到浏览器的 HTML 大小也保持不变。
+
+        参数:
+        max_turns: 整数，每页显示的消息条数，None 表示全部显示。
+        cache_size: 整数，缓存的消息片段数（所有会话共用）。
+        """
+        self.max_turns = max_turns
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def render_turn(speaker, text):
+        '''渲染单条消息，内容转义后换行显示为 <br>'''
+        align, color = _STYLES.get(speaker, _STYLES["Assistant"])
+        body = html.escape(str(text)).replace("\n", "<br>")
+        return (f'<div style="text-align: {align}; margin: 10px;"><span style="background-color: {color}; '
+                f'padding: 5px; border-radius: 5px;">{body}</span></div>')
+
+    def _cached_turn(self, speaker, text):
+        key = (speaker, text)
+        with self._lock:
+            fragment = self._cache.get(key)
+            if fragment is not None:
+                self._cache.move_to_end(key)
+                return fragment
+        fragment = self.render_turn(speaker, text)
+        with self._lock:
+            self._cache[key] = fragment
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return fragment
+
+    def render(self, chat_history, pages=1):
+        '''
+        渲染最近 pages 页（每页 max_turns 条）消息，界面上每点一次“显示更早的消息”多展开一页。
+        最后一条可能仍在流式生成，每个 token 内容都不同，不写入缓存
+        '''
+        turns = list(chat_history)
+        hidden = 0
+        if self.max_turns is not None:
+            shown = self.max_turns * max(1, pages)
+            if len(turns) > shown:
+                hidden = len(turns) - shown
+                turns = turns[hidden:]
+        parts = [_HEADER]
+        if hidden:
+            parts.append(f'<div style="text-align: center; color: #888; margin: 10px;">'
+                         f'较早的 {hidden} 条消息已折叠，点击“显示更早的消息”查看</div>')
+        for speaker, text in turns[:-1]:
+            parts.append(self._cached_turn(speaker, text))
+        if turns:
+            parts.append(self.render_turn(*turns[-1]))
+        return "".join(parts)
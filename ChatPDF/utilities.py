@@ -1,59 +1,271 @@
+from collections import deque
+
 from nltk.tokenize import sent_tokenize
 
-def split_text(paragraphs, chunk_size=300, overlap_size=100):
+
+def token_counter(model="gpt-3.5-turbo"):
+    '''返回按指定模型的 tokenizer 计算 token 数的函数（依赖 tiktoken）'''
+    import tiktoken
+    encoding = tiktoken.encoding_for_model(model)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def _iter_sentence_chunks(sentences, chunk_size, overlap_size, length_function=None):
+    '''
+    单次前向遍历句子流，逐个 yield (chunk, 首句下标, 末句下标+1)。
+
+    用句子长度的前缀和表示滑动窗口，重叠部分和 chunk 长度都是前缀和之差，
+    只保留当前窗口内的句子，总耗时与句子数成线性关系。
+    length_function 为空时按字符数计算，句子间的空格计入长度，结果与原先的逐句拼接完全一致；
+    否则按 length_function（如 token_counter）计算，句子间的空格不计入长度。
+    '''
+    if length_function is None:
+        length_function, sep = len, 1
+    else:
+        sep = 0
+
+    sentences = iter(sentences)
+    window = []       # 第 base 句起的句子
+    prefix = [0]      # prefix[k] 为 window[:k] 的长度和（含分隔符）
+    base = 0
+    exhausted = False
+
+    i = 0
+    start = 0
+    while True:
+        if i == len(window):
+            sentence = next(sentences, None)
+            if sentence is None:
+                break
+            window.append(sentence)
+            prefix.append(prefix[-1] + length_function(sentence) + sep)
+
+        # 向前计算重叠部分：最长的、总长度不超过 overlap_size 的前序句子
+        min_prefix = prefix[i] - overlap_size - sep
+        while prefix[start] < min_prefix:
+            start += 1
+
+        # 向后计算当前chunk：加入第 end 句后长度不超过 chunk_size
+        max_prefix = prefix[start] + chunk_size + 2 * sep
+        end = i + 1
+        while True:
+            if end == len(window):
+                if exhausted:
+                    break
+                sentence = next(sentences, None)
+                if sentence is None:
+                    exhausted = True
+                    break
+                window.append(sentence)
+                prefix.append(prefix[-1] + length_function(sentence) + sep)
+            if prefix[end + 1] > max_prefix:
+                break
+            end += 1
+
+        yield ' '.join(window[start:end]), base + start, base + end
+        i = end
+
+        # 下一个 chunk 的重叠部分不会早于本 chunk 的起点，定期丢弃之前的句子
+        if start >= 1024:
+            del window[:start]
+            del prefix[:start]
+            base += start
+            i -= start
+            start = 0
+
+
+def iter_chunks(paragraphs, chunk_size=300, overlap_size=100, length_function=None):
+    '''
+    按指定 chunk_size 和 overlap_size 交叠割文本，逐个 yield chunk。
+
+    paragraphs 可以是任意段落迭代器（如 iter_text_from_pdf 的返回值）；
+    length_function 为空时按字符数计算，结果与 split_text 相同，也可传入 token_counter() 按 token 数计算。
+    '''
+    sentences = (s.strip() for p in paragraphs for s in sent_tokenize(p))
+    for chunk, _, _ in _iter_sentence_chunks(sentences, chunk_size, overlap_size, length_function):
+        yield chunk
+
+
+def split_text(paragraphs, chunk_size=300, overlap_size=100, length_function=None):
     '''按指定 chunk_size 和 overlap_size 交叠割文本'''
-    sentences = [s.strip() for p in paragraphs for s in sent_tokenize(p)]
+    return list(iter_chunks(paragraphs, chunk_size, overlap_size, length_function))
+
+
+def iter_page_chunks(pages, chunk_size=300, overlap_size=100, length_function=None):
+    '''
+    按指定 chunk_size 和 overlap_size 交叠切分带页码的文本，逐个 yield (chunk, metadata)。
+
+    pages: (页码, 段落列表) 的迭代器，即 iter_pages_from_pdf 的返回值
+    metadata 包括:
+    page / page_end: chunk 起止所在页码（从 0 开始）
+    start / end: chunk 在全文（所有句子以空格连接）中的字符区间
+    '''
+    # 窗口内每个句子的页码与在全文中的起始位置，与句子窗口同步淘汰
+    sentence_pages = deque()
+    offsets = deque()
+    base = 0
+    position = 0
+
+    def sentences():
+        nonlocal position
+        for page, paragraphs in pages:
+            for p in paragraphs:
+                for s in sent_tokenize(p):
+                    s = s.strip()
+                    sentence_pages.append(page)
+                    offsets.append(position)
+                    position += len(s) + 1
+                    yield s
+
+    for chunk, first, last in _iter_sentence_chunks(sentences(), chunk_size, overlap_size, length_function):
+        start = offsets[first - base]
+        yield chunk, {
+            "page": sentence_pages[first - base],
+            "page_end": sentence_pages[last - 1 - base],
+            "start": start,
+            "end": start + len(chunk),
+        }
+        while base < first:
+            sentence_pages.popleft()
+            offsets.popleft()
+            base += 1
+
+
+def split_pages(pages, chunk_size=300, overlap_size=100, length_function=None):
+    '''
+    按指定 chunk_size 和 overlap_size 交叠切分带页码的文本，切分结果与 split_text 相同。
+
+    返回 (chunks, metadatas)，metadata 见 iter_page_chunks
+    '''
     chunks = []
-    i = 0
-    while i < len(sentences):
-        chunk = sentences[i]
-        overlap = ''
-        prev_len = 0
-        prev = i - 1
-        # 向前计算重叠部分
-        while prev >= 0 and len(sentences[prev])+len(overlap) <= overlap_size:
-            overlap = sentences[prev] + ' ' + overlap
-            prev -= 1
-        chunk = overlap+chunk
-        next = i + 1
-        # 向后计算当前chunk
-        while next < len(sentences) and len(sentences[next])+len(chunk) <= chunk_size:
-            chunk = chunk + ' ' + sentences[next]
-            next += 1
+    metadatas = []
+    for chunk, metadata in iter_page_chunks(pages, chunk_size, overlap_size, length_function):
         chunks.append(chunk)
-        i = next
-    return chunks
+        metadatas.append(metadata)
+    return chunks, metadatas
 
 
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
 from pdfminer.high_level import extract_pages
 from pdfminer.layout import LTTextContainer
+from pdfminer.pdfpage import PDFPage
 
-def extract_text_from_pdf(filename, page_numbers=None, min_line_length=1):
-    '''从 PDF 文件中（按指定页码）提取文字'''
+
+def count_pdf_pages(filename):
+    '''统计 PDF 页数（只解析页面目录，不做版面分析）'''
+    with open(filename, 'rb') as f:
+        return sum(1 for _ in PDFPage.get_pages(f))
+
+
+def _lines_to_paragraphs(lines, min_line_length):
+    '''按空行分隔，将文本行重新组织成段落'''
     paragraphs = []
-    buffer = ''
-    full_text = ''
-    # 提取全部文本
-    for i, page_layout in enumerate(extract_pages(filename)):
-        # 如果指定了页码范围，跳过范围外的页
-        if page_numbers is not None and i not in page_numbers:
-            continue
-        for element in page_layout:
-            if isinstance(element, LTTextContainer):
-                full_text += element.get_text() + '\n'
-    # 按空行分隔，将文本重新组织成段落
-    lines = full_text.split('\n')
+    buffer = []
     for text in lines:
         if len(text) >= min_line_length:
-            buffer += (' '+text) if not text.endswith('-') else text.strip('-')
+            buffer.append((' '+text) if not text.endswith('-') else text.strip('-'))
         elif buffer:
-            paragraphs.append(buffer)
-            buffer = ''
+            paragraphs.append(''.join(buffer))
+            buffer = []
     if buffer:
-        paragraphs.append(buffer)
+        paragraphs.append(''.join(buffer))
     return paragraphs
 
 
+def _page_paragraphs(page_layout, min_line_length):
+    '''提取一页中的段落；每个文本块之后都有一个空行，段落不会跨文本块，也就不会跨页'''
+    lines = chain.from_iterable(
+        (element.get_text() + '\n').split('\n')
+        for element in page_layout
+        if isinstance(element, LTTextContainer)
+    )
+    return _lines_to_paragraphs(lines, min_line_length)
+
+
+def _extract_page_range(filename, page_numbers, min_line_length):
+    '''提取指定页码（升序）的段落，返回 [(页码, 段落列表)]；作为进程池任务时需位于模块顶层'''
+    # 交给 pdfminer 按页码过滤，范围外的页不做版面分析
+    page_layouts = extract_pages(filename, page_numbers=page_numbers)
+    return [(i, _page_paragraphs(page_layout, min_line_length))
+            for i, page_layout in zip(page_numbers, page_layouts)]
+
+
+def create_extract_pool(workers):
+    '''
+    解析 PDF 的进程池，创建一次供多次导入共用（传给 iter_pages_from_pdf 的 executor）。
+
+    子进程以 spawn 方式启动：服务进程中有导入、向量计算、HTTP 等线程在运行，fork 出的子进程会继承
+    其他线程持有的锁而死锁。spawn 的子进程会重新导入主模块，启动服务的脚本需要 __main__ 保护
+    '''
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def iter_pages_from_pdf(filename, page_numbers=None, min_line_length=1, workers=1, pages_per_task=8,
+                        executor=None):
+    '''
+    从 PDF 文件中（按指定页码）逐页提取文字，逐页 yield (页码, 段落列表)，页码从 0 开始。
+
+    workers > 1 时按 pages_per_task 页一组分发到进程池并行解析，结果仍按页码顺序返回；
+    同时在途的任务数不超过 workers 的两倍，内存占用与文档总页数无关。
+    executor: create_extract_pool 创建的进程池，可选；不指定时本次调用临时创建一个
+    '''
+    if page_numbers is None:
+        page_numbers = range(count_pdf_pages(filename)) if workers > 1 else None
+    if page_numbers is not None:
+        page_numbers = sorted(set(page_numbers))
+
+    if workers <= 1 or len(page_numbers) <= pages_per_task:
+        if page_numbers is None:
+            # 顺序解析全部页面，逐页产出
+            for i, page_layout in enumerate(extract_pages(filename)):
+                yield i, _page_paragraphs(page_layout, min_line_length)
+        else:
+            yield from _extract_page_range(filename, page_numbers, min_line_length)
+        return
+
+    tasks = [page_numbers[i:i + pages_per_task] for i in range(0, len(page_numbers), pages_per_task)]
+    if executor is None:
+        with create_extract_pool(workers) as executor:
+            yield from _iter_page_tasks(executor, filename, tasks, min_line_length, workers)
+    else:
+        yield from _iter_page_tasks(executor, filename, tasks, min_line_length, workers)
+
+
+def _iter_page_tasks(executor, filename, tasks, min_line_length, workers):
+    '''提交解析任务并按顺序产出结果，同时在途的任务数不超过 workers 的两倍'''
+    pending = deque()
+    try:
+        for task in tasks:
+            pending.append(executor.submit(_extract_page_range, filename, task, min_line_length))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        # 导入中止时，共用进程池中本次导入还未开始的任务不再执行
+        for future in pending:
+            future.cancel()
+
+
+def extract_pages_from_pdf(filename, page_numbers=None, min_line_length=1, workers=1):
+    '''从 PDF 文件中（按指定页码）逐页提取文字，返回 [(页码, 段落列表)]'''
+    return list(iter_pages_from_pdf(filename, page_numbers, min_line_length, workers))
+
+
+def iter_text_from_pdf(filename, page_numbers=None, min_line_length=1, workers=1):
+    '''从 PDF 文件中（按指定页码）逐段 yield 文字'''
+    for _, paragraphs in iter_pages_from_pdf(filename, page_numbers, min_line_length, workers):
+        yield from paragraphs
+
+
+def extract_text_from_pdf(filename, page_numbers=None, min_line_length=1):
+    '''从 PDF 文件中（按指定页码）提取文字'''
+    return list(iter_text_from_pdf(filename, page_numbers, min_line_length))
+
+
 def build_prompt(prompt_template, **kwargs):
     '''将 Prompt 模板赋值'''
     inputs = {}
@@ -63,4 +275,6 @@ def build_prompt(prompt_template, **kwargs):
         else:
             val = v
         inputs[k] = val
-    return prompt_template.format(**inputs)
\ No newline at end of file
+    return prompt_template.format(**inputs)
+
+
@@ -1,51 +1,531 @@
+import os
+import threading
+
 import chromadb
 from chromadb.config import Settings
 
+from hashing import content_hash
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from local_index import LocalCollection
+from tracing import tracer
+
+
+class NamespaceDeletedError(RuntimeError):
+    '''导入过程中命名空间被删除（如会话已结束），剩余片段不再写入'''
+
+
+def scope_filter(source=None, namespace=None, where=None):
+    '''将 source、namespace 与额外的 where 条件合并为 chroma 的过滤条件'''
+    conditions = []
+    if source is not None:
+        conditions.append({"source": source})
+    if namespace is not None:
+        conditions.append({"namespace": namespace})
+    if where:
+        conditions.append(where)
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
 class MyVectorDBConnector:
-    def __init__(self, collection_name, embedding_fn):
+    def __init__(self, collection_name, embedding_fn, persist_path=None, keyword_index=False,
+                 search_mode="dense", backend="chroma", local_options=None, query_embedding_fn=None):
         """
         初始化Chroma类的实例。
 
         这个初始化过程主要包括：
         1. 连接到Chroma数据库客户端。
-        2. 重置数据库以确保干净的启动状态。
+        2. 未指定持久化路径时，重置数据库以确保干净的启动状态。
         3. 创建或获取一个指定名称的集合(collection)。
         4. 设置嵌入函数(embedding function)。
 
         参数:
         collection_name: 字符串，表示集合的名称，用于存储和检索嵌入向量。
         embedding_fn: 函数，用于计算给定输入的嵌入向量。
+        persist_path: 字符串，持久化目录。指定后数据保存在磁盘上，重启后无需重新导入
+            （按会话划分命名空间时，新会话看不到旧会话的文档，旧命名空间由 NamespaceRegistry 清理）。
+        keyword_index: 布尔值，是否同时维护 BM25 关键词索引（内存中，启动时根据集合内容重建）。
+        search_mode: search 的默认检索方式，"dense"（向量）、"keyword"（BM25）或 "hybrid"（两者 RRF 融合），
+            后两者需要 keyword_index。
+        backend: "chroma" 或 "local"。"local" 使用纯 NumPy 的 LocalCollection，省去 chroma 的调用开销，
+            适合中小规模的集合；指定 persist_path 时保存到 persist_path/collection_name 目录，
+            每次写入后只把新写入的片段追加到日志（LocalCollection.flush），日志较大时才完整保存一次。
+        local_options: 字典，传给 LocalCollection 的参数，如 {"dtype": "float16", "ivf_threshold": 50000}。
+        query_embedding_fn: 函数，计算检索问题的向量，默认与 embedding_fn 相同；
+            BGE 等模型的问题需要加前缀（BGEEmbedder.query_fn），文档不加。
         """
-        # 初始化Chroma数据库客户端，允许在必要时重置数据库状态。
-        chroma_client = chromadb.Client(Settings(allow_reset=True))
+        self.persist_dir = None
+        if backend == "local":
+            if persist_path:
+                self.persist_dir = os.path.join(persist_path, collection_name)
+            if self.persist_dir and os.path.exists(self.persist_dir):
+                self.collection = LocalCollection.load(self.persist_dir)
+            else:
+                self.collection = LocalCollection(collection_name, **(local_options or {}))
+        elif backend != "chroma":
+            raise ValueError(f"unknown backend {backend!r}")
+        else:
+            if persist_path:
+                # 持久化模式：不重置，复用上次导入的文档
+                chroma_client = chromadb.PersistentClient(path=persist_path)
+            else:
+                # 初始化Chroma数据库客户端，允许在必要时重置数据库状态。
+                chroma_client = chromadb.Client(Settings(allow_reset=True))
 
-        # 重置数据库以清除之前的设置和数据，确保每次初始化都是干净的环境。
-        # 为了演示，实际不需要每次 reset()
-        chroma_client.reset()
+                # 重置数据库以清除之前的设置和数据，确保每次初始化都是干净的环境。
+                # 为了演示，实际不需要每次 reset()
+                chroma_client.reset()
 
-        # 获取或创建一个指定名称的集合，用于后续的嵌入向量存储和检索。
-        # 创建一个 collection
-        self.collection = chroma_client.get_or_create_collection(name=collection_name)
+            # 获取或创建一个指定名称的集合，用于后续的嵌入向量存储和检索。
+            # 创建一个 collection
+            self.collection = chroma_client.get_or_create_collection(name=collection_name)
         # 设置用于计算嵌入向量的函数。
         self.embedding_fn = embedding_fn
+        self.query_embedding_fn = query_embedding_fn or embedding_fn
+        # 集合内容版本号，每次写入后递增，用于使依赖检索结果的缓存失效；
+        # 另按命名空间记录最后一次写入时的版本号，一个会话的写入不影响其他会话的缓存
+        self.version = 0
+        self._namespace_versions = {}
+        # 命名空间每删除一次加一，删除前开始的增量导入不再写入该命名空间
+        self._namespace_generations = {}
+        # 检索不加锁；写入由 write_lock 串行化，同一文档的增量导入由 document_lock 串行化
+        self.write_lock = threading.Lock()
+        self._document_locks = {}
+        self._document_locks_guard = threading.Lock()
+        # 关键词索引与集合同步更新，补充向量检索对型号、数字、章节标题等精确词的召回
+        self.keyword_index = BM25Index() if keyword_index else None
+        self.search_mode = search_mode
+        if self.keyword_index is not None:
+            self._load_keyword_index()
+
+    def _load_keyword_index(self, batch_size=1000):
+        '''根据集合中已有的片段重建关键词索引'''
+        offset = 0
+        while True:
+            batch = self.collection.get(
+                include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not batch['ids']:
+                break
+            self.keyword_index.add(batch['ids'], batch['documents'], batch['metadatas'])
+            offset += len(batch['ids'])
+
+    @staticmethod
+    def chunk_id(doc_hash, chunk_index, namespace=None):
+        '''
+        片段 id：文档内容哈希 + 片段序号，同一文档总是得到相同的 id，不同文档之间不会冲突。
+        指定 namespace 时加上命名空间前缀，不同命名空间导入同一文档互不影响。
+        '''
+        chunk_id = f"{doc_hash[:16]}-{chunk_index}"
+        return f"{namespace}/{chunk_id}" if namespace is not None else chunk_id
+
+    def document_lock(self, source, namespace=None):
+        '''返回同一文档（namespace + source）共用的锁，避免并发上传同一文档时的竞争'''
+        with self._document_locks_guard:
+            return self._document_locks.setdefault((namespace, source), threading.Lock())
+
+    def _chunk_records(self, documents, metadatas, source, doc_hash, start_index=0, seen=None,
+                       namespace=None):
+        '''
+        为每个片段生成 id 与 metadata，同一文档内内容重复的片段只保留第一个。
+
+        start_index: 第一个片段在文档中的序号，分批提交时使用
+        seen: 之前批次已出现的片段内容哈希集合，会被原地更新
+        namespace: 命名空间（如用户会话），写入 metadata 并用于区分 id
+        '''
+        records = {}
+        seen = set() if seen is None else seen
+        for offset, doc in enumerate(documents):
+            chunk_hash = content_hash(doc)
+            if chunk_hash in seen:
+                continue
+            seen.add(chunk_hash)
+            i = start_index + offset
+            # complete_hash 是导入完成标记，只在 DocumentSync.finish 时写到文档的第一个片段上，
+            # 这里显式清空，避免增量更新时保留旧版本的标记
+            metadata = {"doc_hash": doc_hash, "chunk_hash": chunk_hash, "chunk_index": i, "complete_hash": ""}
+            if source is not None:
+                metadata["source"] = source
+            if namespace is not None:
+                metadata["namespace"] = namespace
+            if metadatas is not None:
+                metadata.update(metadatas[offset])
+            records[chunk_hash] = (self.chunk_id(doc_hash, i, namespace), doc, metadata)
+        return records
+
+    def add_documents(self, documents, metadatas=None, source=None, doc_hash=None, namespace=None):
+        '''
+        向 collection 中添加文档与向量
+
+        参数:
+        documents: 文档切分后的片段列表。
+        metadatas: 每个片段的 metadata 列表（如 split_pages 返回的页码与字符区间），可选。
+        source: 字符串，文档来源（如文件名），检索时可按 source 过滤。
+        doc_hash: 字符串，文档内容哈希，默认根据片段内容计算。
+        namespace: 字符串，命名空间（如用户会话），检索时可按 namespace 过滤。
+        '''
+        if doc_hash is None:
+            doc_hash = content_hash('\n'.join(documents))
+        records = list(self._chunk_records(
+            documents, metadatas, source, doc_hash, namespace=namespace).values())
+        if not records:
+            return
+        # 一次写入全部片段，直接带上导入完成标记
+        records[0][2]["complete_hash"] = doc_hash
+        ids, docs, metas = zip(*records)
+        embeddings = self.embedding_fn(list(docs))  # 每个文档的向量
+        with self.write_lock:
+            self.collection.add(
+                embeddings=embeddings,
+                documents=list(docs),  # 文档的原文
+                metadatas=list(metas),  # 来源、页码、字符区间等
+                ids=list(ids)  # 每个文档的 id
+            )
+            if self.keyword_index is not None:
+                self.keyword_index.add(ids, docs, metas)
+            self._bump_version(namespace)
+            self.persist()
 
-    def add_documents(self, documents):
-        '''向 collection 中添加文档与向量'''
-        self.collection.add(
-            embeddings=self.embedding_fn(documents),  # 每个文档的向量
-            documents=documents,  # 文档的原文
-            ids=[f"id{i}" for i in range(len(documents))]  # 每个文档的 id
-        )
-
-    def search(self, query, top_n):
-        '''检索向量数据库'''
-        results = self.collection.query(
-            query_embeddings=self.embedding_fn([query]),
-            n_results=top_n
-        )
+    def _bump_version(self, namespace=None):
+        '''写入后递增版本号，需持有 write_lock'''
+        self.version += 1
+        self._namespace_versions[namespace] = self.version
+
+    def namespace_version(self, namespace=None):
+        '''
+        检索范围的内容版本号，只在该范围内有写入时变化。
+
+        namespace 为 None 时检索全部命名空间，返回整个集合的版本号
+        '''
+        if namespace is None:
+            return self.version
+        return self._namespace_versions.get(namespace, 0)
+
+    def persist(self):
+        '''local 后端指定了持久化目录时把新写入追加到磁盘（chroma 后端写入时已自动持久化）'''
+        if self.persist_dir is not None:
+            self.collection.flush(self.persist_dir)
+
+    def search(self, query, top_n, source=None, where=None, namespace=None, mode=None, candidates=None):
+        '''
+        检索向量数据库
+
+        source: 只在指定来源的文档中检索
+        namespace: 只在指定命名空间（如用户会话）的文档中检索
+        where: chroma 的 metadata 过滤条件，可与 source、namespace 同时使用
+        mode: "dense"、"keyword" 或 "hybrid"，默认为 search_mode
+        candidates: hybrid 模式下每种检索取回的候选数，以及 keyword 模式下有 where 条件时
+            首次取回的候选数，默认为 top_n 的 4 倍
+
+        返回与 chroma query 相同结构的结果；keyword 与 hybrid 模式下另有 scores（BM25 或 RRF 分数），
+        不是由向量检索召回的片段 distance 为 None
+        '''
+        mode = mode or self.search_mode
+        scope = scope_filter(source, namespace, where)
+        if mode == "dense":
+            return self._dense_search([query], top_n, scope)
+        if self.keyword_index is None:
+            raise ValueError(f"search mode {mode!r} requires keyword_index=True")
+
+        if mode == "keyword":
+            # BM25 索引只能按 source 与 namespace 过滤，where 条件由 chroma 在取回时过滤；
+            # 有 where 条件时多取候选，过滤后不足 top_n 且还有更多命中时扩大候选数重试
+            n = top_n if not where else (candidates or top_n * 4)
+            while True:
+                with tracer.span("keyword_search", queries=1):
+                    keyword_hits = self.keyword_index.search(query, n, source=source, namespace=namespace)
+                records = self._fetch(keyword_hits, where and scope)
+                hits = [(i, score) for i, score in keyword_hits if i in records]
+                if len(hits) >= top_n or len(keyword_hits) < n:
+                    break
+                n *= 4
+            return self._as_results(hits[:top_n], records)
+
+        if mode != "hybrid":
+            raise ValueError(f"unknown search mode {mode!r}")
+        return self._hybrid_search([query], top_n, source, where, namespace, candidates)
+
+    def _dense_search(self, queries, top_n, scope):
+        '''计算问题的向量并检索，两个阶段分别记录 span'''
+        with tracer.span("embed_query", queries=len(queries)):
+            query_embeddings = self.query_embedding_fn(list(queries))
+        with tracer.span("vector_search", queries=len(queries), top_n=top_n,
+                         backend=type(self.collection).__name__):
+            return self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=top_n,
+                where=scope
+            )
+
+    def _hybrid_search(self, queries, top_n, source=None, where=None, namespace=None, candidates=None):
+        '''向量检索（全部问题一次计算向量、一次检索）与 BM25 检索按 RRF 融合，结果按问题顺序排列'''
+        scope = scope_filter(source, namespace, where)
+        candidates = candidates or top_n * 4
+        dense = self._dense_search(queries, candidates, scope)
+        results = {key: [] for key in ("ids", "documents", "metadatas", "distances", "scores")}
+        # BM25 检索与 RRF 融合
+        with tracer.span("keyword_search", queries=len(queries)):
+            for row, query in enumerate(queries):
+                records = {
+                    i: (doc, meta, dist) for i, doc, meta, dist in zip(
+                        dense['ids'][row], dense['documents'][row], dense['metadatas'][row], dense['distances'][row])
+                }
+                keyword_hits = self.keyword_index.search(query, candidates, source=source, namespace=namespace)
+                # 只需取回向量检索没有召回的片段；有 where 条件时由 chroma 过滤
+                missing = [(i, score) for i, score in keyword_hits if i not in records]
+                fetched = self._fetch(missing, where and scope)
+                records.update(fetched)
+                keyword_ids = [i for i, _ in keyword_hits if i in records]
+                fused = reciprocal_rank_fusion([dense['ids'][row], keyword_ids])[:top_n]
+                for key, values in self._as_results(fused, records).items():
+                    results[key].extend(values)
         return results
+
+    def search_batch(self, queries, top_n, source=None, where=None, namespace=None, mode=None, candidates=None):
+        '''
+        检索一组问题，全部问题的向量一次计算、向量检索一次完成（local 后端合并为一次矩阵乘法）。
+        参数与 search 相同，返回与 chroma query 相同结构的结果，每个字段按问题顺序排列。
+        '''
+        queries = list(queries)
+        mode = mode or self.search_mode
+        if mode == "dense":
+            return self._dense_search(queries, top_n, scope_filter(source, namespace, where))
+        if self.keyword_index is None:
+            raise ValueError(f"search mode {mode!r} requires keyword_index=True")
+        if mode == "keyword":
+            results = {}
+            for query in queries:
+                for key, values in self.search(query, top_n, source, where, namespace, mode).items():
+                    results.setdefault(key, []).extend(values)
+            return results
+        if mode != "hybrid":
+            raise ValueError(f"unknown search mode {mode!r}")
+        return self._hybrid_search(queries, top_n, source, where, namespace, candidates)
+
+    def _fetch(self, hits, where=None):
+        '''按 id 取回片段，返回 {id: (文档, metadata, None)}'''
+        if not hits:
+            return {}
+        found = self.collection.get(
+            ids=[i for i, _ in hits], where=where, include=["documents", "metadatas"])
+        return {i: (doc, meta, None)
+                for i, doc, meta in zip(found['ids'], found['documents'], found['metadatas'])}
+
+    @staticmethod
+    def _as_results(hits, records):
+        '''将 [(id, 分数)] 整理成与 chroma query 相同结构的结果'''
+        ids = [i for i, _ in hits]
+        return {
+            "ids": [ids],
+            "documents": [[records[i][0] for i in ids]],
+            "metadatas": [[records[i][1] for i in ids]],
+            "distances": [[records[i][2] for i in ids]],
+            "scores": [[score for _, score in hits]],
+        }
     
 
-    def collection_size(self):
-        '''返回 collection 中的文档数量'''
-        return self.collection.count()
+    def collection_size(self, namespace=None):
+        '''
+        返回 collection 中的文档数量（指定 namespace 时只统计该命名空间）。
+
+        统计命名空间需要取出其全部 id，只判断是否有文档时用 has_documents
+        '''
+        if namespace is None:
+            return self.collection.count()
+        return len(self.collection.get(where={"namespace": namespace}, include=[])['ids'])
+
+    def has_documents(self, namespace=None):
+        '''命名空间中是否有文档，只取一个 id'''
+        if namespace is None:
+            return self.collection.count() > 0
+        return len(self.collection.get(where={"namespace": namespace}, limit=1, include=[])['ids']) > 0
+
+    def stored_namespaces(self):
+        '''集合中出现过的全部命名空间；需要读取全部 metadata，只在启动时清理失效命名空间用'''
+        metadatas = self.collection.get(include=["metadatas"])['metadatas']
+        return {m["namespace"] for m in metadatas if m and m.get("namespace") is not None}
+
+    def delete_namespace(self, namespace):
+        '''
+        删除命名空间（如已结束的用户会话）下的全部片段。
+
+        正在进行的增量导入在下一次写入时抛出 NamespaceDeletedError，不会在删除后留下片段
+        '''
+        with self.write_lock:
+            self._namespace_generations[namespace] = self._namespace_generations.get(namespace, 0) + 1
+            self.collection.delete(where={"namespace": namespace})
+            if self.keyword_index is not None:
+                self.keyword_index.remove_where(namespace=namespace)
+            self.version += 1
+            self._namespace_versions.pop(namespace, None)
+            self.persist()
+        # 正被导入持有的锁保留，否则同一文档的下一次导入会拿到另一把锁
+        with self._document_locks_guard:
+            for key in [k for k, lock in self._document_locks.items() if k[0] == namespace and not lock.locked()]:
+                del self._document_locks[key]
+
+    def has_document(self, doc_hash, namespace=None):
+        '''
+        判断指定内容哈希的文档是否已经完整导入（指定 namespace 时只在该命名空间中查找）。
+
+        按导入完成标记判断：中途失败的导入只写入了部分片段，没有标记，再次导入时会补齐剩余片段
+        '''
+        found = self.collection.get(
+            where=scope_filter(namespace=namespace, where={"complete_hash": doc_hash}), limit=1, include=[])
+        return len(found['ids']) > 0
+
+    def document_source(self, doc_hash, namespace=None):
+        '''
+        已完整导入的内容哈希对应的文档标识（source），没有时返回 None。
+
+        同一内容以不同文件名再次上传时不会重新导入，片段上仍是首次导入时的 source，按 source 检索要用它
+        '''
+        found = self.collection.get(
+            where=scope_filter(namespace=namespace, where={"complete_hash": doc_hash}), limit=1,
+            include=["metadatas"])
+        if not found['ids']:
+            return None
+        return found['metadatas'][0].get("source")
+
+    def start_sync(self, source, doc_hash, namespace=None):
+        '''开始一次分批的增量导入，返回 DocumentSync；调用方应持有 document_lock(source, namespace)'''
+        return DocumentSync(self, source, doc_hash, namespace)
+
+    def sync_document(self, source, documents, metadatas=None, doc_hash=None, namespace=None):
+        '''
+        按内容哈希增量导入一个文档的全部片段。
+
+        - 文档内容未变（doc_hash 已存在）时直接返回，不做任何计算；
+        - 文档内容变化时，只为新增的片段计算向量，并删除已不存在的片段。
+
+        参数:
+        source: 字符串，文档标识（如文件名），同一文档的不同版本使用相同的 source。
+        documents: 文档切分后的片段列表。
+        metadatas: 每个片段的 metadata 列表，可选。
+        doc_hash: 字符串，文档内容哈希，默认根据片段内容计算。
+        namespace: 字符串，命名空间（如用户会话），不同命名空间的同名文档互不影响。
+
+        返回 (新增片段数, 删除片段数)
+        '''
+        if doc_hash is None:
+            doc_hash = content_hash('\n'.join(documents))
+        with self.document_lock(source, namespace):
+            if self.has_document(doc_hash, namespace):
+                return 0, 0
+
+            sync = self.start_sync(source, doc_hash, namespace)
+            sync.write(*sync.prepare(documents, metadatas))
+            return sync.finish()
+
+
+class DocumentSync:
+    def __init__(self, vector_db, source, doc_hash, namespace=None):
+        """
+        一次增量导入。片段可以分批提交，且分配 id（prepare）、计算向量与写入（write）相互独立，
+        便于在流水线中让不同阶段并发执行。全部片段提交后调用 finish 删除已不存在的旧片段。
+
+        参数:
+        vector_db: MyVectorDBConnector 实例。
+        source: 字符串，文档标识（如文件名）。
+        doc_hash: 字符串，本次导入的文档内容哈希。
+        namespace: 字符串，命名空间（如用户会话）。
+        """
+        self.vector_db = vector_db
+        self.source = source
+        self.doc_hash = doc_hash
+        self.namespace = namespace
+        self.generation = vector_db._namespace_generations.get(namespace, 0)
+        self.next_index = 0
+        self.seen = set()
+        self.added = 0
+        self.kept = 0
+        # 第一个片段的 (id, metadata)，finish 时在其上写入导入完成标记
+        self.first = None
+
+        # 按片段内容哈希比对旧版本：内容未变的片段沿用原 id 与向量
+        existing = vector_db.collection.get(
+            where=scope_filter(source, namespace), include=["metadatas"])
+        self.existing = {}
+        self.stale = []
+        for chunk_id, metadata in zip(existing['ids'], existing['metadatas']):
+            chunk_hash = (metadata or {}).get("chunk_hash")
+            if chunk_hash is not None and chunk_hash not in self.existing:
+                self.existing[chunk_hash] = chunk_id
+            else:
+                self.stale.append(chunk_id)
+
+    def prepare(self, documents, metadatas=None):
+        '''为下一批片段分配 id 与 metadata，返回 (保留的 [(id, metadata)], 新增的 [(id, 文档, metadata)])'''
+        records = self.vector_db._chunk_records(
+            documents, metadatas, self.source, self.doc_hash, self.next_index, self.seen, self.namespace)
+        self.next_index += len(documents)
+        kept = [(self.existing[h], meta) for h, (_, _, meta) in records.items() if h in self.existing]
+        added = [record for h, record in records.items() if h not in self.existing]
+        if self.first is None and records:
+            h, (chunk_id, _, meta) = next(iter(records.items()))
+            self.first = (self.existing.get(h, chunk_id), meta)
+        return kept, added
+
+    def write(self, kept, added, embeddings=None):
+        '''写入 prepare 的结果；embeddings 为新增片段的向量，为空时用 embedding_fn 计算'''
+        if added:
+            docs = [doc for _, doc, _ in added]
+            if embeddings is None:
+                embeddings = self.vector_db.embedding_fn(docs)
+        with self.vector_db.write_lock:
+            self._check_namespace()
+            self._write(kept, added, embeddings)
+
+    def _check_namespace(self):
+        '''命名空间在导入开始后被删除时抛出 NamespaceDeletedError；需持有 write_lock'''
+        if self.vector_db._namespace_generations.get(self.namespace, 0) != self.generation:
+            raise NamespaceDeletedError(f"namespace {self.namespace!r} was deleted during the import")
+
+    def _write(self, kept, added, embeddings):
+        collection = self.vector_db.collection
+        keyword_index = self.vector_db.keyword_index
+        if kept:
+            # 保留的片段无需重新计算向量，只更新所属文档版本、页码等 metadata
+            ids = [chunk_id for chunk_id, _ in kept]
+            metadatas = [meta for _, meta in kept]
+            collection.update(ids=ids, metadatas=metadatas)
+            if keyword_index is not None:
+                keyword_index.update_metadata(ids, metadatas)
+            self.kept += len(kept)
+        if added:
+            ids = [chunk_id for chunk_id, _, _ in added]
+            docs = [doc for _, doc, _ in added]
+            metadatas = [meta for _, _, meta in added]
+            collection.add(embeddings=embeddings, documents=docs, metadatas=metadatas, ids=ids)
+            if keyword_index is not None:
+                keyword_index.add(ids, docs, metadatas)
+            self.added += len(added)
+        if kept or added:
+            self.vector_db._bump_version(self.namespace)
+
+    def finish(self):
+        '''
+        删除新版本中已不存在的片段并写入导入完成标记，返回 (新增片段数, 删除片段数)。
+
+        全部片段写入后才调用；之前中断的导入没有完成标记，has_document 不会把它当作已导入
+        '''
+        to_delete = self.stale + [i for h, i in self.existing.items() if h not in self.seen]
+        if to_delete:
+            with self.vector_db.write_lock:
+                self._check_namespace()
+                self.vector_db.collection.delete(ids=to_delete)
+                if self.vector_db.keyword_index is not None:
+                    self.vector_db.keyword_index.remove(to_delete)
+                self.vector_db._bump_version(self.namespace)
+        if self.first is not None:
+            chunk_id, metadata = self.first
+            metadata = dict(metadata, complete_hash=self.doc_hash)
+            with self.vector_db.write_lock:
+                self._check_namespace()
+                self.vector_db.collection.update(ids=[chunk_id], metadatas=[metadata])
+                if self.vector_db.keyword_index is not None:
+                    self.vector_db.keyword_index.update_metadata([chunk_id], [metadata])
+        if self.added or self.kept or to_delete:
+            with self.vector_db.write_lock:
+                self.vector_db.persist()
+        return self.added, len(to_delete)
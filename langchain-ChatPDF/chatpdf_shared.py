@@ -0,0 +1,56 @@
+"""
+The framework-free modules shared with the ChatPDF app.
+
+Tracing, transcript rendering, the BM25 index, embedding batching, content hashing and the local
+BGE embedder are implemented once in ../ChatPDF and loaded from there, so a fix to one of them
+applies to both apps.
+Set CHATPDF_DIR when the ChatPDF directory lives elsewhere.
+"""
+import importlib.util
+import os
+import sys
+
+CHATPDF_DIR = os.getenv("CHATPDF_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ChatPDF")
+
+
+def _load(name):
+    """
+    Load a module of the ChatPDF app by file path, without putting its whole directory on sys.path.
+
+    Args:
+        name (str): The module name, e.g. "tracing".
+
+    Returns:
+        module: The loaded module, shared by every importer in this process.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.spec_from_file_location(name, os.path.join(CHATPDF_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+tracing = _load("tracing")
+transcript = _load("transcript")
+bm25_index = _load("bm25_index")
+embedding_engine = _load("embedding_engine")
+hashing = _load("hashing")
+local_embedding = _load("local_embedding")
+
+NOOP_SPAN = tracing.NOOP_SPAN
+tracer = tracing.tracer
+configure_from_env = tracing.configure_from_env
+serve_metrics = tracing.serve_metrics
+TranscriptRenderer = transcript.TranscriptRenderer
+BM25Index = bm25_index.BM25Index
+reciprocal_rank_fusion = bm25_index.reciprocal_rank_fusion
+estimate_tokens = embedding_engine.estimate_tokens
+pack_batches = embedding_engine.pack_batches
+is_retryable = embedding_engine.is_retryable
+file_sha256 = hashing.file_sha256
+BGEEmbedder = local_embedding.BGEEmbedder
+BGE_QUERY_INSTRUCTION = local_embedding.BGE_QUERY_INSTRUCTION
@@ -0,0 +1,151 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from chatpdf_shared import BGE_QUERY_INSTRUCTION, BGEEmbedder, is_retryable, pack_batches, tracer
+
+
+class ConcurrentEmbeddings(Embeddings):
+    """
+    An Embeddings wrapper that packs documents into budgeted batches and embeds them concurrently.
+    """
+
+    def __init__(self, base_embeddings, max_tokens_per_batch=8000, max_items_per_batch=256,
+                 max_workers=4, max_retries=3, backoff=0.5):
+        """
+        Initialize the wrapper around an existing Embeddings object.
+
+        Args:
+            base_embeddings (Embeddings): The embeddings model that performs each request, e.g. OpenAIEmbeddings.
+            max_tokens_per_batch (int): The estimated token budget per request. Defaults to 8000.
+            max_items_per_batch (int): The maximum number of texts per request. Defaults to 256.
+            max_workers (int): The maximum number of requests in flight. Defaults to 4.
+            max_retries (int): How many times a failed batch is retried after a connection error, timeout,
+                rate limit or 5xx response; other errors are raised at once. Create the base embeddings with
+                max_retries=0 so failures are not retried by both layers. Defaults to 3.
+            backoff (float): Seconds to wait before the first retry, doubled on each attempt. Defaults to 0.5.
+        """
+        self.base_embeddings = base_embeddings
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_items_per_batch = max_items_per_batch
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embedding")
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents, returning the vectors in input order.
+
+        Args:
+            texts (list): The documents to embed.
+
+        Returns:
+            list: One vector per document.
+        """
+        texts = list(texts)
+        batches = pack_batches(texts, self.max_tokens_per_batch, self.max_items_per_batch)
+        with tracer.span("embed_documents", texts=len(texts), batches=len(batches)):
+            futures = [
+                self._executor.submit(self._embed_with_retry, [texts[i] for i in batch])
+                for batch in batches
+            ]
+            vectors = [None] * len(texts)
+            for batch, future in zip(batches, futures):
+                for i, vector in zip(batch, future.result()):
+                    vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a single query text.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            list: The query vector.
+        """
+        with tracer.span("embed_query"):
+            return self.base_embeddings.embed_query(text)
+
+    def _embed_with_retry(self, batch):
+        attempt = 0
+        while True:
+            with self._lock:
+                self.requests += 1
+            try:
+                return self.base_embeddings.embed_documents(batch)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                with self._lock:
+                    self.retries += 1
+                tracer.count("embedding_retries_total")
+                delay = self.backoff * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+                attempt += 1
+
+
+class LocalBGEEmbeddings(Embeddings):
+    """
+    A LangChain adapter around ChatPDF's BGEEmbedder, which keeps the model warm, encodes
+    length-sorted batches once per distinct text and supports ONNX Runtime and int8 quantization.
+    """
+
+    def __init__(self, model_name="BAAI/bge-large-zh-v1.5", batch_size=32, max_length=512, normalize=True,
+                 backend="torch", quantize=False, onnx_dir="onnx_models", query_instruction=BGE_QUERY_INSTRUCTION):
+        """
+        Initialize the embeddings; the model is loaded on first use (or by warmup) and kept in memory.
+
+        Args:
+            model_name (str): The sentence-transformers model name or local path. Defaults to "BAAI/bge-large-zh-v1.5".
+            batch_size (int): The number of texts encoded per forward pass. Defaults to 32.
+            max_length (int): The maximum number of tokens per text. Defaults to 512.
+            normalize (bool): Whether to return unit vectors. Defaults to True.
+            backend (str): "torch", or "onnx" to run on ONNX Runtime. Defaults to "torch".
+            quantize (bool): Whether to use int8 dynamic quantization. Defaults to False.
+            onnx_dir (str): Where the quantized ONNX model is exported for the onnx backend. Defaults to "onnx_models".
+            query_instruction (str): The prefix BGE recommends for retrieval queries. Defaults to the Chinese instruction.
+        """
+        self.embedder = BGEEmbedder(model_name, batch_size=batch_size, max_length=max_length, normalize=normalize,
+                                    backend=backend, quantize=quantize, onnx_dir=onnx_dir,
+                                    query_instruction=query_instruction)
+        self._embed_queries = self.embedder.query_fn()
+
+    def warmup(self):
+        """
+        Load the model and run one encoding so the first request does not pay for it.
+        """
+        self.embedder.warmup()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents, returning the vectors in input order.
+
+        Args:
+            texts (list): The documents to embed.
+
+        Returns:
+            list: One vector per document.
+        """
+        with tracer.span("embed_documents", texts=len(texts), model=self.embedder.name):
+            return self.embedder(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a single query text with the query instruction prepended.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            list: The query vector.
+        """
+        with tracer.span("embed_query", model=self.embedder.name):
+            return self._embed_queries([text])[0]
@@ -3,32 +3,102 @@ from langchain_openai import ChatOpenAI
 from langchain_community.chat_models import QianfanChatEndpoint
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.callbacks import BaseCallbackHandler
 from prompt_base import prompt_template
+from chatpdf_shared import NOOP_SPAN, tracer
+from concurrent.futures import Future
+import threading
+import time
+import httpx
 import os
 
+
+def _record_attempt(span):
+    """
+    Count one HTTP request of a model call on its span; every request after the first is a retry.
+    """
+    if span.get("attempts"):
+        span.add("retries")
+        tracer.count("llm_retries_total")
+    span.add("attempts")
+
+
+def _on_request(request):
+    _record_attempt(tracer.current())
+
+
+async def _on_request_async(request):
+    _record_attempt(tracer.current())
+
+
+class _UsageCallback(BaseCallbackHandler):
+    """
+    Record the token usage reported by the model on a span.
+    """
+
+    def __init__(self, span):
+        self.span = span
+
+    def on_llm_end(self, response, **kwargs):
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                usage["prompt"] = usage.get("prompt", 0) + metadata.get("input_tokens", 0)
+                usage["completion"] = usage.get("completion", 0) + metadata.get("output_tokens", 0)
+        if not any(usage.values()):
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            usage = {"prompt": token_usage.get("prompt_tokens", 0),
+                     "completion": token_usage.get("completion_tokens", 0)}
+        for kind, tokens in usage.items():
+            if tokens:
+                self.span.add(f"{kind}_tokens", tokens)
+                tracer.count("llm_tokens_total", tokens, kind=kind)
+
 class LLMUtils:
     """
     A utility class for handling multiple language models and invoking them based on user input.
     """
 
-    def __init__(self, model_name="gpt"):
+    def __init__(self, model_name="gpt", max_concurrency=16, timeout=60, max_retries=3, max_connections=64):
         """
         Initialize the LLMUtils class with model configurations.
 
         Args:
             model_name (str): The default model to use. Defaults to "gpt".
+            max_concurrency (int): The maximum number of model calls in flight across all users. Defaults to 16.
+            timeout (float): The request timeout in seconds. Defaults to 60.
+            max_retries (int): How many times a failed request is retried with backoff. Defaults to 3.
+            max_connections (int): The size of the shared HTTP connection pool. Defaults to 64.
         """
         self.model_name = model_name        
 
         # Initialize QianfanChatEndpoint with credentials from environment variables
         self.ernie_model = QianfanChatEndpoint(
             qianfan_ak=os.getenv('ERNIE_CLIENT_ID'),
-            qianfan_sk=os.getenv('ERNIE_CLIENT_SECRET')
+            qianfan_sk=os.getenv('ERNIE_CLIENT_SECRET'),
+            request_timeout=timeout
         )
 
-        # Initialize GPT model
-        self.gpt_model = ChatOpenAI()
+        # Initialize GPT model with pooled HTTP connections shared by all requests;
+        # the request hooks count the retries made by the OpenAI client on the current span
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.gpt_model = ChatOpenAI(
+            http_client=httpx.Client(limits=limits, timeout=timeout,
+                                     event_hooks={"request": [_on_request]}),
+            http_async_client=httpx.AsyncClient(limits=limits, timeout=timeout,
+                                                event_hooks={"request": [_on_request_async]}),
+            timeout=timeout,
+            max_retries=max_retries,
+            # Ask for the token usage in the last chunk of streamed answers too
+            stream_usage=True
+        )
+
+        # Global concurrency limit and the identical requests currently in flight
+        self.max_concurrency = max_concurrency
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
 
         # Select model based on configurable alternatives
         self.model = self.gpt_model.configurable_alternatives(
@@ -41,34 +111,165 @@ class LLMUtils:
         # Load the prompt template
         self.prompt = ChatPromptTemplate.from_template(prompt_template)
 
-    def invoke(self, question, context_retriever):
+        # Build the processing chain once; the context is supplied by the caller
+        self.chain = self.prompt | self.model | StrOutputParser()
+
+        # Chains bound to a specific model, built on first use
+        self.model_chains = {}
+
+    def get_chain(self, model_name=None):
+        """
+        Get the processing chain bound to a model, building it only once per model.
+
+        Args:
+            model_name (str): The model to use. Defaults to the model given at initialization.
+
+        Returns:
+            object: The runnable chain configured for the model.
+        """
+        model_name = model_name or self.model_name
+        chain = self.model_chains.get(model_name)
+        if chain is None:
+            chain = self.chain.with_config(configurable={"llm": model_name})
+            self.model_chains[model_name] = chain
+        return chain
+
+    def retrieve(self, question, context_retriever):
+        """
+        Retrieve the context documents for a question and join them into one text.
+
+        Args:
+            question (str): The question to be answered.
+            context_retriever (object): The retriever object to get relevant context documents.
+
+        Returns:
+            str: The relevant texts separated by blank lines.
+        """
+        with tracer.span("retrieve") as span:
+            ref_docs = context_retriever.invoke(question)
+            span.set(documents=len(ref_docs))
+        relevant_texts = [doc.page_content for doc in ref_docs]
+        return "\n\n".join(relevant_texts)
+
+    def invoke(self, question, context_retriever, model_name=None):
         """
         Invoke the language model to get an answer to the given question using the specified context retriever.
 
         Args:
             question (str): The question to be answered.
             context_retriever (object): The retriever object to get relevant context documents.
+            model_name (str): The model to use. Defaults to the model given at initialization.
 
         Returns:
             tuple: A tuple containing the model response and the relevant texts.
         """
-        self.context_retriever = context_retriever
-        
-        # Retrieve relevant documents based on the question
-        ref_docs = self.context_retriever.invoke(question)     
-        relevant_texts = [doc.page_content for doc in ref_docs]
-        relevant_texts = "\n\n".join(relevant_texts)
-
-        # Define the processing chain
-        self.chain = (
-            {"question": RunnablePassthrough(), "context": self.context_retriever}
-            | self.prompt
-            | self.model 
-            | StrOutputParser()
-        )
+        model_name = model_name or self.model_name
+        with tracer.span("answer", model=model_name):
+            # Retrieve relevant documents once and feed them into the prompt directly
+            relevant_texts = self.retrieve(question, context_retriever)
+
+            # Invoke the chain with the specified model configuration
+            chain = self.get_chain(model_name)
+            inputs = {"question": question, "context": relevant_texts}
+            with tracer.span("generate", model=model_name, context_chars=len(relevant_texts)) as span:
+                # The usage callback is only attached while tracing, to keep the call path unchanged otherwise
+                config = {"callbacks": [_UsageCallback(span)]} if span else None
+                response = self.coalesce(
+                    (model_name, question, relevant_texts),
+                    lambda: chain.invoke(inputs, config=config)
+                )
 
-        # Invoke the chain with the specified model configuration
-        response = self.chain.with_config(configurable={"llm": self.model_name}).invoke(question)
-        
         return response, relevant_texts
-    
\ No newline at end of file
+
+    def coalesce(self, key, call):
+        """
+        Run a model call under the concurrency limit, sharing the result with identical calls already in flight.
+
+        Args:
+            key (tuple): Identifies the request; calls with the same key share one model call.
+            call (callable): The function that performs the model call.
+
+        Returns:
+            object: The result of the call.
+        """
+        with self.inflight_lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.inflight[key] = future
+
+        if not owner:
+            tracer.current().set(coalesced=True)
+            return future.result()
+
+        try:
+            with self.semaphore:
+                result = call()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.inflight_lock:
+                self.inflight.pop(key, None)
+
+    def invoke_stream(self, question, context_retriever=None, model_name=None, relevant_texts=None, trace=None):
+        """
+        Stream the answer to the given question, yielding text chunks as the model produces them.
+
+        Args:
+            question (str): The question to be answered.
+            context_retriever (object): The retriever object, used when `relevant_texts` is not given.
+            model_name (str): The model to use. Defaults to the model given at initialization.
+            relevant_texts (str): Context already retrieved for this question, to avoid retrieving it again.
+            trace (Span): The span this answer belongs to, e.g. one started by the caller around
+                its own retrieval. Defaults to a new "answer_stream" span.
+
+        Yields:
+            str: The next chunk of the model response.
+        """
+        # A generator may resume in another context, so spans are only made current
+        # for the work between two yields and never held across one
+        model_name = model_name or self.model_name
+        root = trace or tracer.start("answer_stream", model=model_name)
+        generate = NOOP_SPAN
+        try:
+            if relevant_texts is None:
+                with tracer.activate(root):
+                    relevant_texts = self.retrieve(question, context_retriever)
+
+            generate = tracer.start("generate", parent=root or None, model=model_name,
+                                    context_chars=len(relevant_texts), stream=True)
+            config = {"callbacks": [_UsageCallback(generate)]} if generate else None
+            # A stream holds one concurrency slot until it is fully consumed
+            with self.semaphore:
+                stream = self.get_chain(model_name).stream(
+                    {"question": question, "context": relevant_texts}, config=config
+                )
+                chunks = 0
+                start = time.perf_counter()
+                done = object()
+                while True:
+                    with tracer.activate(generate):
+                        chunk = next(stream, done)
+                    if chunk is done:
+                        break
+                    if not chunks:
+                        generate.set(first_token_seconds=time.perf_counter() - start)
+                    chunks += 1
+                    yield chunk
+            generate.set(chunks=chunks).end()
+        except GeneratorExit:
+            # The caller stopped reading, e.g. the browser session went away
+            generate.set(cancelled=True).end()
+            raise
+        except Exception as e:
+            generate.end(e)
+            if trace is None:
+                root.end(e)
+            raise
+        finally:
+            if trace is None:
+                root.end()
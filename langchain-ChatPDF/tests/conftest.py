@@ -0,0 +1,42 @@
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class HashEmbeddings(Embeddings):
+    """Deterministic bag-of-words vectors, so tests need no embedding service."""
+
+    def __init__(self, dim=32):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1
+        return (vector / (np.linalg.norm(vector) or 1)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """Write a PDF with one page per text and return its path."""
+    import pymupdf
+
+    def make(name, pages):
+        path = str(tmp_path / name)
+        document = pymupdf.open()
+        for text in pages:
+            document.new_page().insert_textbox(pymupdf.Rect(72, 72, 540, 770), text)
+        document.save(path)
+        return path
+    return make
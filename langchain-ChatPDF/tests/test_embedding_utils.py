@@ -0,0 +1,60 @@
+import httpx
+import openai
+import pytest
+
+from conftest import HashEmbeddings
+from embedding_utils import ConcurrentEmbeddings, LocalBGEEmbeddings
+
+
+def status_error(code):
+    request = httpx.Request("POST", "http://127.0.0.1/v1/embeddings")
+    return openai.APIStatusError("error", response=httpx.Response(code, request=request), body=None)
+
+
+class FailingEmbeddings(HashEmbeddings):
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = list(errors)
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return super().embed_documents(texts)
+
+
+def test_only_transient_errors_are_retried():
+    base = FailingEmbeddings([status_error(429), status_error(502), openai.APIConnectionError(
+        request=httpx.Request("POST", "http://127.0.0.1"))])
+    embeddings = ConcurrentEmbeddings(base, backoff=0)
+    assert len(embeddings.embed_documents(["a", "b"])) == 2
+    assert base.calls == 4 and embeddings.retries == 3
+
+    base = FailingEmbeddings([status_error(401)])
+    with pytest.raises(openai.APIStatusError):
+        ConcurrentEmbeddings(base, backoff=0).embed_documents(["a"])
+    assert base.calls == 1
+
+
+class FakeSentenceTransformer:
+    """Stands in for the loaded model; records the texts it encodes."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, batch_size, normalize_embeddings, convert_to_numpy):
+        self.encoded.extend(texts)
+        return HashEmbeddings(dim=8).embed_documents(texts)
+
+
+def test_local_bge_embeddings_delegate_to_the_shared_embedder():
+    embeddings = LocalBGEEmbeddings(backend="onnx", quantize=True, query_instruction="query: ")
+    model = embeddings.embedder._model = FakeSentenceTransformer()
+    assert embeddings.embedder.name.endswith("-onnx-int8")
+    vectors = embeddings.embed_documents(["same text", "other", "same text"])
+    assert vectors[0] == vectors[2] and len(vectors) == 3
+    # Duplicates are encoded once; queries get the instruction, documents do not
+    assert model.encoded == ["other", "same text"]
+    embeddings.embed_query("what is llama")
+    assert model.encoded[-1] == "query: what is llama"
@@ -0,0 +1,60 @@
+import threading
+
+from conftest import HashEmbeddings
+from vector_db_utils import VectorDBConnector
+
+TOPICS = ["attention", "tokenizer", "reward model", "safety", "context length", "pretraining data",
+          "ghost attention", "rejection sampling", "temperature", "red teaming"]
+
+
+def report_pages(n):
+    return [" ".join(f"Section {page}.{line} discusses {TOPICS[(page + line) % len(TOPICS)]} "
+                     f"in experiment {page * 31 + line}." for line in range(20)) for page in range(n)]
+
+
+def test_ivfpq_namespace_starts_flat_and_trains_once_enough_chunks_are_collected(make_pdf):
+    connector = VectorDBConnector(embeddings=HashEmbeddings(), index_type="ivfpq", ivfpq_train_size=256)
+    small = make_pdf("small.pdf", ["Llama 2 is a family of pretrained language models.",
+                                   "Llama 2-Chat is tuned for dialogue with human feedback."])
+    # A first upload of a few chunks cannot train 8-bit PQ codebooks
+    assert 0 < connector.add_file(small, namespace="s") < 256
+    assert connector.stores["s"].index_type == "flat"
+    retriever = connector.get_retriever(k=1, namespace="s", mode="dense")
+    assert "Chat" in retriever.invoke("Llama 2-Chat dialogue")[0].page_content
+
+    added = connector.add_file(make_pdf("report.pdf", report_pages(80)), namespace="s")
+    store = connector.stores["s"]
+    assert store.index_type == "ivfpq"
+    assert store.db.index.is_trained and store.db.index.ntotal == len(store.documents) > added
+    assert len(connector.get_retriever(k=2, namespace="s").invoke("reward model experiment")) == 2
+
+
+class BlockingEmbeddings(HashEmbeddings):
+    """Blocks document embedding until released, to interleave an upload with a removal."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def embed_documents(self, texts):
+        self.started.set()
+        self.release.wait(10)
+        return super().embed_documents(texts)
+
+
+def test_upload_in_progress_does_not_recreate_removed_namespace(make_pdf, tmp_path):
+    embeddings = BlockingEmbeddings()
+    connector = VectorDBConnector(embeddings=embeddings, persist_dir=str(tmp_path / "index"))
+    path = make_pdf("doc.pdf", report_pages(2))
+    result = []
+    upload = threading.Thread(target=lambda: result.append(connector.add_file(path, namespace="s")))
+    upload.start()
+    assert embeddings.started.wait(10)
+    connector.remove_namespace("s")
+    embeddings.release.set()
+    upload.join()
+    assert result == [0]
+    assert not connector.has_documents("s")
+    # A new upload to the same namespace works as before
+    assert connector.add_file(path, namespace="s") > 0
@@ -1,33 +1,267 @@
+import math
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import faiss
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain_community.document_loaders import PyMuPDFLoader
+from langchain_core.retrievers import BaseRetriever
+from embedding_utils import ConcurrentEmbeddings
+from chatpdf_shared import BM25Index, file_sha256, reciprocal_rank_fusion, tracer
+
+class _GuardedRetriever(BaseRetriever):
+    """
+    Search one namespace store, holding its lock only for the FAISS lookup.
+
+    The query is embedded before taking the lock, so a slow embedding request never blocks an
+    upload to the same namespace; the BM25 index has its own lock.
+    """
+
+    store: Any
+    k: int
+    mode: str = "hybrid"
+    candidates: int = 0
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        with tracer.span("search", mode=self.mode, k=self.k) as span:
+            n = self.candidates if self.mode == "hybrid" else self.k
+            rankings = []
+            if self.mode != "keyword":
+                vector = self.store.db.embeddings.embed_query(query)
+                start = time.perf_counter()
+                with self.store.lock:
+                    span.set(lock_wait_seconds=time.perf_counter() - start)
+                    rankings.append(self.store.db.similarity_search_by_vector(vector, k=n))
+            if self.mode != "dense":
+                documents = self.store.documents
+                rankings.append([documents[int(i)] for i, _ in self.store.keyword_index.search(query, n)])
+        if len(rankings) == 1:
+            return rankings[0][:self.k]
+        # Fuse by rank so the two score scales need no calibration; chunks are identified by their text
+        by_text = {doc.page_content: doc for ranking in rankings for doc in ranking}
+        fused = reciprocal_rank_fusion([[doc.page_content for doc in ranking] for ranking in rankings])
+        return [by_text[text] for text, _ in fused[:self.k]]
+
+
+class _NamespaceStore:
+    """
+    The FAISS index, BM25 index and uploaded file hashes of one namespace.
+    """
+
+    def __init__(self, db, index_type):
+        self.db = db
+        self.index_type = index_type
+        self.lock = threading.Lock()
+        self.documents = [db.docstore.search(db.index_to_docstore_id[i]) for i in range(db.index.ntotal)]
+        self.files = {doc.metadata.get("file_hash") for doc in self.documents}
+        # BM25 entries are keyed by position in `documents` and updated incrementally on upload
+        self.keyword_index = BM25Index(filter_keys=())
+        self.keyword_index.add([str(i) for i in range(len(self.documents))],
+                               [doc.page_content for doc in self.documents])
+
+    def add(self, documents, vectors):
+        """
+        Append embedded chunks to the FAISS and BM25 indexes; the caller holds `lock`.
+        """
+        start = len(self.documents)
+        self.db.add_embeddings(
+            list(zip([doc.page_content for doc in documents], vectors)),
+            metadatas=[doc.metadata for doc in documents],
+        )
+        self.documents.extend(documents)
+        self.files.update(doc.metadata.get("file_hash") for doc in documents)
+        self.keyword_index.add([str(start + i) for i in range(len(documents))],
+                               [doc.page_content for doc in documents])
+
 
 class VectorDBConnector:
     """
     A class to handle the connection and operations related to a vector database using Langchain and OpenAI embeddings.
+
+    Documents are kept per namespace (e.g. one per user session) so that uploads from different
+    users never mix. Each namespace has its own FAISS index that grows incrementally: uploading
+    another file embeds only that file, and a file already in the namespace is skipped. With a
+    persist directory every index is saved after each upload and loaded on first use, so a namespace
+    evicted from memory or reopened after a restart is not re-embedded; namespaces whose session
+    ended without an unload are removed by `sweep_namespaces`. Writes to a namespace are serialized; searches of that namespace wait
+    only while new vectors are being inserted, not while they are being embedded.
     """
 
-    def __init__(self, model="text-embedding-ada-002"):
+    def __init__(self, model="text-embedding-ada-002", embeddings=None, max_workers=4, max_namespaces=256,
+                 persist_dir=None, index_type="auto", hnsw_threshold=10000, ivfpq_threshold=200000,
+                 ivfpq_train_size=10000):
         """
         Initialize the VectorDBConnector with a specified embedding model.
 
         Args:
             model (str): The name of the embedding model to use. Defaults to "text-embedding-ada-002".
+            embeddings (Embeddings): An embeddings object to use instead of the default batched OpenAI embeddings.
+            max_workers (int): The number of concurrent embedding requests for the default embeddings. Defaults to 4.
+            max_namespaces (int): The number of namespaces kept in memory; the least recently
+                written one is dropped beyond that (and reloaded from disk when persisted). Defaults to 256.
+            persist_dir (str): The directory to save the indexes to. Defaults to None (memory only).
+            index_type (str): "flat", "hnsw", "ivfpq", or "auto" to choose by corpus size. Defaults to "auto".
+            hnsw_threshold (int): The number of chunks from which "auto" uses HNSW. Defaults to 10000.
+            ivfpq_threshold (int): The number of chunks from which "auto" uses IVF-PQ. Defaults to 200000.
+            ivfpq_train_size (int): The number of chunks a namespace collects in a flat index before
+                an IVF-PQ index is trained on all of them. Defaults to 10000.
         """
         self.model = model
+        self.max_namespaces = max_namespaces
+        self.persist_dir = persist_dir
+        self.index_type = index_type
+        self.hnsw_threshold = hnsw_threshold
+        self.ivfpq_threshold = ivfpq_threshold
+        self.ivfpq_train_size = ivfpq_train_size
+        self.stores = OrderedDict()
+        self.write_lock = threading.Lock()
+        self.namespace_locks = {}
+        self.last_used = {}
+        # Bumped by remove_namespace, so an upload that started before the removal does not recreate the store
+        self.generations = {}
+
+        # Embed chunks in budgeted batches with several requests in flight; ConcurrentEmbeddings
+        # does the retrying, so the client itself does not retry as well
+        self.embeddings = embeddings or ConcurrentEmbeddings(
+            OpenAIEmbeddings(model=self.model, max_retries=0), max_workers=max_workers
+        )
+
+    def _choose_index_type(self, n):
+        index_type = self.index_type
+        if index_type == "auto":
+            index_type = "ivfpq" if n >= self.ivfpq_threshold else "hnsw" if n >= self.hnsw_threshold else "flat"
+        if index_type == "ivfpq" and n < max(256, self.ivfpq_train_size):
+            # 8-bit PQ needs at least 256 training vectors, and codebooks trained on the first file
+            # alone would fit later files poorly: keep the vectors exact until enough are collected,
+            # then the flat index is rebuilt as IVF-PQ trained on all of them
+            return "flat"
+        return index_type
+
+    @staticmethod
+    def _new_index(index_type, vectors):
+        """
+        Create an empty FAISS index of the given type, trained on the vectors if it needs training.
+        """
+        dim = vectors.shape[1]
+        if index_type == "flat":
+            return faiss.IndexFlatL2(dim)
+        if index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, 32)
+            index.hnsw.efSearch = 64
+            return index
+        if index_type == "ivfpq":
+            # Training needs about 39 vectors per list; IVF-PQ is meant for corpora of tens of thousands of chunks
+            nlist = max(1, min(int(4 * math.sqrt(len(vectors))), len(vectors) // 39))
+            # 8-bit codes over subvectors of about 16 dimensions (one subvector below 16 dimensions)
+            m = max(d for d in range(1, max(1, dim // 16) + 1) if dim % d == 0)
+            index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, m, 8)
+            index.train(vectors)
+            index.nprobe = 16
+            return index
+        raise ValueError(f"unknown index type {index_type!r}")
 
-    def add_file(self, file_path):
+    def _build(self, index_type, documents, vectors):
+        db = FAISS(
+            embedding_function=self.embeddings,
+            index=self._new_index(index_type, vectors),
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+        )
+        db.add_embeddings(
+            list(zip([doc.page_content for doc in documents], vectors)),
+            metadatas=[doc.metadata for doc in documents],
+        )
+        return db
+
+    def _namespace_dir(self, namespace):
+        name = "default" if namespace is None else re.sub(r"[^A-Za-z0-9_-]", "_", str(namespace))
+        return os.path.join(self.persist_dir, name)
+
+    def _namespace_lock(self, namespace):
+        with self.write_lock:
+            return self.namespace_locks.setdefault(namespace, threading.RLock())
+
+    def _remember(self, namespace, store):
+        with self.write_lock:
+            self.stores[namespace] = store
+            self.stores.move_to_end(namespace)
+            while len(self.stores) > self.max_namespaces:
+                self.stores.popitem(last=False)
+
+    def _get_store(self, namespace):
         """
-        Load a PDF file, split its content into manageable chunks, and store the embeddings in a FAISS vector database.
+        Return the store of a namespace, loading it from the persist directory if needed.
+        """
+        self.last_used[namespace] = time.time()
+        store = self.stores.get(namespace)
+        if store is not None or self.persist_dir is None:
+            return store
+        path = self._namespace_dir(namespace)
+        if not os.path.exists(path):
+            return None
+        with self._namespace_lock(namespace):
+            store = self.stores.get(namespace)
+            if store is None:
+                # The index was written by save_local of this class, so its docstore is trusted
+                db = FAISS.load_local(path, self.embeddings, allow_dangerous_deserialization=True)
+                with open(os.path.join(path, "index_type"), encoding="utf-8") as f:
+                    index_type = f.read().strip()
+                store = _NamespaceStore(db, index_type)
+                self._remember(namespace, store)
+        return store
+
+    def _save(self, namespace, store):
+        """
+        Save a namespace's index, writing to a temporary directory first so a crash never leaves a partial index.
+        """
+        path = self._namespace_dir(namespace)
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        store.db.save_local(tmp)
+        with open(os.path.join(tmp, "index_type"), "w", encoding="utf-8") as f:
+            f.write(store.index_type)
+        old = path + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def add_file(self, file_path, namespace=None):
+        """
+        Load a PDF file, split its content into manageable chunks, and add their embeddings to the namespace's FAISS index.
 
         Args:
             file_path (str): The path to the PDF file to be processed.
+            namespace (str): The namespace (e.g. a user session) the document belongs to.
+
+        Returns:
+            int: The number of chunks added, 0 if the same file was already in the namespace or the
+                namespace was removed while the file was being embedded.
         """
-        self.file_path = file_path
+        with tracer.span("add_file") as span:
+            added = self._add_file(file_path, namespace)
+            span.set(chunks=added)
+            return added
+
+    def _add_file(self, file_path, namespace):
+        generation = self.generations.get(namespace, 0)
+        file_hash = file_sha256(file_path)
+        store = self._get_store(namespace)
+        if store is not None and file_hash in store.files:
+            return 0
 
         # Load and split the PDF document into pages
-        loader = PyMuPDFLoader(self.file_path)
+        loader = PyMuPDFLoader(file_path)
         pages = loader.load_and_split()
 
         # Split the text content of the pages into smaller chunks
@@ -39,21 +273,127 @@ class VectorDBConnector:
         )
 
         texts = text_splitter.create_documents(
-            [page.page_content for page in pages]
+            [page.page_content for page in pages],
+            metadatas=[dict(page.metadata, file_hash=file_hash) for page in pages],
         )
+        if not texts:
+            return 0
+
+        # Embed outside the locks so uploads overlap with each other and with searches
+        vectors = np.asarray(self.embeddings.embed_documents([t.page_content for t in texts]), dtype=np.float32)
 
-        # Embed the text chunks and store them in a FAISS vector database
-        embeddings = OpenAIEmbeddings(model=self.model)
-        self.db = FAISS.from_documents(texts, embeddings)
+        with self._namespace_lock(namespace), tracer.span("index_write", chunks=len(texts)):
+            if self.generations.get(namespace, 0) != generation:
+                # The session ended during the upload; writing now would bring its store back
+                return 0
+            store = self._get_store(namespace) if store is None else store
+            if store is not None and file_hash in store.files:
+                return 0
+            total = len(texts) + (store.db.index.ntotal if store is not None else 0)
+            index_type = self._choose_index_type(total)
+
+            if store is None:
+                store = _NamespaceStore(self._build(index_type, texts, vectors), index_type)
+            elif index_type != store.index_type and store.index_type != "ivfpq":
+                # The corpus outgrew the index type: rebuild once from the stored vectors
+                # (exact for flat and HNSW), without re-embedding anything
+                old = store.db.index
+                documents = store.documents + texts
+                all_vectors = np.vstack([old.reconstruct_n(0, old.ntotal), vectors])
+                store = _NamespaceStore(self._build(index_type, documents, all_vectors), index_type)
+            else:
+                with store.lock:
+                    store.add(texts, vectors)
+
+            self._remember(namespace, store)
+            if self.persist_dir is not None:
+                self._save(namespace, store)
+        return len(texts)
+
+    def has_documents(self, namespace=None):
+        """
+        Check whether a file has been uploaded to the namespace.
+
+        Args:
+            namespace (str): The namespace to check.
+
+        Returns:
+            bool: True if the namespace has a vector store.
+        """
+        return self._get_store(namespace) is not None
+
+    def remove_namespace(self, namespace):
+        """
+        Drop the vector store of a namespace, in memory and on disk, e.g. when its session ends.
+
+        Waits for a write to the namespace in progress; an upload still being embedded is discarded.
+        The namespace's lock is kept, so a later upload serializes with any upload that already holds it.
+
+        Args:
+            namespace (str): The namespace to remove.
+        """
+        with self._namespace_lock(namespace):
+            with self.write_lock:
+                self.generations[namespace] = self.generations.get(namespace, 0) + 1
+                self.stores.pop(namespace, None)
+                self.last_used.pop(namespace, None)
+            if self.persist_dir is not None:
+                shutil.rmtree(self._namespace_dir(namespace), ignore_errors=True)
+
+    def sweep_namespaces(self, ttl):
+        """
+        Remove the namespaces not used for `ttl` seconds, in memory and on disk.
+
+        A session that ends without an unload (a crashed browser or a restarted server) would
+        otherwise leave its index in the persist directory forever. Directories of namespaces
+        not used since this process started count from their last save.
+
+        Args:
+            ttl (float): The seconds a namespace is kept after its last use.
+
+        Returns:
+            int: The number of namespaces removed.
+        """
+        cutoff = time.time() - ttl
+        with self.write_lock:
+            stale = [ns for ns, used in self.last_used.items() if ns is not None and used < cutoff]
+            recent = {self._namespace_dir(ns) for ns, used in self.last_used.items() if used >= cutoff} \
+                if self.persist_dir is not None else set()
+        for namespace in stale:
+            self.remove_namespace(namespace)
+        removed = len(stale)
+        if self.persist_dir is None or not os.path.isdir(self.persist_dir):
+            return removed
+        for name in os.listdir(self.persist_dir):
+            path = os.path.join(self.persist_dir, name)
+            # Skip the shared namespace and the temporary directories of a save in progress
+            if name == "default" or name.endswith((".tmp", ".old")) or path in recent:
+                continue
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
 
-    def get_retriever(self, k=2):
+    def get_retriever(self, k=2, namespace=None, mode="hybrid", candidates=None):
         """
-        Get a retriever object to query the vector database for the top-k most similar documents.
+        Get a retriever object to query the vector database for the top-k most relevant documents.
 
         Args:
-            k (int): The number of top similar documents to retrieve. Defaults to 2.
+            k (int): The number of top documents to retrieve. Defaults to 2.
+            namespace (str): The namespace to search in.
+            mode (str): "dense" for vector similarity, "keyword" for BM25, or "hybrid" to fuse both
+                rankings with reciprocal rank fusion. Defaults to "hybrid".
+            candidates (int): The number of candidates each retriever contributes in hybrid mode.
+                Defaults to 4 * k.
 
         Returns:
-            object: A retriever object to perform similarity searches.
+            object: A retriever object to perform the search, or None if nothing was uploaded to the namespace.
         """
-        return self.db.as_retriever(search_kwargs={"k": k})
+        if mode not in ("dense", "keyword", "hybrid"):
+            raise ValueError(f"unknown retrieval mode {mode!r}")
+        store = self._get_store(namespace)
+        if store is None:
+            return None
+        # Exact terms such as model names, numbers and section titles are often missed by
+        # dense retrieval alone, so hybrid mode adds BM25 candidates
+        return _GuardedRetriever(store=store, k=k, mode=mode, candidates=candidates or k * 4)
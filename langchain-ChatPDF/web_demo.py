@@ -1,22 +1,70 @@
+import os
+import threading
+
 import gradio as gr
 from vector_db_utils import VectorDBConnector
+from embedding_utils import LocalBGEEmbeddings
 from llm_utils import LLMUtils
+from chatpdf_shared import TranscriptRenderer, configure_from_env, serve_metrics, tracer
 
 # Load environment variables
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv())
 
-# Initialize VectorDBConnector instance
-vector_db = VectorDBConnector()
-file_uploaded = False
+# Per-stage tracing: TRACING=1 records spans, TRACE_FILE appends them as JSON lines,
+# and METRICS_PORT serves the aggregated metrics in the Prometheus format at /metrics
+configure_from_env()
+if os.getenv("METRICS_PORT"):
+    serve_metrics(int(os.getenv("METRICS_PORT")))
+
+# Initialize VectorDBConnector instance, shared by all sessions with one namespace per session.
+# Indexes are saved to disk, so a namespace evicted from memory is reloaded rather than re-embedded.
+# A new session starts empty, and the indexes of sessions gone for NAMESPACE_TTL seconds (a day by default)
+# are removed at startup and every 10 minutes.
+if os.getenv("LOCAL_EMBEDDING_MODEL"):
+    # Offline embeddings (e.g. BAAI/bge-large-zh-v1.5) kept warm across requests; the vectors
+    # have another dimension than OpenAI's, so their indexes live in a separate directory
+    local_embeddings = LocalBGEEmbeddings(
+        os.getenv("LOCAL_EMBEDDING_MODEL"),
+        backend=os.getenv("EMBEDDING_BACKEND", "torch"),
+        quantize=os.getenv("EMBEDDING_QUANTIZE") == "1",
+    )
+    local_embeddings.warmup()
+    vector_db = VectorDBConnector(embeddings=local_embeddings, persist_dir="faiss_index_local")
+else:
+    vector_db = VectorDBConnector(persist_dir="faiss_index")
+
+NAMESPACE_TTL = float(os.getenv("NAMESPACE_TTL", 24 * 3600))
+
+
+def sweep_namespaces(interval=600):
+    """
+    Remove the namespaces of ended sessions now and then every `interval` seconds.
+    """
+    vector_db.sweep_namespaces(NAMESPACE_TTL)
+    timer = threading.Timer(interval, sweep_namespaces, args=(interval,))
+    timer.daemon = True
+    timer.start()
+
 
-def handle_file_upload(file, chat_history):
+sweep_namespaces()
+
+# Long-lived model clients and chains shared by all queries
+llm = LLMUtils()
+
+# Concurrency limits: parallel uploads, parallel queries (bounded by the LLM client) and queued requests
+UPLOAD_CONCURRENCY = 2
+QUERY_CONCURRENCY = llm.max_concurrency
+QUEUE_SIZE = 64
+
+def handle_file_upload(file, chat_history, request: gr.Request):
     """
     Handle the file upload and update the vector database.
 
     Args:
         file: The uploaded file.
         chat_history: The chat history.
+        request: The Gradio request, whose session hash is used as the document namespace.
 
     Returns:
         Updated chat history and empty text fragments.
@@ -25,64 +73,86 @@ def handle_file_upload(file, chat_history):
         chat_history = [("Assistant", "请先选择文件。")]
         return chat_history, ""
     
-    # Add the file to the vector database
-    vector_db.add_file(file.name)
-    global file_uploaded 
-    file_uploaded = True
+    # Add the file to the vector database, visible to the current session only.
+    # Only the new file is embedded; a file already uploaded in this session is skipped.
+    if vector_db.add_file(file.name, namespace=request.session_hash) == 0:
+        chat_history = [("Assistant", "文件已导入过，可直接提问。")]
+        return chat_history, ""
 
     chat_history = [("Assistant", "文件已上传并处理成功。")]
     return chat_history, ""
 
-def handle_query(query, chat_history, selected_llm):
+def handle_query(query, chat_history, selected_llm, request: gr.Request):
     """
-    Handle the user query by retrieving relevant documents and invoking the language model.
+    Handle the user query by retrieving relevant documents and streaming the language model response.
 
     Args:
         query: The user query.
         chat_history: The chat history.
         selected_llm: The selected language model.
+        request: The Gradio request, whose session hash selects the document namespace.
 
-    Returns:
-        Updated chat history and relevant text fragments.
+    Yields:
+        Updated chat history and relevant text fragments, once per received chunk.
     """
-    if file_uploaded == False:
+    if not vector_db.has_documents(request.session_hash):
         chat_history = [("Assistant", "请先上传文件。")]        
-        return chat_history, ""
+        yield chat_history, ""
+        return
     
     if query.strip() == "":
         chat_history = [("Assistant", "请输入问题。")]        
-        return chat_history, ""    
-    
-    # Get the retriever object
-    retriever = vector_db.get_retriever()
-    
-    # Initialize the LLMUtils with the selected model
-    llm = LLMUtils(selected_llm)
+        yield chat_history, ""
+        return
     
-    # Invoke the language model with the query and retriever
-    response, ref_texts = llm.invoke(query, retriever)
+    # One trace per query; it is made current only around the retrieval, never across a yield
+    trace = tracer.start("query", model=selected_llm)
+    try:
+        with tracer.activate(trace):
+            # Get the retriever object
+            retriever = vector_db.get_retriever(namespace=request.session_hash)
+
+            # Retrieve the context once and show it together with the question
+            ref_texts = llm.retrieve(query, retriever)
+        chat_history = chat_history + [("User", query)]
+        yield chat_history, ref_texts
+
+        # Stream the answer into the chat history as it arrives
+        response = ""
+        for chunk in llm.invoke_stream(query, model_name=selected_llm, relevant_texts=ref_texts,
+                                       trace=trace or None):
+            response += chunk
+            yield chat_history + [("Assistant", f"{selected_llm}: {response}\n")], ref_texts
+    except Exception as e:
+        trace.end(e)
+        raise
+    finally:
+        trace.end()
+
+def handle_unload(request: gr.Request):
+    """
+    Drop the documents of a session once it ends.
+
+    Args:
+        request: The Gradio request of the closing session.
+    """
+    vector_db.remove_namespace(request.session_hash)
 
-    chat_history.append(("User", query))
-    chat_history.append(("Assistant", f"{selected_llm}: {response}\n"))    
-    return chat_history, ref_texts
+# Shared renderer for the chat history, showing the last 50 turns per page
+transcript = TranscriptRenderer(max_turns=50)
 
-def format_chat(chat_history):
+def format_chat(chat_history, pages=1):
     """
     Format the chat history for display.
 
     Args:
         chat_history: The chat history.
+        pages: How many pages of 50 turns to show; older turns are folded into a one-line notice.
 
     Returns:
-        Formatted HTML string of the chat history.
+        Formatted HTML string of the most recent turns, with the text escaped.
     """
-    formatted_chat = "<div><strong>对话历史</strong></div>"
-    for speaker, text in chat_history:
-        if speaker == "User":
-            formatted_chat += f'<div style="text-align: right; margin: 10px;"><span style="background-color: #daf7a6; padding: 5px; border-radius: 5px;">{text}</span></div>'
-        else:
-            formatted_chat += f'<div style="text-align: left; margin: 10px;"><span style="background-color: #ffcccc; padding: 5px; border-radius: 5px;">{text}</span></div>'
-    return formatted_chat
+    return transcript.render(chat_history, pages)
 
 # Define the Gradio interface
 with gr.Blocks() as demo:
@@ -94,6 +164,7 @@ with gr.Blocks() as demo:
 
         with gr.Column(scale=1):
             chat_history = gr.State([])            
+            shown_pages = gr.State(1)
             upload = gr.File(label="上传PDF文件")
             upload_button = gr.Button("上传")
             query = gr.Textbox(label="输入问题", placeholder="请输入您的问题...")
@@ -111,13 +182,21 @@ with gr.Blocks() as demo:
             ref_texts = gr.Textbox(label="相关文档片段", elem_id="ref_texts", interactive=False)
             
             # Define the click actions for the buttons
-            upload_button.click(handle_file_upload, inputs=[upload, chat_history], outputs=[chat_history, ref_texts])
-            query_button.click(handle_query, inputs=[query, chat_history, radio], outputs=[chat_history, ref_texts])
-            clear_button.click(lambda: ([], ""), inputs=None, outputs=[chat_history, ref_texts])
+            # Uploads are CPU and embedding heavy, queries mostly wait on the LLM
+            upload_button.click(handle_file_upload, inputs=[upload, chat_history], outputs=[chat_history, ref_texts],
+                                concurrency_limit=UPLOAD_CONCURRENCY, concurrency_id="upload")
+            query_button.click(handle_query, inputs=[query, chat_history, radio], outputs=[chat_history, ref_texts],
+                               concurrency_limit=QUERY_CONCURRENCY, concurrency_id="query")
+            clear_button.click(lambda: ([], "", 1), inputs=None, outputs=[chat_history, ref_texts, shown_pages])
+            # Page in turns folded out of the display
+            older_button = gr.Button("显示更早的消息")
+            older_button.click(lambda pages: pages + 1, inputs=shown_pages, outputs=shown_pages)
 
     # Load and update the chat display
     demo.load(lambda: format_chat([]), inputs=None, outputs=chat_display)
-    chat_history.change(fn=format_chat, inputs=chat_history, outputs=chat_display)
+    chat_history.change(fn=format_chat, inputs=[chat_history, shown_pages], outputs=chat_display)
+    shown_pages.change(fn=format_chat, inputs=[chat_history, shown_pages], outputs=chat_display)
+    demo.unload(handle_unload)
 
 # Launch the Gradio app
-demo.queue().launch(share=False, server_name='0.0.0.0', server_port=7860, inbrowser=True)
+demo.queue(default_concurrency_limit=QUERY_CONCURRENCY, max_size=QUEUE_SIZE).launch(share=False, server_name='0.0.0.0', server_port=7860, inbrowser=True)